@@ -0,0 +1,90 @@
+"""
+Benchmarks masked word prediction fine-tuning on the CPU with a small,
+randomly initialized BERT, from a text file to trained weights, through
+FinetuneMlm.train().
+
+Each setting trains on the same corpus and reports the training
+throughput and the share of the loop spent waiting for batches, from the
+telemetry records of the run.
+
+Run with: python benchmarks/mlm_cpu_finetune.py
+"""
+
+import logging
+import os
+import random
+import tempfile
+
+import torch
+from transformers import BertConfig, BertForMaskedLM, BertTokenizer
+
+from happytransformer.mlm_utils import FinetuneMlm, word_prediction_args
+
+VOCAB_SIZE = 2000
+NUM_LINES = 2000
+
+SETTINGS = [
+    # name, changes to word_prediction_args
+    ("padded lines", {"packed": False, "num_workers": 0}),
+    ("packed", {"num_workers": 0}),
+    ("packed, 2 workers", {"num_workers": 2}),
+    ("packed, 2 workers, accumulation 2", {"num_workers": 2, "batch_size": 4, "gradient_accumulation_steps": 2}),
+    ("packed, 2 workers, bf16", {"num_workers": 2, "bf16": True}),
+    ("packed, 2 workers, whole words", {"num_workers": 2, "whole_word_mask": True}),
+]
+
+
+def write_corpus(directory):
+    """
+    :return: the paths of a vocabulary and of a text file of random lines
+    """
+    words = ["w{}".format(word) for word in range(VOCAB_SIZE // 2)]
+    pieces = ["##p{}".format(piece) for piece in range(VOCAB_SIZE - len(words) - 5)]
+    vocab_path = os.path.join(directory, "vocab.txt")
+    with open(vocab_path, "w") as vocab_file:
+        vocab_file.write("\n".join(["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]"] + words + pieces))
+    generator = random.Random(0)
+    text_path = os.path.join(directory, "train.txt")
+    with open(text_path, "w") as text_file:
+        for _ in range(NUM_LINES):
+            length = int(generator.expovariate(1 / 20)) + 1
+            text_file.write(" ".join(generator.choice(words) + generator.choice(["", "p1", "p2"])
+                                     for _ in range(length)) + "\n")
+    return vocab_path, text_path
+
+
+def run(tokenizer, text_path, cache_dir, changes):
+    """
+    :return: the sum of the telemetry records of one epoch of training
+    """
+    torch.manual_seed(0)
+    config = BertConfig(vocab_size=len(tokenizer), hidden_size=128, num_hidden_layers=2,
+                        num_attention_heads=2, intermediate_size=512)
+    args = {**word_prediction_args, "batch_size": 8, "block_size": 128,
+            "feature_cache_dir": cache_dir, **changes}
+    records = []
+    trainer = FinetuneMlm(BertForMaskedLM(config), args, tokenizer, logging.getLogger(__name__),
+                          callbacks=[records.append], device="cpu")
+    trainer.train(text_path)
+    return {
+        name: sum(record[name] for record in records)
+        for name in ("examples", "tokens", "seconds", "data_wait_seconds")
+    }
+
+
+def main():
+    with tempfile.TemporaryDirectory() as directory:
+        vocab_path, text_path = write_corpus(directory)
+        tokenizer = BertTokenizer(vocab_path)
+        cache_dir = os.path.join(directory, "cache")
+        print("{:40s} {:>9s} {:>9s} {:>12s} {:>10s}".format(
+            "setting", "examples", "tokens", "tokens / s", "data wait"))
+        for name, changes in SETTINGS:
+            totals = run(tokenizer, text_path, cache_dir, changes)
+            print("{:40s} {:9d} {:9d} {:12.0f} {:9.1%}".format(
+                name, totals["examples"], totals["tokens"], totals["tokens"] / totals["seconds"],
+                totals["data_wait_seconds"] / totals["seconds"]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+"""
+Benchmarks the exact top_k_spans search against the greedy
+biggest_sums walk used by qa_logits.
+
+Run with: python benchmarks/qa_span_search.py
+"""
+
+import time
+import torch
+
+from happytransformer.qa_util import qa_logits, top_k_spans
+
+
+def time_function(function, repeats=5):
+    """
+    :return: best wall clock time of the given function, in milliseconds
+    """
+    best = float('inf')
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+
+def greedy_top_k(start_logits, end_logits, k):
+    """
+    top k spans for each example with the greedy qa_logits generator
+    """
+    return [
+        [answer for answer, _ in zip(qa_logits(starts, ends), range(k))]
+        for starts, ends in zip(start_logits, end_logits)
+    ]
+
+
+def exact_recall(start_logits, end_logits, k):
+    """
+    fraction of the exact top k spans that the greedy walk also finds
+    """
+    _, starts, ends = top_k_spans(start_logits, end_logits, k)
+    greedy = greedy_top_k(start_logits, end_logits, k)
+    found = 0
+    for row, answers in enumerate(greedy):
+        greedy_spans = {(answer.start_idx, answer.end_idx) for answer in answers}
+        exact_spans = set(zip(starts[row].tolist(), ends[row].tolist()))
+        found += len(greedy_spans & exact_spans)
+    return found / (k * len(greedy))
+
+
+def main():
+    torch.manual_seed(0)
+    print("batch  length     k   greedy ms   exact ms   greedy recall")
+    for batch_size, length, k in [(1, 128, 3), (1, 384, 20), (16, 384, 20), (32, 384, 100)]:
+        start_logits = torch.randn(batch_size, length)
+        end_logits = torch.randn(batch_size, length)
+        greedy_ms = time_function(lambda: greedy_top_k(start_logits, end_logits, k))
+        exact_ms = time_function(lambda: top_k_spans(start_logits, end_logits, k, max_answer_length=30))
+        recall = exact_recall(start_logits, end_logits, k)
+        print(f"{batch_size:5d} {length:7d} {k:5d} {greedy_ms:11.2f} {exact_ms:10.2f} {recall:15.2f}")
+
+
+if __name__ == "__main__":
+    main()
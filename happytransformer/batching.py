@@ -0,0 +1,233 @@
+"""
+Samplers and collate functions that batch variable length examples with as
+little padding as possible.
+"""
+
+import random
+import sys
+import time
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+import torch
+from torch.utils.data import Sampler
+
+
+class LengthGroupedSampler(Sampler):
+    """
+    Batch sampler that groups examples of similar length together so that
+    each batch only needs to be padded to a length close to its examples.
+
+    When shuffle is True the examples are shuffled, split into buckets of
+    batch_size * bucket_batches examples, sorted by length within each
+    bucket and the order of the resulting batches is shuffled. This keeps
+    training batches random while still cutting most of the padding.
+    When shuffle is False every example is sorted by length, which gives
+    the least padding for evaluation and inference.
+
+    With max_tokens, batches hold as many examples as fit in max_tokens
+    padded tokens, the number of examples times the longest example,
+    instead of batch_size examples, so that short texts are batched in
+    larger numbers and every batch takes about the same memory and
+    compute. The batches are then cut once from every example sorted by
+    length, and shuffling only changes their order, so that the number
+    of batches is known before an epoch starts.
+
+    For distributed training, every replica draws the same batches from
+    seed and the current epoch, see set_epoch(), and keeps every
+    num_replicas-th batch. Batches are repeated so that each replica gets
+    the same number of them.
+
+    :param lengths: list with the number of tokens of each example
+    :param batch_size: number of examples in each batch
+    :param shuffle: True for training, False for evaluation and inference
+    :param bucket_batches: number of batches sorted together when shuffling
+    :param num_replicas: number of distributed processes
+    :param rank: the rank of this process
+    :param seed: seed shared by the replicas
+    :param first_index: examples before it are skipped, to resume inference
+    :param sorted_bucket_size: when shuffle is False, sort the examples by
+           length within buckets of this many examples instead of all
+           together, so that the batches go through the data in order
+    :param max_tokens: maximum padded tokens per batch, or None for
+           batches of batch_size examples. Longer examples get a batch of
+           their own
+    """
+
+    def __init__(self, lengths, batch_size, shuffle=True, bucket_batches=50,
+                 num_replicas=1, rank=0, seed=0, first_index=0, sorted_bucket_size=None,
+                 max_tokens=None):
+        self.lengths = lengths
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.bucket_batches = bucket_batches
+        self.num_replicas = num_replicas
+        self.rank = rank
+        self.seed = seed
+        self.first_index = first_index
+        self.sorted_bucket_size = sorted_bucket_size
+        self.max_tokens = max_tokens
+        self.token_batches = None
+        self.epoch = 0
+
+    def set_epoch(self, epoch):
+        """
+        Sets the epoch that distributed replicas draw their batches for
+        """
+        self.epoch = epoch
+
+    def __iter__(self):
+        # a single process uses the global generator so that its state
+        # decides, and checkpoints can restore, the order of the batches
+        rng = random if self.num_replicas == 1 else random.Random(self.seed + self.epoch)
+        if self.max_tokens:
+            batches = list(self.__token_batches())
+        else:
+            indices = list(range(self.first_index, len(self.lengths)))
+            if self.shuffle:
+                rng.shuffle(indices)
+                bucket_size = self.batch_size * self.bucket_batches
+            else:
+                bucket_size = self.sorted_bucket_size or len(indices)
+            batches = []
+            for bucket_start in range(0, len(indices), max(bucket_size, 1)):
+                bucket = self.__sorted(indices[bucket_start:bucket_start + bucket_size])
+                batches.extend(
+                    bucket[batch_start:batch_start + self.batch_size]
+                    for batch_start in range(0, len(bucket), self.batch_size)
+                )
+        if self.shuffle:
+            rng.shuffle(batches)
+        if self.num_replicas > 1:
+            padded_length = len(self) * self.num_replicas
+            batches = (batches * self.num_replicas)[:padded_length] if batches else []
+            batches = batches[self.rank::self.num_replicas]
+        return iter(batches)
+
+    def __sorted(self, indices):
+        return sorted(indices, key=lambda index: self.lengths[index], reverse=True)
+
+    def __token_batches(self):
+        """
+        :return: the batches of at most self.max_tokens padded tokens, in
+                 sorted order. They are only cut once
+        """
+        if self.token_batches is not None:
+            return self.token_batches
+        indices = list(range(self.first_index, len(self.lengths)))
+        bucket_size = len(indices) if self.shuffle else self.sorted_bucket_size or len(indices)
+        self.token_batches = []
+        for bucket_start in range(0, len(indices), max(bucket_size, 1)):
+            batch = []
+            for index in self.__sorted(indices[bucket_start:bucket_start + bucket_size]):
+                # examples are sorted from the longest, so the first one
+                # decides the padded length of the batch
+                if batch and (len(batch) + 1) * max(self.lengths[batch[0]], 1) > self.max_tokens:
+                    self.token_batches.append(batch)
+                    batch = []
+                batch.append(index)
+            if batch:
+                self.token_batches.append(batch)
+        return self.token_batches
+
+    def __len__(self):
+        if self.max_tokens:
+            num_batches = len(self.__token_batches())
+        else:
+            num_batches = (len(self.lengths) - self.first_index + self.batch_size - 1) // self.batch_size
+        return (num_batches + self.num_replicas - 1) // self.num_replicas
+
+
+class PaddingCollator():
+    """
+    collate_fn that pads a list of (index, input_ids, segment_ids, label)
+    examples to the longest example in the batch.
+
+    :return: a tuple of tensors (input_ids, attention_mask, token_type_ids,
+             labels, indices), where indices are the dataset positions of
+             the examples in the batch
+    """
+
+    def __init__(self, pad_token=0, pad_token_segment_id=0, pad_on_left=False):
+        self.pad_token = pad_token
+        self.pad_token_segment_id = pad_token_segment_id
+        self.pad_on_left = pad_on_left
+
+    def __call__(self, examples):
+        max_length = max(len(input_ids) for _, input_ids, _, _ in examples)
+        input_ids = torch.full((len(examples), max_length), self.pad_token, dtype=torch.long)
+        attention_mask = torch.zeros((len(examples), max_length), dtype=torch.long)
+        token_type_ids = torch.full((len(examples), max_length), self.pad_token_segment_id, dtype=torch.long)
+        for row, (_, example_ids, example_segment_ids, _) in enumerate(examples):
+            if self.pad_on_left:
+                columns = slice(max_length - len(example_ids), max_length)
+            else:
+                columns = slice(0, len(example_ids))
+            input_ids[row, columns] = torch.as_tensor(example_ids, dtype=torch.long)
+            attention_mask[row, columns] = 1
+            token_type_ids[row, columns] = torch.as_tensor(example_segment_ids, dtype=torch.long)
+        labels = torch.tensor([label for _, _, _, label in examples], dtype=torch.long)
+        indices = torch.tensor([index for index, _, _, _ in examples], dtype=torch.long)
+        return input_ids, attention_mask, token_type_ids, labels, indices
+
+
+def peak_memory_mb(device=None):
+    """
+    :param device: a torch device. For cuda devices, the peak memory
+                   allocated by torch since the last
+                   torch.cuda.reset_peak_memory_stats() call
+    :return: the peak memory use in MB. For other devices, the peak resident
+             memory of this process, or None if it can't be measured
+    """
+    if device is not None and torch.device(device).type == 'cuda':
+        return torch.cuda.max_memory_allocated(device) / 2 ** 20
+    if resource is None:
+        return None
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return max_rss / (2 ** 20 if sys.platform == 'darwin' else 2 ** 10)
+
+
+class BatchStats():
+    """
+    Keeps track of how many real and padded tokens went through the model,
+    how long it took and the peak memory use.
+
+    :param device: the torch device the model runs on
+    """
+
+    def __init__(self, device=None):
+        self.examples = 0
+        self.real_tokens = 0
+        self.padded_tokens = 0
+        self.device = device
+        if device is not None and torch.device(device).type == 'cuda':
+            torch.cuda.reset_peak_memory_stats(device)
+        self.start_time = time.time()
+
+    def update(self, attention_mask):
+        """
+        :param attention_mask: the attention mask of a batch
+        """
+        self.examples += attention_mask.shape[0]
+        self.real_tokens += int(attention_mask.sum())
+        self.padded_tokens += attention_mask.numel()
+
+    def report(self):
+        """
+        :return: a dictionary with the throughput, the padding ratio, which
+                 is the fraction of the tokens sent to the model that were
+                 padding, and the peak memory use, see peak_memory_mb()
+        """
+        seconds = max(time.time() - self.start_time, 1e-9)
+        return {
+            "examples": self.examples,
+            "seconds": seconds,
+            "examples_per_second": self.examples / seconds,
+            "tokens_per_second": self.real_tokens / seconds,
+            "padding_ratio": 1 - self.real_tokens / max(self.padded_tokens, 1),
+            "peak_memory_mb": peak_memory_mb(self.device)
+        }
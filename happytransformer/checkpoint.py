@@ -0,0 +1,180 @@
+"""
+Training checkpoints that are written in a background thread.
+
+A checkpoint holds the model, optimizer and scheduler state, the random
+number generator states and the position of the training loop, so that an
+interrupted run can resume from the batch it stopped at.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+import glob
+import os
+import random
+import re
+
+import numpy as np
+import torch
+
+CHECKPOINT_PATTERN = re.compile(r'checkpoint-(\d+)\.pt$')
+BEST_CHECKPOINT = 'best.pt'
+
+
+def _to_cpu(state):
+    """
+    :return: a copy of state, a nested structure of dictionaries, lists and
+             tensors, with every tensor copied to the CPU
+    """
+    if isinstance(state, torch.Tensor):
+        return state.detach().to('cpu', copy=True)
+    if isinstance(state, dict):
+        return {key: _to_cpu(value) for key, value in state.items()}
+    if isinstance(state, (list, tuple)):
+        return type(state)(_to_cpu(value) for value in state)
+    return state
+
+
+def rng_state():
+    """
+    :return: the states of the python, NumPy and torch random number generators
+    """
+    state = {
+        'python': random.getstate(),
+        'numpy': np.random.get_state(),
+        'torch': torch.get_rng_state(),
+    }
+    if torch.cuda.is_available():
+        state['cuda'] = torch.cuda.get_rng_state_all()
+    return state
+
+
+def set_rng_state(state):
+    """
+    :param state: a state returned by rng_state()
+    """
+    random.setstate(state['python'])
+    np.random.set_state(state['numpy'])
+    torch.set_rng_state(state['torch'])
+    if 'cuda' in state and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all(state['cuda'])
+
+
+def latest_checkpoint(path):
+    """
+    :param path: a checkpoint file, or a directory of checkpoints
+    :return: path if it is a file, otherwise the path of the checkpoint in
+             the directory with the most optimizer steps, or None
+    """
+    if path is None or os.path.isfile(path):
+        return path
+    checkpoints = [
+        (int(CHECKPOINT_PATTERN.search(checkpoint).group(1)), checkpoint)
+        for checkpoint in glob.glob(os.path.join(path, 'checkpoint-*.pt'))
+        if CHECKPOINT_PATTERN.search(checkpoint)
+    ]
+    return max(checkpoints)[1] if checkpoints else None
+
+
+def load_checkpoint(path, model, optimizer=None, scheduler=None):
+    """
+    Restores a checkpoint into a model, optimizer and scheduler
+
+    :param path: a checkpoint file, or a directory to load the latest checkpoint of
+    :return: the training state that was saved with the checkpoint, which
+             includes the random number generator states under "rng"
+    """
+    try:
+        # the random number generator states are not plain tensors
+        checkpoint = torch.load(latest_checkpoint(path), map_location='cpu', weights_only=False)
+    except TypeError:  # torch < 1.13
+        checkpoint = torch.load(latest_checkpoint(path), map_location='cpu')
+    model.load_state_dict(checkpoint['model'])
+    if optimizer is not None:
+        optimizer.load_state_dict(checkpoint['optimizer'])
+    if scheduler is not None:
+        scheduler.load_state_dict(checkpoint['scheduler'])
+    return checkpoint['training_state']
+
+
+class AsyncCheckpointer():
+    """
+    Saves checkpoints to checkpoint_dir/checkpoint-<step>.pt.
+
+    save() copies the states to the CPU, which is fast, and writes them to
+    disk in a background thread while training continues. Only one write
+    runs at a time: a save waits for the previous write to finish. Files are
+    written under a temporary name and renamed, so a crash never leaves a
+    partial checkpoint.
+
+    :param checkpoint_dir: directory the checkpoints are saved in
+    :param keep: number of most recent checkpoints kept, at least 1. None to keep all
+    """
+
+    def __init__(self, checkpoint_dir, keep=2):
+        if keep is not None and keep < 1:
+            raise ValueError("At least one checkpoint must be kept to resume from, not {}".format(keep))
+        self.checkpoint_dir = checkpoint_dir
+        self.keep = keep
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.pending = None
+        os.makedirs(checkpoint_dir, exist_ok=True)
+
+    def save(self, step, model, optimizer, scheduler, training_state):
+        """
+        :param step: number of optimizer steps taken so far
+        :param training_state: a dictionary describing the position of the
+               training loop, saved along with the current rng_state()
+        :return: the path the checkpoint is being written to
+        """
+        checkpoint = _to_cpu({
+            'model': model.state_dict(),
+            'optimizer': optimizer.state_dict(),
+            'scheduler': scheduler.state_dict(),
+            'training_state': {**training_state, 'rng': rng_state()},
+        })
+        path = os.path.join(self.checkpoint_dir, 'checkpoint-{}.pt'.format(step))
+        self.wait()
+        self.pending = self.executor.submit(self.__write, checkpoint, path)
+        return path
+
+    def save_best(self, step, model, metrics):
+        """
+        Saves the model to checkpoint_dir/best.pt, which is kept when older
+        checkpoints are deleted
+        :param step: the training step of the model
+        :param metrics: the evaluation results that made it the best model
+        :return: the path the model is being written to
+        """
+        best = _to_cpu({'model': model.state_dict(), 'step': step, 'metrics': metrics})
+        path = os.path.join(self.checkpoint_dir, BEST_CHECKPOINT)
+        self.wait()
+        self.pending = self.executor.submit(self.__write, best, path)
+        return path
+
+    def wait(self):
+        """
+        Blocks until the last checkpoint is written, and raises its error if
+        writing it failed
+        """
+        if self.pending is not None:
+            pending, self.pending = self.pending, None
+            pending.result()
+
+    def close(self):
+        """
+        Waits for the last checkpoint and stops the background thread
+        """
+        self.wait()
+        self.executor.shutdown()
+
+    def __write(self, checkpoint, path):
+        temporary = path + '.tmp'
+        torch.save(checkpoint, temporary)
+        os.replace(temporary, path)
+        if self.keep is not None:
+            checkpoints = sorted(
+                (int(CHECKPOINT_PATTERN.search(name).group(1)), name)
+                for name in glob.glob(os.path.join(self.checkpoint_dir, 'checkpoint-*.pt'))
+                if CHECKPOINT_PATTERN.search(name)
+            )
+            for _, old_checkpoint in checkpoints[:-self.keep]:
+                os.remove(old_checkpoint)
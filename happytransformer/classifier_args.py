@@ -12,6 +12,28 @@ classifier_args = {
     'warmup_ratio': 0.06,
     'warmup_steps': 0,
     'max_grad_norm': 1.0,
+    'bf16': False,  # Run the model under bfloat16 autocast mixed precision. Faster and uses less memory on CPUs and GPUs that support bfloat16
+    'max_tokens_per_batch': None,  # Size batches by padded tokens, the number of texts times the longest text, instead of batch_size texts, so that every batch takes about the same memory. Batches are grouped by length. Can't be used with streaming
+    'group_by_length': True,  # Batch texts of similar length together so that less padding is needed
+    'streaming': False,  # Read and tokenize the csv files in chunks while training, for data sets that don't fit in memory
+    'stream_chunk_size': 10000,  # Rows read at a time when streaming
+    'shuffle_buffer_size': 10000,  # Examples held in memory to shuffle the training data when streaming
+    'num_workers': 2,  # DataLoader worker processes that tokenize the data when streaming
+    'eval_steps': None,  # Steps between evaluations when training with eval data. None to evaluate after every epoch
+    'early_stopping_metric': 'loss',  # 'loss', 'accuracy', 'precision', 'recall', 'f1' or 'roc_auc'. The loss is minimized, the others are maximized
+    'early_stopping_patience': None,  # Evaluations in a row without improvement before training stops. None to never stop early
+    'load_best_model': True,  # After training with eval data, keep the model with the best early_stopping_metric
+    'checkpoint_dir': None,  # Training checkpoints are saved here, in the background, so that interrupted training can be resumed. None to disable
+    'checkpoint_steps': 500,  # Optimizer steps between checkpoints
+    'checkpoints_to_keep': 2,  # Older checkpoints are deleted. At least 1
+    'resume_from': None,  # A checkpoint file, or a checkpoint_dir to resume from its latest checkpoint
+    'freeze_encoder': False,  # Run the encoder once over the data, cache its features and only train the classification head, which takes seconds. Can't be used with checkpoints, streaming, several processes or distillation
+    'unfrozen_layers': 0,  # With freeze_encoder, also train this many of the top encoder layers. BERT and RoBERTa only
+    'distillation_temperature': 2.0,  # Softens the teacher's and the student's predictions when distilling a classifier
+    'distillation_alpha': 0.5,  # Weight of the teacher's soft targets when distilling. The labels, if there are any, get 1 - distillation_alpha
+    'telemetry_path': None,  # A JSON lines file that the loss, learning rate, throughput, data wait and compute time and peak memory of training, evaluation and testing are appended to. None to disable
+    'telemetry_steps': 1,  # Optimizer steps per training telemetry record
+    'feature_cache_dir': None,  # A directory that tokenized data is saved to and reused from. Entries are never deleted. None to disable
 
     # More modes will become available in future releases
     'task_mode': 'binary',
@@ -0,0 +1,183 @@
+"""
+Readers that load the texts and labels of classifier data from csv,
+Parquet, Arrow, JSON and JSON lines files, pandas DataFrames or lists.
+
+Only the text and label columns are read. Parquet and Arrow files are
+memory-mapped so that the other columns are never loaded, and their texts
+stay in Arrow memory until they are tokenized.
+"""
+
+from collections import namedtuple
+import hashlib
+import os
+
+import numpy as np
+import pandas as pd
+
+ClassifierData = namedtuple('ClassifierData', ['texts', 'labels'])
+
+CSV_EXTENSIONS = ('.csv',)
+PARQUET_EXTENSIONS = ('.parquet', '.pq')
+ARROW_EXTENSIONS = ('.arrow', '.feather', '.ipc')
+JSONL_EXTENSIONS = ('.jsonl', '.ndjson')
+JSON_EXTENSIONS = ('.json',)
+
+
+def is_csv_path(data):
+    """
+    :return: True if data is a path to a csv file
+    """
+    return isinstance(data, str) and os.path.splitext(data)[1].lower() in CSV_EXTENSIONS
+
+
+def classifier_data_hash(classifier_data):
+    """
+    Hashes in-memory data, files are hashed with file_sha256 instead
+    :param classifier_data: ClassifierData
+    :return: a hex hash of the texts and labels
+    """
+    sha256 = hashlib.sha256()
+    for column in classifier_data:
+        for value in column:
+            sha256.update(value.encode())
+            sha256.update(b'\x00')
+        sha256.update(b'\x01')
+    return sha256.hexdigest()
+
+
+def read_classifier_data(data, labelled=True):
+    """
+    :param data: one of
+        - a path to a csv file without a header. The first column is for
+          the labels and the second is for the text. Test files only have
+          the text column
+        - a path to a Parquet (.parquet, .pq), Arrow (.arrow, .feather),
+          JSON lines (.jsonl) or JSON (.json) file. JSON files hold an
+          array of records, or any other layout that pandas.read_json reads
+        - a pandas DataFrame
+        - a (texts, labels) tuple of sequences, or for test data a sequence
+          of texts
+        Files and DataFrames use their "text" and "label" columns, or when
+        there is no "text" column, the same column order as csv files
+    :param labelled: False for test data, which has no labels
+    :return: ClassifierData with the texts as an Arrow array for Parquet
+             and Arrow files, and a NumPy array or list of strings
+             otherwise, see text_list, and the labels as a NumPy array of
+             strings. Test data gets "0" labels
+    """
+    if isinstance(data, str):
+        extension = os.path.splitext(data)[1].lower()
+        if extension in CSV_EXTENSIONS:
+            texts, labels = _read_csv(data, labelled)
+        elif extension in PARQUET_EXTENSIONS:
+            texts, labels = _read_parquet(data, labelled)
+        elif extension in ARROW_EXTENSIONS:
+            texts, labels = _read_arrow(data, labelled)
+        elif extension in JSONL_EXTENSIONS:
+            texts, labels = _frame_columns(pd.read_json(data, lines=True, dtype=False), labelled)
+        elif extension in JSON_EXTENSIONS:
+            texts, labels = _frame_columns(pd.read_json(data, dtype=False), labelled)
+        else:
+            raise ValueError("Unsupported file type: " + data)
+    else:
+        texts, labels = _in_memory_columns(data, labelled)
+
+    if labelled:
+        labels = np.asarray(labels).astype(np.int64).astype(str)
+    else:
+        labels = np.full(len(texts), "0")
+    return ClassifierData(texts, labels)
+
+
+def text_list(texts):
+    """
+    :param texts: the texts of ClassifierData, or a slice of them
+    :return: the texts as a list of strings, which tokenizers accept
+    """
+    if hasattr(texts, 'to_pylist'):
+        return texts.to_pylist()
+    return list(texts)
+
+
+def _column_names(columns, labelled):
+    """
+    :return: the (text, label) column names, label is None for test data
+    """
+    columns = list(columns)
+    if "text" in columns:
+        return "text", "label" if labelled else None
+    if labelled:
+        return columns[1], columns[0]
+    return columns[0], None
+
+
+def _one_line_texts(texts):
+    """
+    :param texts: a pandas Series
+    :return: a NumPy object array of the texts, with line breaks replaced by spaces
+    """
+    return texts.astype(str).str.replace('\n', ' ', regex=False).to_numpy()
+
+
+def _frame_columns(data_frame, labelled):
+    text_column, label_column = _column_names(data_frame.columns, labelled)
+    # selecting a column of a DataFrame doesn't copy it
+    texts = _one_line_texts(data_frame[text_column])
+    return texts, data_frame[label_column].to_numpy() if labelled else None
+
+
+def _in_memory_columns(data, labelled):
+    if isinstance(data, pd.DataFrame):
+        return _frame_columns(data, labelled)
+    if labelled:
+        texts, labels = data
+    else:
+        texts, labels = data, None
+    return [str(text).replace('\n', ' ') for text in texts], labels
+
+
+def _read_csv(csv_path, labelled):
+    data_frame = pd.read_csv(csv_path, header=None, dtype=str, keep_default_na=False)
+    return _one_line_texts(data_frame[1 if labelled else 0]), data_frame[0].to_numpy() if labelled else None
+
+
+def _import_pyarrow():
+    try:
+        import pyarrow  # pylint: disable=import-outside-toplevel
+    except ImportError:
+        raise ImportError("Reading Parquet and Arrow files requires pyarrow: pip install pyarrow")
+    return pyarrow
+
+
+def _table_columns(table, labelled):
+    """
+    :return: the texts as an Arrow array, which is only turned into Python
+             strings a chunk at a time while it is tokenized, and the
+             labels as a NumPy array
+    """
+    pyarrow = _import_pyarrow()
+    import pyarrow.compute  # pylint: disable=import-outside-toplevel
+    text_column, label_column = _column_names(table.column_names, labelled)
+    texts = table.column(text_column)
+    if not (pyarrow.types.is_string(texts.type) or pyarrow.types.is_large_string(texts.type)):
+        texts = texts.cast(pyarrow.string())
+    texts = pyarrow.compute.replace_substring(texts, '\n', ' ')
+    return texts, table.column(label_column).to_numpy() if labelled else None
+
+
+def _read_parquet(parquet_path, labelled):
+    _import_pyarrow()
+    import pyarrow.parquet as pq  # pylint: disable=import-outside-toplevel
+    schema_names = pq.read_schema(parquet_path).names
+    columns = [name for name in _column_names(schema_names, labelled) if name is not None]
+    return _table_columns(pq.read_table(parquet_path, columns=columns, memory_map=True), labelled)
+
+
+def _read_arrow(arrow_path, labelled):
+    pyarrow = _import_pyarrow()
+    import pyarrow.ipc  # pylint: disable=import-outside-toplevel
+    with pyarrow.memory_map(arrow_path) as source:
+        # record batches read from a memory map reference the file, so
+        # only the selected columns are ever paged in
+        table = pyarrow.ipc.open_file(source).read_all()
+        return _table_columns(table, labelled)
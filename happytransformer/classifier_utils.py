@@ -28,9 +28,17 @@ from __future__ import absolute_import, division, print_function
 import csv
 import logging
 import sys
+import weakref
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
 from io import open
-from multiprocessing import Pool, cpu_count
+from itertools import chain
+from multiprocessing import cpu_count
+import numpy as np
 from tqdm import tqdm
+from torch.utils.data import Dataset
+
+from happytransformer.classifier_data import text_list
 
 logger = logging.getLogger(__name__)
 csv.field_size_limit(2147483647)
@@ -56,16 +64,6 @@ class InputExample(object):
         self.label = label
 
 
-class InputFeatures(object):
-    """A single set of features of data."""
-
-    def __init__(self, input_ids, input_mask, segment_ids, label_id):
-        self.input_ids = input_ids
-        self.input_mask = input_mask
-        self.segment_ids = segment_ids
-        self.label_id = label_id
-
-
 class DataProcessor(object):
     """Base class for data converters for sequence classification data sets."""
 
@@ -124,135 +122,136 @@ class BinaryProcessor(DataProcessor):
         return examples
 
 
-def convert_example_to_feature(example_row, pad_token=0,
-                               sequence_a_segment_id=0, sequence_b_segment_id=1,
-                               cls_token_segment_id=1, pad_token_segment_id=0,
-                               mask_padding_with_zero=True, sep_token_extra=False):
-    example, label_map, max_seq_length, tokenizer, output_mode, cls_token_at_end, cls_token, sep_token, cls_token_segment_id, pad_on_left, pad_token_segment_id, sep_token_extra = example_row
+FeatureArrays = namedtuple('FeatureArrays', [
+    'input_ids', 'segment_ids', 'offsets', 'label_ids'
+])
+FeatureArrays.__doc__ = """
+Unpadded features of many examples, stored in flat NumPy arrays.
+The tokens of example i are input_ids[offsets[i]:offsets[i + 1]]
+"""
 
-    tokens_a = tokenizer.tokenize(example.text_a)
+# Workers are kept between calls so that large inputs don't pay for
+# starting a new pool, and for pickling the tokenizer, every time. The
+# tokenizer is held by a weak reference, since the id of a garbage
+# collected tokenizer can be reused by a new one
+_featurizer_pool = None
+_featurizer_pool_key = None
+_featurizer_pool_tokenizer = None
+_worker_tokenizer = None
+_worker_max_seq_length = None
 
-    tokens_b = None
-    if example.text_b:
-        tokens_b = tokenizer.tokenize(example.text_b)
-        # Modifies `tokens_a` and `tokens_b` in place so that the total
-        # length is less than the specified length.
-        # Account for [CLS], [SEP], [SEP] with "- 3". " -4" for RoBERTa.
-        special_tokens_count = 4 if sep_token_extra else 3
-        _truncate_seq_pair(tokens_a, tokens_b, max_seq_length - special_tokens_count)
-    else:
-        # Account for [CLS] and [SEP] with "- 2" and with "- 3" for RoBERTa.
-        special_tokens_count = 3 if sep_token_extra else 2
-        if len(tokens_a) > max_seq_length - special_tokens_count:
-            tokens_a = tokens_a[:(max_seq_length - special_tokens_count)]
-
-    # The convention in BERT is:
-    # (a) For sequence pairs:
-    #  tokens:   [CLS] is this jack ##son ##ville ? [SEP] no it is not . [SEP]
-    #  type_ids:   0   0  0    0    0     0       0   0   1  1  1  1   1   1
-    # (b) For single sequences:
-    #  tokens:   [CLS] the dog is hairy . [SEP]
-    #  type_ids:   0   0   0   0  0     0   0
-    #
-    # Where "type_ids" are used to indicate whether this is the first
-    # sequence or the second sequence. The embedding vectors for `type=0` and
-    # `type=1` were learned during pre-training and are added to the wordpiece
-    # embedding vector (and position vector). This is not *strictly* necessary
-    # since the [SEP] token unambiguously separates the sequences, but it makes
-    # it easier for the model to learn the concept of sequences.
-    #
-    # For classification tasks, the first vector (corresponding to [CLS]) is
-    # used as as the "sentence vector". Note that this only makes sense because
-    # the entire model is fine-tuned.
-    tokens = tokens_a + [sep_token]
-    segment_ids = [sequence_a_segment_id] * len(tokens)
-
-    if tokens_b:
-        tokens += tokens_b + [sep_token]
-        segment_ids += [sequence_b_segment_id] * (len(tokens_b) + 1)
-
-    if cls_token_at_end:
-        tokens = tokens + [cls_token]
-        segment_ids = segment_ids + [cls_token_segment_id]
-    else:
-        tokens = [cls_token] + tokens
-        segment_ids = [cls_token_segment_id] + segment_ids
 
-    input_ids = tokenizer.convert_tokens_to_ids(tokens)
+def _init_featurizer_worker(tokenizer, max_seq_length):
+    global _worker_tokenizer, _worker_max_seq_length
+    _worker_tokenizer = tokenizer
+    _worker_max_seq_length = max_seq_length
 
-    # The mask has 1 for real tokens and 0 for padding tokens. Only real
-    # tokens are attended to.
-    input_mask = [1 if mask_padding_with_zero else 0] * len(input_ids)
 
-    # Zero-pad up to the sequence length.
-    padding_length = max_seq_length - len(input_ids)
-    if pad_on_left:
-        input_ids = ([pad_token] * padding_length) + input_ids
-        input_mask = ([0 if mask_padding_with_zero else 1] * padding_length) + input_mask
-        segment_ids = ([pad_token_segment_id] * padding_length) + segment_ids
-    else:
-        input_ids = input_ids + ([pad_token] * padding_length)
-        input_mask = input_mask + ([0 if mask_padding_with_zero else 1] * padding_length)
-        segment_ids = segment_ids + ([pad_token_segment_id] * padding_length)
-
-    assert len(input_ids) == max_seq_length
-    assert len(input_mask) == max_seq_length
-    assert len(segment_ids) == max_seq_length
-
-    if output_mode == "classification":
-        label_id = label_map[example.label]
-    elif output_mode == "regression":
-        label_id = float(example.label)
-    else:
-        raise KeyError(output_mode)
-
-    return InputFeatures(input_ids=input_ids,
-                         input_mask=input_mask,
-                         segment_ids=segment_ids,
-                         label_id=label_id)
-
-
-def convert_examples_to_features(examples, label_list, max_seq_length,
-                                 tokenizer, output_mode,
-                                 cls_token_at_end=False, sep_token_extra=False, pad_on_left=False,
-                                 cls_token='[CLS]', sep_token='[SEP]', pad_token=0,
-                                 sequence_a_segment_id=0, sequence_b_segment_id=1,
-                                 cls_token_segment_id=1, pad_token_segment_id=0,
-                                 mask_padding_with_zero=True,
-                                 process_count=max(cpu_count() - 2,1)):
-    """ Loads a data file into a list of `InputBatch`s
-        `cls_token_at_end` define the location of the CLS token:
-            - False (Default, BERT/XLM pattern): [CLS] + A + [SEP] + B + [SEP]
-            - True (XLNet/GPT pattern): A + [SEP] + B + [SEP] + [CLS]
-        `cls_token_segment_id` define the segment id associated to the CLS token (0 for BERT, 2 for XLNet)
+def _encode_chunk(texts, tokenizer=None, max_seq_length=None):
+    """
+    Batch encodes texts with the tokenizer's own special tokens
+    ([CLS] A [SEP] for BERT, <s> A </s> for RoBERTa, A <sep> <cls> for XLNet)
+    :return: tuple of NumPy arrays (lengths, input_ids, segment_ids),
+             where input_ids and segment_ids hold every text back to back
+    """
+    tokenizer = tokenizer or _worker_tokenizer
+    max_seq_length = max_seq_length or _worker_max_seq_length
+    encodings = tokenizer(
+        list(texts), add_special_tokens=True, truncation=True,
+        max_length=max_seq_length, return_token_type_ids=True,
+        return_attention_mask=False
+    )
+    lengths = np.fromiter(map(len, encodings['input_ids']), dtype=np.int64, count=len(texts))
+    total = int(lengths.sum())
+    input_ids = np.fromiter(chain.from_iterable(encodings['input_ids']), dtype=np.int32, count=total)
+    segment_ids = np.fromiter(chain.from_iterable(encodings['token_type_ids']), dtype=np.int8, count=total)
+    return lengths, input_ids, segment_ids
+
+
+def _get_featurizer_pool(tokenizer, max_seq_length, process_count):
+    global _featurizer_pool, _featurizer_pool_key, _featurizer_pool_tokenizer
+    key = (max_seq_length, process_count)
+    if (_featurizer_pool is None or _featurizer_pool_key != key
+            or _featurizer_pool_tokenizer() is not tokenizer):
+        if _featurizer_pool is not None:
+            _featurizer_pool.shutdown()
+        _featurizer_pool = ProcessPoolExecutor(
+            process_count, initializer=_init_featurizer_worker,
+            initargs=(tokenizer, max_seq_length)
+        )
+        _featurizer_pool_key = key
+        _featurizer_pool_tokenizer = weakref.ref(tokenizer)
+    return _featurizer_pool
+
+
+def featurize_texts(texts, labels, label_list, max_seq_length, tokenizer,
+                    chunk_size=2000, parallel_threshold=20000,
+                    process_count=max(cpu_count() - 2, 1), show_progress=True):
+    """
+    Batch encodes texts straight into flat NumPy arrays.
+
+    Small inputs, and any input with a fast (Rust) tokenizer, which already
+    encodes batches in parallel, are encoded in this process. Larger inputs
+    with a Python tokenizer are split into chunks and encoded by a pool of
+    process_count workers that is reused by later calls.
+
+    :param texts: list of strings, or the texts of ClassifierData, which
+           are turned into strings a chunk at a time
+    :param labels: list or array of labels, each in label_list
+    :param label_list: list of the possible labels
+    :param max_seq_length: maximum number of tokens, including special tokens
+    :param tokenizer: a transformers tokenizer
+    :param show_progress: False to hide the progress bar
+    :return: FeatureArrays
     """
-
     label_map = {label: i for i, label in enumerate(label_list)}
+    label_ids = np.fromiter((label_map[label] for label in labels), dtype=np.int64, count=len(labels))
 
-    examples = [(example, label_map, max_seq_length, tokenizer, output_mode, cls_token_at_end, cls_token, sep_token,
-                 cls_token_segment_id, pad_on_left, pad_token_segment_id, sep_token_extra) for example in examples]
-
-    with Pool(process_count) as p:
-        features = list(tqdm(p.imap(convert_example_to_feature, examples, chunksize=500), total=len(examples)))
+    chunks = (text_list(texts[start:start + chunk_size]) for start in range(0, len(texts), chunk_size))
+    num_chunks = (len(texts) + chunk_size - 1) // chunk_size
+    if len(texts) < parallel_threshold or process_count < 2 or getattr(tokenizer, 'is_fast', False):
+        encoded = [_encode_chunk(chunk, tokenizer, max_seq_length)
+                   for chunk in tqdm(chunks, total=num_chunks, disable=not show_progress)]
+    else:
+        pool = _get_featurizer_pool(tokenizer, max_seq_length, process_count)
+        encoded = list(tqdm(pool.map(_encode_chunk, chunks), total=num_chunks, disable=not show_progress))
+
+    lengths = np.concatenate([chunk_lengths for chunk_lengths, _, _ in encoded] or [np.zeros(0, dtype=np.int64)])
+    offsets = np.zeros(len(texts) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    input_ids = np.empty(offsets[-1], dtype=np.int32)
+    segment_ids = np.empty(offsets[-1], dtype=np.int8)
+    position = 0
+    for _, chunk_ids, chunk_segment_ids in encoded:
+        input_ids[position:position + len(chunk_ids)] = chunk_ids
+        segment_ids[position:position + len(chunk_ids)] = chunk_segment_ids
+        position += len(chunk_ids)
+    return FeatureArrays(input_ids, segment_ids, offsets, label_ids)
+
+
+class FeatureDataset(Dataset):
+    """
+    Dataset of unpadded features backed by FeatureArrays. Each item is a
+    tuple of (index, input_ids, segment_ids, label_id), to be padded per
+    batch by batching.PaddingCollator
+    """
 
-    return features
+    def __init__(self, arrays):
+        self.arrays = arrays
 
+    def __len__(self):
+        return len(self.arrays.label_ids)
 
-def _truncate_seq_pair(tokens_a, tokens_b, max_length):
-    """Truncates a sequence pair in place to the maximum length."""
+    def __getitem__(self, index):
+        start, end = self.arrays.offsets[index], self.arrays.offsets[index + 1]
+        return (index, self.arrays.input_ids[start:end],
+                self.arrays.segment_ids[start:end], self.arrays.label_ids[index])
 
-    # This is a simple heuristic which will always truncate the longer sequence
-    # one token at a time. This makes more sense than truncating an equal percent
-    # of tokens from each, since if one sequence is very short then each token
-    # that's truncated likely contains more information than a longer sequence.
-    while True:
-        total_length = len(tokens_a) + len(tokens_b)
-        if total_length <= max_length:
-            break
-        if len(tokens_a) > len(tokens_b):
-            tokens_a.pop()
-        else:
-            tokens_b.pop()
+    def lengths(self):
+        """
+        :return: NumPy array with the number of tokens in each example
+        """
+        return np.diff(self.arrays.offsets)
 
 
 processors = {
@@ -0,0 +1,159 @@
+"""
+Knowledge distillation of a fine-tuned sequence classifier, the teacher,
+into a smaller student model that is trained to match the teacher's
+temperature-softened logits.
+"""
+
+import copy
+import re
+
+import torch.nn.functional as F
+from transformers import PretrainedConfig
+
+# the encoder layers of BERT, RoBERTa and XLNet models are "...layer.<index>."
+LAYER_PATTERN = re.compile(r'(^|\.)layer\.(\d+)\.')
+
+# settings of the teacher's own training that a student doesn't inherit:
+# the teacher's checkpoints, the warmup that training computed for the
+# teacher, and the frozen encoder, which can't learn from the teacher's logits
+TEACHER_ONLY_ARGS = ('checkpoint_dir', 'resume_from', 'warmup_steps', 'freeze_encoder', 'unfrozen_layers')
+
+
+def distillation_loss(student_logits, teacher_logits, labels=None, temperature=2.0, alpha=0.5):
+    """
+    :param student_logits: (batch size, num_labels) tensor
+    :param teacher_logits: (batch size, num_labels) tensor
+    :param labels: (batch size) tensor of correct labels, or None for
+           unlabelled data
+    :param temperature: softens both distributions, so that the student
+           also learns how the teacher ranks the wrong labels
+    :param alpha: weight of the soft target loss. The cross entropy with
+           the labels has weight 1 - alpha
+    :return: the mean loss of the batch
+    """
+    student_logits = student_logits.float()
+    teacher_logits = teacher_logits.float()
+    # scaled by temperature ** 2 so that the gradients keep the same size
+    # as the temperature changes
+    soft_loss = F.kl_div(
+        F.log_softmax(student_logits / temperature, dim=1),
+        F.softmax(teacher_logits / temperature, dim=1),
+        reduction='batchmean'
+    ) * temperature ** 2
+    if labels is None:
+        return soft_loss
+    return alpha * soft_loss + (1 - alpha) * F.cross_entropy(student_logits, labels)
+
+
+def num_layers(state_dict):
+    """
+    :return: the number of encoder layers in a model's state dict
+    """
+    indices = [int(match.group(2)) for match in map(LAYER_PATTERN.search, state_dict) if match]
+    return max(indices) + 1 if indices else 0
+
+
+def copy_teacher_weights(teacher_model, student_model):
+    """
+    Initializes a student from its teacher. Student layer i starts from an
+    evenly spaced teacher layer, which includes the first and the last
+    layer. The embeddings, pooler and classifier are copied as they are.
+    Weights whose shapes differ, such as when the student has a smaller
+    hidden size, keep their random initialization
+    :return: the number of weights that were copied
+    """
+    teacher_state = teacher_model.state_dict()
+    student_state = student_model.state_dict()
+    teacher_layers, student_layers = num_layers(teacher_state), num_layers(student_state)
+
+    def teacher_layer(match):
+        index = int(match.group(2))
+        if student_layers > 1:
+            index = round(index * (teacher_layers - 1) / (student_layers - 1))
+        else:
+            index = teacher_layers - 1
+        return '{}layer.{}.'.format(match.group(1), index)
+
+    copied = {}
+    for name, weight in student_state.items():
+        teacher_name = LAYER_PATTERN.sub(teacher_layer, name, count=1)
+        teacher_weight = teacher_state.get(teacher_name)
+        if teacher_weight is not None and teacher_weight.shape == weight.shape:
+            copied[name] = teacher_weight
+    student_model.load_state_dict(copied, strict=False)
+    return len(copied)
+
+
+def create_student(teacher_model, student):
+    """
+    :param teacher_model: the fine-tuned classifier
+    :param student: one of
+        - a dictionary of changes to the teacher's config, such as
+          {"num_hidden_layers": 4}, for a student initialized from the
+          teacher's weights by copy_teacher_weights()
+        - a PretrainedConfig for a randomly initialized student
+        - the name or path of a pretrained model of the same type as the
+          teacher, which must use the teacher's vocabulary
+    :return: a sequence classification model of the teacher's class
+    """
+    model_class = type(teacher_model)
+    num_labels = teacher_model.config.num_labels
+    if isinstance(student, str):
+        return model_class.from_pretrained(student, num_labels=num_labels)
+    if isinstance(student, PretrainedConfig):
+        config = copy.deepcopy(student)
+        config.num_labels = num_labels
+        return model_class(config)
+
+    config = copy.deepcopy(teacher_model.config)
+    for key, value in student.items():
+        setattr(config, key, value)
+    student_model = model_class(config)
+    copy_teacher_weights(teacher_model, student_model)
+    return student_model
+
+
+def count_parameters(model):
+    """
+    :return: the number of parameters of a model
+    """
+    return sum(parameter.numel() for parameter in model.parameters())
+
+
+def distillation_report(teacher_results, teacher_stats, student_results, student_stats,
+                        teacher_model, student_model):
+    """
+    Compares the size, speed and accuracy of a teacher and its student
+    :param teacher_results: the StreamingMetrics report of the teacher on eval data
+    :param teacher_stats: the BatchStats report of the same evaluation
+    :return: a dictionary with the "teacher" and "student" parameters,
+             accuracy, F1, loss and milliseconds per example, the
+             student's "speedup" and its "accuracy_change"
+    """
+    report = {}
+    for name, results, stats, model in (('teacher', teacher_results, teacher_stats, teacher_model),
+                                        ('student', student_results, student_stats, student_model)):
+        report[name] = {
+            'parameters': count_parameters(model),
+            'accuracy': results['accuracy'],
+            'f1': results['f1'],
+            'loss': results.get('loss'),
+            'examples_per_second': stats['examples_per_second'],
+            'ms_per_example': 1000 / stats['examples_per_second'] if stats['examples_per_second'] else None
+        }
+    report['speedup'] = (
+        student_stats['examples_per_second'] / teacher_stats['examples_per_second']
+        if teacher_stats['examples_per_second'] else None
+    )
+    report['accuracy_change'] = student_results['accuracy'] - teacher_results['accuracy']
+    return report
+
+
+def teacher_logits_file(features_key, teacher_fingerprint, bf16):
+    """
+    :param features_key: the feature cache key of the data the teacher runs on
+    :param teacher_fingerprint: model_fingerprint() of the teacher
+    :param bf16: whether the teacher runs under bfloat16 autocast
+    :return: the file name of the cached teacher logits
+    """
+    return '{}-{}-{}.npy'.format(features_key, teacher_fingerprint[:16], 'bf16' if bf16 else 'fp32')
@@ -0,0 +1,123 @@
+"""
+On-disk cache of tokenized classifier features.
+
+Features are stored as .npy files in a directory named after a key built
+from the input data, the tokenizer, the model and max_seq_length, and are
+memory-mapped when loaded so that re-using them skips tokenization and
+does not read the whole dataset into memory.
+"""
+
+import contextlib
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+import numpy as np
+import torch
+
+from happytransformer.classifier_utils import FeatureArrays
+
+
+def file_sha256(path, block_size=1 << 20):
+    """
+    :param path: path to a file
+    :return: the hex sha256 hash of the file's contents
+    """
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as data_file:
+        for block in iter(lambda: data_file.read(block_size), b''):
+            sha256.update(block)
+    return sha256.hexdigest()
+
+
+def tokenizer_fingerprint(tokenizer):
+    """
+    :param tokenizer: a transformers tokenizer
+    :return: a hex hash that changes if the tokenizer's class, vocabulary
+             or special tokens change
+    """
+    sha256 = hashlib.sha256()
+    sha256.update(type(tokenizer).__name__.encode())
+    sha256.update(json.dumps(sorted(tokenizer.get_vocab().items())).encode())
+    sha256.update(json.dumps(tokenizer.special_tokens_map, sort_keys=True, default=str).encode())
+    return sha256.hexdigest()
+
+
+def model_fingerprint(model, skip=()):
+    """
+    :param model: a torch module
+    :param skip: names of state dict entries to leave out
+    :return: a hex hash of the model's weights
+    """
+    sha256 = hashlib.sha256()
+    for name, tensor in model.state_dict().items():
+        if name in skip:
+            continue
+        sha256.update(name.encode())
+        sha256.update(str(tensor.dtype).encode())
+        sha256.update(tensor.detach().cpu().contiguous().reshape(-1).view(torch.uint8).numpy().tobytes())
+    return sha256.hexdigest()
+
+
+def feature_cache_key(data_hash, tokenizer, model_name, max_seq_length, labelled=True):
+    """
+    :param data_hash: hash of the input data, such as file_sha256(csv_path)
+    :param tokenizer: the tokenizer used to build the features
+    :param model_name: such as "BERT"
+    :param max_seq_length: maximum number of tokens per example
+    :param labelled: False for test data, which is read without labels
+    :return: the name of the cache entry for these features
+    """
+    key = json.dumps([
+        data_hash, tokenizer_fingerprint(tokenizer), model_name, max_seq_length, labelled
+    ])
+    return hashlib.sha256(key.encode()).hexdigest()
+
+
+def load_features(cache_dir, key):
+    """
+    :return: memory-mapped FeatureArrays, or None if they are not cached
+    """
+    entry = os.path.join(cache_dir, key)
+    if not os.path.isdir(entry):
+        return None
+    # copy-on-write maps give writable arrays that torch can wrap
+    # without copying the file into memory
+    return FeatureArrays(*(
+        np.load(os.path.join(entry, field + '.npy'), mmap_mode='c')
+        for field in FeatureArrays._fields
+    ))
+
+
+@contextlib.contextmanager
+def cache_entry(cache_dir, key):
+    """
+    Writes an entry of a cache directory. The files of the entry are
+    written to the yielded temporary directory, which is renamed to the
+    entry once they are all written, so a crash never leaves a partial
+    entry. If another process wrote the same entry first, its entry is kept
+    :param cache_dir: the cache directory, created if it does not exist
+    :param key: the name of the entry
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    temporary = tempfile.mkdtemp(dir=cache_dir)
+    try:
+        yield temporary
+    except BaseException:
+        shutil.rmtree(temporary, ignore_errors=True)
+        raise
+    try:
+        os.rename(temporary, os.path.join(cache_dir, key))
+    except OSError:
+        shutil.rmtree(temporary)
+
+
+def save_features(cache_dir, key, arrays):
+    """
+    Writes FeatureArrays to the cache, see cache_entry()
+    """
+    with cache_entry(cache_dir, key) as entry:
+        for field, array in zip(FeatureArrays._fields, arrays):
+            np.save(os.path.join(entry, field + '.npy'), array)
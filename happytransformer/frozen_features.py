@@ -0,0 +1,171 @@
+"""
+Fast fine-tuning of a sequence classifier with a frozen encoder.
+
+The encoder runs once over the data in inference mode and its features
+are saved to memory-mapped arrays. Training then only runs the
+classification head, and optionally the top few encoder layers, over the
+saved features, which is fast enough to train for many epochs.
+
+With no unfrozen layers, one feature is saved per example: the pooled
+output for BERT, the first token's hidden state for RoBERTa and the
+summary token's hidden state for XLNet, which is what their heads
+classify. With unfrozen layers, the hidden states of every token that
+enter the first unfrozen layer are saved instead. Layers can only be
+unfrozen for BERT and RoBERTa.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+
+import numpy as np
+import torch
+from transformers import (
+    BertForSequenceClassification,
+    RobertaForSequenceClassification
+)
+
+from happytransformer.feature_cache import cache_entry
+from happytransformer.pruning import encoder_layers
+
+FEATURES_FILE = 'features.npy'
+
+
+def trainable_modules(model, unfrozen_layers=0):
+    """
+    :return: the modules of a sequence classification model that are
+             trained when its encoder is frozen, except for the top
+             unfrozen_layers layers
+    """
+    if isinstance(model, BertForSequenceClassification):
+        modules = [model.classifier] + ([model.bert.pooler] if unfrozen_layers else [])
+    elif isinstance(model, RobertaForSequenceClassification):
+        modules = [model.classifier]
+    else:
+        if unfrozen_layers:
+            raise ValueError("Layers can only be unfrozen for BERT and RoBERTa")
+        modules = [model.sequence_summary, model.logits_proj]
+    if unfrozen_layers:
+        modules += list(encoder_layers(model)[-unfrozen_layers:])
+    return modules
+
+
+def frozen_fingerprint_skip(model, unfrozen_layers=0):
+    """
+    :return: the state dict names of the trained weights, to leave out of
+             the fingerprint of the frozen encoder
+    """
+    trained = {id(parameter) for module in trainable_modules(model, unfrozen_layers)
+               for parameter in module.parameters()}
+    return {name for name, parameter in model.state_dict(keep_vars=True).items() if id(parameter) in trained}
+
+
+def encoder_features(model, input_ids, attention_mask, token_type_ids, unfrozen_layers=0):
+    """
+    Runs the frozen part of the model over a batch
+    :return: a (batch size, hidden size) tensor of features, or with
+             unfrozen_layers, the (batch size, sequence length, hidden size)
+             hidden states that enter the first unfrozen layer
+    """
+    outputs = model.base_model(input_ids=input_ids, attention_mask=attention_mask,
+                               token_type_ids=token_type_ids, output_hidden_states=bool(unfrozen_layers))
+    if unfrozen_layers:
+        # hidden_states[0] is the output of the embeddings
+        return outputs.hidden_states[len(encoder_layers(model)) - unfrozen_layers]
+    if isinstance(model, BertForSequenceClassification):
+        return outputs[1]
+    if isinstance(model, RobertaForSequenceClassification):
+        return outputs[0][:, 0]
+    if model.config.summary_type not in ('first', 'last'):
+        raise ValueError("A frozen XLNet encoder needs a \"first\" or \"last\" summary_type")
+    return outputs[0][:, 0 if model.config.summary_type == 'first' else -1]
+
+
+def head_logits(model, features, attention_mask=None, unfrozen_layers=0):
+    """
+    Runs the trained part of the model over features from encoder_features()
+    :return: the (batch size, num_labels) logits
+    """
+    if unfrozen_layers:
+        extended_mask = model.get_extended_attention_mask(attention_mask, attention_mask.shape)
+        for layer in encoder_layers(model)[-unfrozen_layers:]:
+            features = layer(features, attention_mask=extended_mask)[0]
+        if isinstance(model, RobertaForSequenceClassification):
+            return model.classifier(features)
+        features = model.bert.pooler(features)
+    if isinstance(model, BertForSequenceClassification):
+        return model.classifier(model.dropout(features))
+    if isinstance(model, RobertaForSequenceClassification):
+        # the head classifies the first token of a sequence
+        return model.classifier(features.unsqueeze(1))
+    return model.logits_proj(model.sequence_summary(features.unsqueeze(1)))
+
+
+class FrozenFeatures():
+    """
+    Features of a data set from encoder_features(), in data set order.
+    Per token hidden states are stored one example after another, and
+    padded per batch
+
+    :param features: a (number of examples, hidden size) array, or a
+           (number of tokens, hidden size) array of hidden states
+    :param offsets: with hidden states, the position of the first token of
+           each example, followed by the number of tokens
+    :param temporary_dir: a tempfile.TemporaryDirectory that holds the
+           features file, kept until the features are garbage collected
+    """
+
+    def __init__(self, features, offsets=None, temporary_dir=None):
+        self.features = features
+        self.offsets = offsets
+        self.temporary_dir = temporary_dir
+
+    def batch(self, indices, device):
+        """
+        :param indices: data set positions of the examples in the batch
+        :return: a (features, attention mask) tuple of tensors on device.
+                 The attention mask is None for per example features
+        """
+        if self.offsets is None:
+            return torch.as_tensor(np.array(self.features[indices])).to(device), None
+        lengths = self.offsets[np.asarray(indices) + 1] - self.offsets[indices]
+        features = torch.zeros((len(indices), int(lengths.max()), self.features.shape[1]))
+        attention_mask = torch.zeros((len(indices), int(lengths.max())), dtype=torch.long)
+        for row, (index, length) in enumerate(zip(indices, lengths)):
+            start = self.offsets[index]
+            features[row, :length] = torch.as_tensor(np.array(self.features[start:start + length]))
+            attention_mask[row, :length] = 1
+        return features.to(device), attention_mask.to(device)
+
+
+def frozen_features_key(features_key, encoder_fingerprint, unfrozen_layers, bf16):
+    """
+    :param features_key: the feature cache key of the tokenized data
+    :param encoder_fingerprint: a fingerprint of the frozen weights, see
+           frozen_fingerprint_skip()
+    :param bf16: whether the encoder runs under bfloat16 autocast
+    :return: the name of the cache entry for these features
+    """
+    key = json.dumps([features_key, encoder_fingerprint, unfrozen_layers, bf16])
+    return hashlib.sha256(key.encode()).hexdigest()
+
+
+def load_frozen_features(cache_dir, key, offsets=None):
+    """
+    :return: memory-mapped FrozenFeatures, or None if they are not cached
+    """
+    path = os.path.join(cache_dir, key, FEATURES_FILE)
+    if not os.path.isfile(path):
+        return None
+    return FrozenFeatures(np.load(path, mmap_mode='r'), offsets)
+
+
+def save_frozen_features(cache_dir, key, features):
+    """
+    Moves the features from a temporary .npy file into the cache, see
+    feature_cache.cache_entry()
+    :param features: path of the .npy file
+    """
+    with cache_entry(cache_dir, key) as entry:
+        shutil.move(features, os.path.join(entry, FEATURES_FILE))
@@ -3,11 +3,15 @@ HappyBERT: a wrapper over PyTorch's BERT implementation
 
 """
 
-from collections import namedtuple
 # disable pylint TODO warning
 # pylint: disable=W0511
 import re
+import inspect
+import time
 from transformers import (
+    AutoConfig,
+    AutoModelForQuestionAnswering,
+    AutoTokenizer,
     BertForMaskedLM,
     BertForNextSentencePrediction,
     BertForQuestionAnswering,
@@ -15,10 +19,26 @@ from transformers import (
 )
 
 import torch
-import numpy as np
 
 from happytransformer.happy_transformer import HappyTransformer
-from happytransformer.qa_util import qa_probabilities, QAAnswer
+from happytransformer.qa_util import (
+    qa_spans_batch,
+    top_span_probabilities,
+    QAAnswer,
+    QADocument,
+    qa_args
+)
+
+def _empty_cascade_stats():
+    """
+    :return: the statistics of a QA cascade that has answered no questions
+    """
+    return {
+        "questions": 0,
+        "escalated": 0,
+        "cascade_seconds": 0.0,
+        "large_seconds": 0.0
+    }
 
 class HappyBERT(HappyTransformer):
     """
@@ -35,6 +55,11 @@ class HappyBERT(HappyTransformer):
             1. predict_next_sentence(sentence_a, sentence_b)
         BertForQuestionAnswering:
             1. answer_question(question, text)
+            2. answers_to_question(question, text, k=3)
+            3. answers_to_questions(questions, text, k=3)
+            4. prepare_context(text)
+            5. init_qa_cascade(model, threshold)
+            6. get_qa_cascade_stats()
 
             """
 
@@ -43,6 +68,9 @@ class HappyBERT(HappyTransformer):
         self.mlm = None  # Masked Language Model
         self.nsp = None  # Next Sentence Prediction
         self.qa = None   # Question Answering
+        self.qa_args = qa_args.copy()
+        self.qa_cascade = None  # Small Question Answering model tried first
+        self.qa_cascade_stats = _empty_cascade_stats()
         self.tokenizer = BertTokenizer.from_pretrained(model)
         self.masked_token = self.tokenizer.mask_token
         self.sep_token = self.tokenizer.sep_token
@@ -65,9 +93,17 @@ class HappyBERT(HappyTransformer):
     def _get_question_answering(self):
         """
         Initializes the BertForQuestionAnswering transformer
-        NOTE: This uses the bert-large-uncased-whole-word-masking-finetuned-squad pretraining for best results.
+        NOTE: Unless the model is already a question answering checkpoint,
+        such as one saved by prune(task="qa"), this uses the
+        bert-large-uncased-whole-word-masking-finetuned-squad pretraining for best results.
         """
-        self.qa = BertForQuestionAnswering.from_pretrained('bert-large-uncased-whole-word-masking-finetuned-squad')
+        architectures = AutoConfig.from_pretrained(self.model).architectures or []
+        if any(architecture.endswith("ForQuestionAnswering") for architecture in architectures):
+            qa_model = self.model
+        else:
+            qa_model = 'bert-large-uncased-whole-word-masking-finetuned-squad'
+        self.qa = BertForQuestionAnswering.from_pretrained(qa_model)
+        self.qa.to(self.gpu_support)
         self.qa.eval()
 
     def predict_next_sentence(self, sentence_a, sentence_b, use_probability=False):
@@ -142,53 +178,211 @@ class HappyBERT(HappyTransformer):
         """
         return self.answers_to_question(question, text, 1)[0].text
 
-    def _tokenize_qa(self, question, context):
-        input_text = ' '.join([
-            question, 
-            self.sep_token,
-            context
-        ])
-        input_ids = self.tokenizer.encode(input_text)
-        return input_ids
-
-    def _run_qa_model(self, input_ids):
-        if self.qa is None:
-            self._get_question_answering()
-        sep_id_index = input_ids.index(self.tokenizer.sep_token_id)
-        before_after_ids = [
-            0 if idx <= sep_id_index else 1
-            for idx, _ in enumerate(input_ids)
+    def prepare_context(self, context):
+        """
+        Tokenizes a context once so that many questions can be asked about it.
+
+        :param context: The text containing the answers to the questions
+        :return: A QADocument. Use its answers_to_questions(questions, k)
+                 method, or queue questions with add_question(question)
+                 and answer them all at once with answer_pending(k)
+        """
+        return QADocument(self, context)
+
+    def answers_to_questions(self, questions, context, k=3):
+        """
+        Answers many questions about the same context. The context is
+        tokenized once and the questions are answered in batches.
+
+        :param questions: list of questions to be answered
+        :param context: The text containing the answers to the questions
+        :param k: number of answers to return per question
+        :return: a list containing a list of QAAnswers for each question
+        """
+        return self.prepare_context(context).answers_to_questions(questions, k)
+
+    def init_qa_cascade(self, model='distilbert-base-uncased-distilled-squad', threshold=0.5):
+        """
+        Answers questions with a small, fast question answering model first.
+        The large question answering model is only run for the questions
+        where the probability of the small model's best answer is below
+        the threshold.
+
+        :param model: a question answering model that uses the same
+                      vocabulary as this HappyBERT's tokenizer
+        :param threshold: the small model's best answer is used when its
+                          probability is at least this value
+        """
+        cascade_tokenizer = AutoTokenizer.from_pretrained(model)
+        if cascade_tokenizer.get_vocab() != self.tokenizer.get_vocab():
+            self.logger.error("The cascade model %s must use the same vocabulary as %s", model, self.model)
+            exit()
+        self.qa_cascade = AutoModelForQuestionAnswering.from_pretrained(model)
+        self.qa_cascade.to(self.gpu_support)
+        self.qa_cascade.eval()
+        self.qa_args["cascade_threshold"] = threshold
+        self.qa_cascade_stats = _empty_cascade_stats()
+        self.logger.info("Questions will be answered by %s first", model)
+
+    def get_qa_cascade_stats(self):
+        """
+        :return: a dictionary with the number of questions answered, the
+                 number and fraction of them escalated to the large model,
+                 and the mean seconds per question spent in each model.
+                 The counts are zero before init_qa_cascade is called
+        """
+        stats = dict(self.qa_cascade_stats)
+        questions = max(stats["questions"], 1)
+        stats["escalation_rate"] = stats["escalated"] / questions
+        stats["mean_seconds"] = (stats["cascade_seconds"] + stats["large_seconds"]) / questions
+        return stats
+
+    def _run_qa_batch(self, question_ids, context_ids, qa_model):
+        """
+        Runs a QA model over [CLS] question [SEP] context [SEP] inputs,
+        padded to the longest input in the batch.
+
+        :param question_ids: list of question token ids, without special tokens
+        :param context_ids: list of context token ids, without special tokens
+        :param qa_model: the question answering model to run
+        :return: tuple of (start_logits, end_logits, lengths) for the
+                 context part of each input, padded to the longest context
+        """
+        input_ids = [
+            [self.tokenizer.cls_token_id] + question + [self.tokenizer.sep_token_id]
+            + context + [self.tokenizer.sep_token_id]
+            for question, context in zip(question_ids, context_ids)
         ]
+        max_length = max(len(ids) for ids in input_ids)
+        padded_ids = torch.full((len(input_ids), max_length),
+                                self.tokenizer.pad_token_id, dtype=torch.long)
+        attention_mask = torch.zeros((len(input_ids), max_length), dtype=torch.long)
+        token_type_ids = torch.zeros((len(input_ids), max_length), dtype=torch.long)
+        for row, (ids, question) in enumerate(zip(input_ids, question_ids)):
+            padded_ids[row, :len(ids)] = torch.tensor(ids)
+            attention_mask[row, :len(ids)] = 1
+            # everything after the middle [SEP] token is segment 1
+            token_type_ids[row, len(question) + 2:len(ids)] = 1
+        inputs = {
+            "input_ids": padded_ids.to(self.gpu_support),
+            "attention_mask": attention_mask.to(self.gpu_support)
+        }
+        # some small QA models, such as DistilBERT, have no segment embeddings
+        if "token_type_ids" in inspect.signature(qa_model.forward).parameters:
+            inputs["token_type_ids"] = token_type_ids.to(self.gpu_support)
         with torch.no_grad():
-            return self.qa(
-                input_ids=torch.tensor([input_ids]),
-                token_type_ids=torch.tensor([before_after_ids])
-            )
+            qa_output = qa_model(**inputs)
 
-    def answers_to_question(self, question, context, k=3):
-        input_ids = self._tokenize_qa(question, context)
-        qa_output = self._run_qa_model(input_ids)
-        sep_id_index = input_ids.index(self.tokenizer.sep_token_id)
-        probabilities = qa_probabilities(
-            # only consider logits from the context part of the embedding.
-            # that is, between the middle [SEP] token
-            # and the final [SEP] token
-            qa_output.start_logits[0][sep_id_index+1:-1],
-            qa_output.end_logits[0][sep_id_index+1:-1],
-            k
+        # only consider logits from the context part of the embedding.
+        # that is, between the middle [SEP] token and the final [SEP] token
+        lengths = [len(context) for context in context_ids]
+        start_logits = torch.zeros((len(context_ids), max(lengths)))
+        end_logits = torch.zeros((len(context_ids), max(lengths)))
+        for row, (question, length) in enumerate(zip(question_ids, lengths)):
+            token_offset = len(question) + 2
+            start_logits[row, :length] = qa_output.start_logits[row, token_offset:token_offset + length]
+            end_logits[row, :length] = qa_output.end_logits[row, token_offset:token_offset + length]
+        return start_logits, end_logits, lengths
+
+    def _cascade_spans(self, question_ids, context_ids, k):
+        """
+        Finds the top spans with the cascade model, then re-runs the
+        questions it is not confident about through the large model.
+        :return: a list containing a list of QASpans for each question
+        """
+        max_answer_length = self.qa_args["max_answer_length"]
+        start_time = time.time()
+        start_logits, end_logits, lengths = self._run_qa_batch(
+            question_ids, context_ids, self.qa_cascade
         )
-        # qa probabilities use indices relative to context.
-        # tokens use indices relative to overall question [SEP] context embedding.
-        # need offset to resolve this difference
-        token_offset = sep_id_index + 1
+        spans = qa_spans_batch(start_logits, end_logits, k, max_answer_length, lengths)
+        confidences = top_span_probabilities(start_logits, end_logits, max_answer_length, lengths)
+        escalate = [
+            row for row, confidence in enumerate(confidences)
+            if confidence < self.qa_args["cascade_threshold"]
+        ]
+        self.qa_cascade_stats["cascade_seconds"] += time.time() - start_time
+        self.qa_cascade_stats["questions"] += len(question_ids)
+        self.qa_cascade_stats["escalated"] += len(escalate)
+
+        if escalate:
+            start_time = time.time()
+            if self.qa is None:
+                self._get_question_answering()
+            start_logits, end_logits, lengths = self._run_qa_batch(
+                [question_ids[row] for row in escalate],
+                [context_ids[row] for row in escalate],
+                self.qa
+            )
+            large_spans = qa_spans_batch(start_logits, end_logits, k, max_answer_length, lengths)
+            for row, row_spans in zip(escalate, large_spans):
+                spans[row] = row_spans
+            self.qa_cascade_stats["large_seconds"] += time.time() - start_time
+        return spans
+
+    def _spans_to_question_ids(self, question_ids, context_ids, k):
+        """
+        Finds the top answer spans of already tokenized questions,
+        qa_args["batch_size"] questions at a time.
+
+        :param question_ids: list of question token ids, without special tokens
+        :param context_ids: list of context token ids for each question
+        :param k: number of spans to return per question
+        :return: a list containing a list of QASpans for each question.
+                 span indices are relative to the context ids
+        """
+        batch_size = self.qa_args["batch_size"]
+        all_spans = []
+        for batch_start in range(0, len(question_ids), batch_size):
+            batch_questions = question_ids[batch_start:batch_start + batch_size]
+            batch_contexts = context_ids[batch_start:batch_start + batch_size]
+            if self.qa_cascade is not None:
+                all_spans.extend(self._cascade_spans(batch_questions, batch_contexts, k))
+                continue
+            if self.qa is None:
+                self._get_question_answering()
+            start_logits, end_logits, lengths = self._run_qa_batch(
+                batch_questions, batch_contexts, self.qa
+            )
+            all_spans.extend(qa_spans_batch(
+                start_logits, end_logits, k,
+                max_answer_length=self.qa_args["max_answer_length"],
+                lengths=lengths
+            ))
+        return all_spans
 
+    def _answers_to_question_ids(self, question_ids, context_ids, k):
+        """
+        Answers already tokenized questions, qa_args["batch_size"] at a time.
+
+        :param question_ids: list of question token ids, without special tokens
+        :param context_ids: list of context token ids for each question
+        :param k: number of answers to return per question
+        :return: a list containing a list of QAAnswers for each question
+        """
+        all_spans = self._spans_to_question_ids(question_ids, context_ids, k)
         return [
-            QAAnswer(
-                text=self.tokenizer.decode(
+            [
+                QAAnswer(
+                    # spans use indices relative to context.
                     # grab ids from start to end (inclusive) and decode to text
-                    input_ids[token_offset+answer.start_idx : token_offset+answer.end_idx+1]
-                ),
-                softmax=answer.probability
-            )
-            for answer in probabilities
-        ]
\ No newline at end of file
+                    text=self.tokenizer.decode(context[span.start_idx:span.end_idx + 1]),
+                    softmax=span.probability
+                )
+                for span in spans
+            ]
+            for context, spans in zip(context_ids, all_spans)
+        ]
+
+    def answers_to_question(self, question, context, k=3):
+        """
+        Using the given context, find the k most likely answers to the
+        given question.
+
+        :param question: The question to be answered
+        :param context: The text containing the answer to the question
+        :param k: number of answers to return
+        :return: a list of QAAnswers of the form (text, softmax),
+                 sorted by descending probability
+        """
+        return self.prepare_context(context).answers_to_question(question, k)
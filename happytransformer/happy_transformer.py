@@ -8,19 +8,36 @@ easier to use.
 """
 
 from collections import namedtuple
+import contextlib
+import json
 import string
 import re
 import os
 import sys
-import csv
 import logging
 import logging.config
 import numpy as np
 import torch
-import pandas as pd
 
 from happytransformer.classifier_args import classifier_args
-from happytransformer.sequence_classifier import SequenceClassifier
+from happytransformer.sequence_classifier import CLASSIFIER_ARGS_FILE, SequenceClassifier
+from happytransformer.classifier_data import (
+    classifier_data_hash,
+    is_csv_path,
+    read_classifier_data,
+    text_list
+)
+from happytransformer.feature_cache import file_sha256
+from happytransformer.batching import LengthGroupedSampler
+from happytransformer.distillation import TEACHER_ONLY_ARGS, create_student
+from happytransformer.pruning import (
+    classifier_batches,
+    mlm_batches,
+    nsp_batches,
+    prune_model,
+    pruning_args,
+    qa_batches
+)
 from happytransformer.mlm_utils import FinetuneMlm, word_prediction_args
 
 def _indices_where(items, predicate):
@@ -30,6 +47,15 @@ def _indices_where(items, predicate):
         if predicate(item)
     ]
 
+@contextlib.contextmanager
+def _printing_disabled():
+    '''
+    Stops external libraries from printing, and closes os.devnull again
+    even if an error is raised
+    '''
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        yield
+
 MaskedPrediction = namedtuple('MaskedPrediction',['text','probability'])
 
 _POSSIBLE_MASK_TOKENS = ['<mask>', '<MASK>', '[MASK]']
@@ -79,10 +105,65 @@ class HappyTransformer:
         self.seq_trained = False
         self.mwp_trainer = None
         self.mwp_trained = False
+        # functions that are called with each telemetry record, see add_telemetry_callback()
+        self.telemetry_callbacks = []
 
     def _get_masked_language_model(self):
         pass
 
+    def encode(self, texts, pooling="mean", batch_size=32, dtype="float32", max_seq_length=512,
+               max_tokens_per_batch=None):
+        """
+        Embeds texts with the pretrained model, for similarity search with
+        happytransformer.vector_index.VectorIndex. Texts are batched by
+        length and each batch is only padded to its longest text.
+
+        :param texts: a list of strings
+        :param pooling: "mean" to average the token embeddings of each
+            text, or "cls" to use the embedding of its classification token
+        :param batch_size: number of texts run through the model at a time
+        :param dtype: "float32", or "float16" to return the embeddings in
+            half the memory
+        :param max_seq_length: longer texts are truncated to this many tokens
+        :param max_tokens_per_batch: size the batches by their padded
+            tokens, the number of texts times the longest text, instead
+            of batch_size texts
+        :return: a (number of texts, hidden size) NumPy array
+        """
+        if pooling not in ("mean", "cls"):
+            self.logger.error("pooling must be \"mean\" or \"cls\"")
+            exit()
+        if dtype not in ("float32", "float16"):
+            self.logger.error("dtype must be \"float32\" or \"float16\"")
+            exit()
+        self._prepare_mlm()
+        encoder = self.mlm.base_model
+        device = next(encoder.parameters()).device
+
+        encoded = self.tokenizer(list(texts), truncation=True, max_length=max_seq_length)
+        lengths = [len(input_ids) for input_ids in encoded["input_ids"]]
+        embeddings = np.zeros((len(texts), encoder.config.hidden_size), dtype=dtype)
+        encoder.eval()
+        with torch.inference_mode():
+            for indices in LengthGroupedSampler(lengths, batch_size, shuffle=False,
+                                                max_tokens=max_tokens_per_batch):
+                batch = self.tokenizer.pad(
+                    {name: [values[index] for index in indices] for name, values in encoded.items()},
+                    return_tensors="pt"
+                )
+                batch = {name: tensor.to(device) for name, tensor in batch.items()}
+                hidden_states = encoder(**batch)[0].float()
+                if pooling == "mean":
+                    mask = batch["attention_mask"].unsqueeze(-1).float()
+                    pooled = (hidden_states * mask).sum(dim=1) / mask.sum(dim=1).clamp(min=1)
+                elif self.tokenizer.padding_side == "left":
+                    # XLNet's classification token is last, after the left padding
+                    pooled = hidden_states[:, -1]
+                else:
+                    pooled = hidden_states[:, 0]
+                embeddings[indices] = pooled.cpu().numpy()
+        return embeddings
+
     def _standardize_mask_tokens(self, text):
         '''
         convert mask tokens to mask token preferred by tokenizer
@@ -347,6 +428,18 @@ class HappyTransformer:
         # Collects the softmax of all tokens in list
         return np.sum([softed[mask_id][op] for op in option])
 
+    def add_telemetry_callback(self, callback):
+        """
+        Adds a function that is called with a dictionary for every record
+        of training, evaluation and testing telemetry: the loss, learning
+        rate, throughput, data wait and compute time and peak memory.
+        See happytransformer.telemetry for the records. The settings
+        telemetry_path and telemetry_steps also write them to a file.
+
+        :param callback: a function that takes a dictionary
+        """
+        self.telemetry_callbacks.append(callback)
+
     def init_sequence_classifier(self):
         """
         Initializes a binary sequence classifier model with default settings
@@ -354,7 +447,8 @@ class HappyTransformer:
 
         # TODO Test the sequence classifier with other models
         args = classifier_args.copy()
-        self.seq = SequenceClassifier(args, self.tokenizer, self.logger, self.gpu_support, self.model, self.model_name)
+        self.seq = SequenceClassifier(args, self.tokenizer, self.logger, self.gpu_support, self.model, self.model_name,
+                                      callbacks=self.telemetry_callbacks)
 
         self.logger.info("A binary sequence classifier for %s has been initialized", self.model_name)
 
@@ -365,10 +459,40 @@ class HappyTransformer:
         This dictionary can then be modified and then used as the only input for this method.
 
         """
-        self.seq = SequenceClassifier(args, self.tokenizer, self.logger, self.gpu_support, self.model, self.model_name)
+        self.seq = SequenceClassifier(args, self.tokenizer, self.logger, self.gpu_support, self.model, self.model_name,
+                                      callbacks=self.telemetry_callbacks)
         self.logger.info("A binary sequence classifier for %s has been initialized", self.model_name)
 
-    def train_sequence_classifier(self, train_csv_path):
+    def save_sequence_classifier(self, path):
+        """
+        Saves the sequence classifier, with its settings, to a directory
+
+        :param path: A path to a directory. It is created if it does not exist
+        """
+        if self.seq is None:
+            self.logger.error("Initialize the sequence classifier before saving it")
+            exit()
+
+        self.seq.save(path)
+        self.logger.info("The sequence classifier has been saved to %s", path)
+
+    def load_sequence_classifier(self, path):
+        """
+        Loads a sequence classifier saved by save_sequence_classifier, ready
+        for evaluation, testing and predictions without training it again.
+        It must have been saved from the same type of model
+
+        :param path: A path to the directory the classifier was saved to
+        """
+        with open(os.path.join(path, CLASSIFIER_ARGS_FILE)) as args_file:
+            args = json.load(args_file)
+        self.seq = SequenceClassifier(args, self.tokenizer, self.logger, self.gpu_support, path, self.model_name,
+                                      callbacks=self.telemetry_callbacks)
+        self.seq_trained = True
+        self.logger.info("A binary sequence classifier for %s has been loaded from %s", self.model_name, path)
+
+    def train_sequence_classifier(self, train_csv_path, eval_csv_path=None, num_processes=1, num_nodes=1,
+                                  node_rank=0, rendezvous_address=None):
         """
         Trains the HappyTransformer's sequence classifier
 
@@ -376,113 +500,229 @@ class HappyTransformer:
             Each test is contained within a row.
             The first column is for the the correct answers, either 0 or 1 as an int or a string .
             The second column is for the text.
+            May also be a path to a Parquet, Arrow, JSON or JSON lines file, a
+            pandas DataFrame with "text" and "label" columns or a
+            (texts, labels) tuple.
+        :param eval_csv_path: Optional evaluation data, in the same formats.
+            It is evaluated during training to stop early once the model
+            stops improving and to keep the best model, see eval_steps,
+            early_stopping_metric, early_stopping_patience and
+            load_best_model in classifier_args.
+        :param num_processes: Number of processes that train the model
+            together on this machine's CPU cores, each on a share of every
+            epoch's batches, with their gradients averaged by torch.distributed.
+        :param num_nodes: Number of machines training together. Each
+            machine calls this method with the same data and settings.
+        :param node_rank: The index of this machine, from 0 to num_nodes - 1.
+        :param rendezvous_address: "host:port" of the machine with node_rank 0.
+            Only needed when num_nodes is more than 1.
         """
         self.logger.info("***** Running Training *****")
 
-        train_df = self.__process_classifier_data(train_csv_path)
-
         if self.seq is None:
             self.logger.error("Initialize the sequence classifier before training")
             exit()
+        if num_processes * num_nodes > 1 and self.seq.args["streaming"]:
+            self.logger.error("Streamed data can't be used for distributed training")
+            exit()
+        if num_nodes > 1 and rendezvous_address is None:
+            self.logger.error("A rendezvous_address is needed to train on several nodes")
+            exit()
+        if self.seq.args["freeze_encoder"] and (num_processes * num_nodes > 1 or self.seq.args["streaming"]):
+            self.logger.error("A frozen encoder is trained in a single process, without streaming")
+            exit()
+        if self.seq.args["freeze_encoder"] and (self.seq.args["checkpoint_dir"] or self.seq.args["resume_from"]):
+            self.logger.error("A frozen encoder trains in seconds, without checkpoints")
+            exit()
 
-        sys.stdout = open(os.devnull,
-                          'w')  # Disable printing to stop external libraries from printing
-        train_df = train_df.astype("str")
-        self.seq.train_list_data = train_df.values.tolist()
-        del train_df  # done with train_df
-        self.seq.train_model()
+        self.__prepare_classifier_data("train", train_csv_path)
+        if eval_csv_path is not None:
+            self.__prepare_classifier_data("eval", eval_csv_path)
+
+        with _printing_disabled():
+            self.seq.train_model(num_processes=num_processes, num_nodes=num_nodes, node_rank=node_rank,
+                                 rendezvous_address=rendezvous_address,
+                                 evaluate_during_training=eval_csv_path is not None)
         self.seq_trained = True
-        sys.stdout = sys.__stdout__  # Enable printing
 
-    def eval_sequence_classifier(self, eval_csv_path):
+    def distill_sequence_classifier(self, student, train_csv_path, eval_csv_path=None, labelled=True,
+                                    args=None):
+        """
+        Distills the trained sequence classifier, the teacher, into a
+        smaller student model that is trained on the teacher's logits. The
+        student then replaces the teacher for evaluation, testing and
+        predictions. When feature_cache_dir is set, the teacher's logits are
+        cached with the features, so distilling several students from the
+        same teacher and data only runs the teacher once.
+
+        :param student: One of
+            - a dictionary of changes to the teacher's config, such as
+              {"num_hidden_layers": 4} for BERT and RoBERTa or {"n_layer": 4}
+              for XLNet. The student starts from evenly spaced layers of
+              the teacher, and the weights whose shape did not change.
+            - a transformers config for a randomly initialized student
+            - the name or path of a pretrained model of the same type,
+              which must use the teacher's vocabulary
+        :param train_csv_path: The data to distill on, in any format
+            accepted by train_sequence_classifier. With labelled=False
+            it has only texts, like test data.
+        :param eval_csv_path: Optional evaluation data, which is used as
+            in train_sequence_classifier and to compare the teacher and the
+            student afterwards.
+        :param labelled: False for unlabelled train data, which the
+            student learns from the teacher's logits alone.
+        :param args: Changes to the teacher's settings for training the
+            student, see distillation_temperature and distillation_alpha
+            in classifier_args. The teacher's checkpoint_dir, resume_from,
+            warmup_steps, freeze_encoder and unfrozen_layers are reset to
+            their defaults. A student can't be trained with freeze_encoder.
+        :return: With eval data, a dictionary that compares the "teacher"
+            and the "student": their parameters, accuracy, F1, loss and
+            milliseconds per example, the student's "speedup" and its
+            "accuracy_change". Otherwise None.
+        """
+        self.logger.info("***** Running Distillation *****")
+
+        if not self.seq_trained:
+            self.logger.error("Train the sequence classifier before distilling it")
+            exit()
+        args = args or {}
+        if args.get("freeze_encoder"):
+            self.logger.error("A student can't be distilled with a frozen encoder")
+            exit()
+
+        teacher = self.seq
+        student_args = {**teacher.args, **{key: classifier_args[key] for key in TEACHER_ONLY_ARGS}, **args}
+        self.seq = SequenceClassifier(student_args, self.tokenizer, self.logger, self.gpu_support,
+                                      create_student(teacher.model, student), self.model_name,
+                                      callbacks=self.telemetry_callbacks)
+        self.seq.labelled["train"] = labelled
+
+        self.__prepare_classifier_data("train", train_csv_path)
+        if eval_csv_path is not None:
+            self.__prepare_classifier_data("eval", eval_csv_path)
+
+        with _printing_disabled():
+            self.seq.train_model(evaluate_during_training=eval_csv_path is not None, teacher=teacher)
+
+        return self.seq.stats.get("distillation")
+
+    def eval_sequence_classifier(self, eval_csv_path, return_logits=False, logits_path=None):
         """
         Evaluates the trained sequence classifier against a testing set.
 
-        :param csv_path: A path to the csv evaluation file.
+        :param eval_csv_path: A path to the csv evaluation file.
             Each test is contained within a row.
             The first column is for the the correct answers, either 0 or 1 as an int or a string .
             The second column is for the text.
-
-        :return: A dictionary evaluation matrix
+            May also be a path to a Parquet, Arrow, JSON or JSON lines file, a
+            pandas DataFrame with "text" and "label" columns or a
+            (texts, labels) tuple.
+        :param return_logits: add the logits of every example to the results under "logits"
+        :param logits_path: path of a .npy file to memory-map the logits to
+
+        :return: A dictionary with the confusion matrix counts, accuracy,
+            precision, recall, F1, approximate ROC AUC and loss
         """
 
         self.logger.info("***** Running evaluation *****")
 
-        sys.stdout = open(os.devnull, 'w')  # Disable printing
-
-        eval_df = self.__process_classifier_data(eval_csv_path)
-
         if not self.seq_trained:
             self.logger.error("Train the sequence classifier before evaluation")
             exit()
 
-        eval_df = eval_df.astype("str")
-        self.seq.eval_list_data = eval_df.values.tolist()
+        self.__prepare_classifier_data("eval", eval_csv_path)
 
-        results = self.seq.evaluate()
-        sys.stdout = sys.__stdout__  # Enable printing
+        with _printing_disabled():
+            results = self.seq.evaluate(return_logits=return_logits, logits_path=logits_path)
 
         return results
 
-    def test_sequence_classifier(self, test_csv_path):
+    def test_sequence_classifier(self, test_csv_path, return_logits=False, logits_path=None, output_path=None):
         """
 
         :param test_csv_path: a path to the csv evaluation file.
-            Each test is contained within a row.
-            The first column is for the the correct answers, either 0 or 1 as an int or a string .
-            The second column is for the text.
-        :return: A list of predictions where each prediction index is the same as the corresponding test's index
+            Each test is contained within a row, in a single column of text.
+            May also be a path to a Parquet, Arrow, JSON or JSON lines file, a
+            pandas DataFrame with a "text" column or a list of texts.
+        :param return_logits: also return the logits of every test
+        :param logits_path: path of a .npy file to memory-map the logits to
+        :param output_path: path of a .csv, .parquet or .npy file to stream
+            the predictions and label probabilities to, in the order of the
+            tests, instead of returning them. If a run is interrupted,
+            calling this again with the same output_path continues after
+            the last written row.
+        :return: A list of predictions where each prediction index is the same as the corresponding test's index.
+            With return_logits, a (predictions, logits) tuple. With output_path, None
         """
         self.logger.info("***** Running Testing *****")
-        sys.stdout = open(os.devnull, 'w')  # Disable printing
-
-        test_df = self.__process_classifier_data(test_csv_path, for_test_data=True)
 
         # todo finish
         if not self.seq_trained:
             self.logger.error("Train the sequence classifier before testing")
             exit()
+        if output_path is not None and (return_logits or logits_path is not None):
+            self.logger.error("Logits can't be returned when the predictions are written to output_path")
+            exit()
 
-        test_df = test_df.astype("str")
-        self.seq.test_list_data = test_df.values.tolist()
-        del test_df  # done with test_df
-
-        results = self.seq.test()
+        self.__prepare_classifier_data("test", test_csv_path)
 
-        sys.stdout = sys.__stdout__  # Enable printing
+        with _printing_disabled():
+            results = self.seq.test(return_logits=return_logits, logits_path=logits_path, output_path=output_path)
 
         return results
 
-    def __process_classifier_data(self, csv_path, for_test_data=False):
+    def predict_sequences(self, texts, batch_size=None, return_probabilities=True):
         """
-         Credit: This code was modified from this repository
-         https://github.com/ThilinaRajapakse/pytorch-transformers-classification
-        :param csv_path: Path to csv file that must be processed
-        :return: A Panda dataframe with the proper information for classification tasks
+        Classifies texts with the trained sequence classifier, without
+        writing them to a file first.
+
+        :param texts: a list of strings
+        :param batch_size: number of texts per batch, the classifier's batch_size by default.
+            Not used with the classifier's max_tokens_per_batch setting
+        :param return_probabilities: False to return the predicted labels
+        :return: a NumPy array with the probability of each label for each
+            text, or the predicted label of each text
         """
+        if not self.seq_trained:
+            self.logger.error("Train the sequence classifier before predicting")
+            exit()
 
-        if for_test_data:
-            with open(csv_path, 'r') as test_file:
-                reader = csv.reader(test_file)
-                text_list = list(reader)
-            # Blank values are required for the first column value the testing data to increase
-            # reusability of preprocessing methods between the tasks
-            blank_values = ["0"] * len(text_list)
-            data_frame = pd.DataFrame([*zip(blank_values, text_list)])
-            del blank_values  # done with blank_values
+        return self.seq.predict(texts, batch_size=batch_size,
+                                return_probabilities=return_probabilities)
 
+    def __prepare_classifier_data(self, task, data):
+        """
+        Gives the sequence classifier the data for a task. The data is
+        only read if it is not streamed and its features are not cached,
+        and only hashed when feature_cache_dir is set.
+        :param task: "train", "eval" or "test"
+        :param data: any input accepted by classifier_data.read_classifier_data
+        """
+        if self.seq.args["streaming"]:
+            if not is_csv_path(data):
+                self.logger.error("Only csv files can be streamed")
+                exit()
+            if self.seq.args["max_tokens_per_batch"]:
+                # the batches of a stream aren't known before it is read
+                self.logger.error("max_tokens_per_batch can't be used with streaming")
+                exit()
+            self.seq.data_paths[task] = data
+            return
+
+        # the data is only hashed to look up its cached features
+        caching = self.seq.args["feature_cache_dir"] is not None
+        self.seq.data_hashes[task] = None
+        if isinstance(data, str):
+            if caching:
+                self.seq.data_hashes[task] = file_sha256(data)
+                if self.seq.has_cached_features(task):
+                    return
+            self.seq.data[task] = read_classifier_data(data, labelled=self.seq.labelled[task])
         else:
-            data_frame = pd.read_csv(csv_path, header=None)
-
-        data_frame[0] = data_frame[0].astype("int")
-        data_frame = pd.DataFrame({
-            'id': range(len(data_frame)),
-            'label': data_frame[0],
-            'alpha': ['a'] * data_frame.shape[0],
-            'text': data_frame[1].replace(r'\n', ' ', regex=True)
-        })
-
-        return data_frame
+            self.seq.data[task] = read_classifier_data(data, labelled=self.seq.labelled[task])
+            if caching:
+                self.seq.data_hashes[task] = classifier_data_hash(self.seq.data[task])
 
     def init_train_mwp(self, args=None):
         """
@@ -508,7 +748,9 @@ class HappyTransformer:
                 self._get_masked_language_model()  # if already has self.mlm
                 # don't call this
             self.mwp_trainer = FinetuneMlm(self.mlm, self.mlm_args,
-                                           self.tokenizer, self.logger)
+                                           self.tokenizer, self.logger,
+                                           callbacks=self.telemetry_callbacks,
+                                           device=self.gpu_support)
 
             self.logger.info(
                 "You can now train a masked word prediction model using %s",
@@ -528,25 +770,18 @@ class HappyTransformer:
 
         """
 
-        if torch.cuda.is_available():
-            if self.mwp_trained and self.mwp_trainer:  # If model is trained
-                self.logger.warning("Training on the already fine-tuned model")
-                self.mwp_trainer.train(train_path)
+        if self.mwp_trained and self.mwp_trainer:  # If model is trained
+            self.logger.warning("Training on the already fine-tuned model")
+            self.mwp_trainer.train(train_path)
 
-            elif self.mwp_trainer and not self.mwp_trained:  # If trainer
-                # exists but isn't trained
-                self.mlm, self.tokenizer = self.mwp_trainer.train(train_path)
-                self.mwp_trained = True
+        elif self.mwp_trainer and not self.mwp_trained:  # If trainer
+            # exists but isn't trained
+            self.mlm, self.tokenizer = self.mwp_trainer.train(train_path)
+            self.mwp_trained = True
 
-            elif not self.mwp_trainer:  # If trainer doesn't exist
-                self.logger.error(
-                    "The model is not loaded, you should run init_train_mwp.")
-                sys.exit()
-
-        else:  # If the user doesn't have a gpu.
+        elif not self.mwp_trainer:  # If trainer doesn't exist
             self.logger.error(
-                "You are using %s, you must use a GPU to train a MLM",
-                self.gpu_support)
+                "The model is not loaded, you should run init_train_mwp.")
             sys.exit()
 
     def eval_mwp(self, eval_path: str, batch_size: int = 2):
@@ -572,3 +807,86 @@ class HappyTransformer:
         results = self.mwp_trainer.evaluate(eval_path, batch_size)
 
         return results
+
+    def prune(self, task, data, output_dir=None, args=None):
+        """
+        Prunes a model for faster inference: drops layers from the top of
+        the encoder, removes the attention heads that matter least for the
+        data, and fine-tunes the model briefly to recover accuracy. The
+        pruned model replaces the original one. Attention heads can only
+        be pruned from BERT and RoBERTa models.
+
+        :param task: The model to prune, and the kind of data:
+            - "mlm": the masked language model, with a list of texts or a
+              path to a .txt file with a text on each line
+            - "sequence_classifier": the trained sequence classifier, with
+              labelled data in any format accepted by train_sequence_classifier
+            - "nsp": HappyBERT's next sentence prediction model, with
+              (sentence_a, sentence_b, is_next) tuples
+            - "qa": HappyBERT's question answering model, with
+              (question, context, answer) tuples
+        :param data: The data that heads are scored on and the model is
+            evaluated and fine-tuned on.
+        :param output_dir: A directory to save the pruned model to. The
+            classifier is saved as by save_sequence_classifier, the other
+            models with their tokenizer, so that they load with
+            HappyBERT(output_dir) or HappyROBERTA(output_dir).
+        :param args: Changes to pruning_args, found in happytransformer.pruning.
+        :return: A dictionary with the loss, accuracy, milliseconds per
+            batch, examples per second, parameters and FLOPs per example
+            "before" and "after" pruning, and the "pruned_heads" of each layer.
+        """
+        args = {**pruning_args, **(args or {})}
+        if args["head_fraction"] and self.model_name == "XLNET":
+            self.logger.error("Attention heads can't be pruned from XLNET, only layers")
+            exit()
+
+        if task == "sequence_classifier":
+            if not self.seq_trained:
+                self.logger.error("Train the sequence classifier before pruning it")
+                exit()
+            model = self.seq.model
+            classifier_data = read_classifier_data(data)
+            batches = classifier_batches(self.tokenizer, text_list(classifier_data.texts),
+                                         [int(label) for label in classifier_data.labels], args)
+        elif task == "mlm":
+            self._prepare_mlm()
+            model = self.mlm
+            if isinstance(data, str):
+                with open(data, encoding="utf-8") as text_file:
+                    data = [line for line in text_file.read().split("\n") if line.strip()]
+            batches = mlm_batches(self.tokenizer, data, args)
+        elif task in ("nsp", "qa"):
+            if self.model_name != "BERT":
+                self.logger.error("Only HappyBERT has next sentence prediction and question answering models")
+                exit()
+            if task == "nsp":
+                if self.nsp is None:
+                    self._get_next_sentence_prediction()
+                model = self.nsp
+                batches = nsp_batches(self.tokenizer, data, args)
+            else:
+                if self.qa is None:
+                    self._get_question_answering()
+                model = self.qa
+                batches = qa_batches(self.tokenizer, data, args)
+        else:
+            self.logger.error("Unknown task %s. Use \"mlm\", \"sequence_classifier\", \"nsp\" or \"qa\"", task)
+            exit()
+
+        self.logger.info("***** Pruning the %s model *****", task)
+        report = prune_model(model, batches, args)
+        self.logger.info(
+            "Pruned %d heads: %.0f to %.0f MFLOPs per example, %.2f to %.2f accuracy", 
+            sum(len(heads) for heads in report["pruned_heads"].values()),
+            report["before"]["flops_per_example"] / 1e6, report["after"]["flops_per_example"] / 1e6,
+            report["before"]["accuracy"], report["after"]["accuracy"]
+        )
+
+        if output_dir is not None:
+            if task == "sequence_classifier":
+                self.seq.save(output_dir)
+            else:
+                model.save_pretrained(output_dir)
+                self.tokenizer.save_pretrained(output_dir)
+        return report
@@ -0,0 +1,188 @@
+"""
+Classification metrics that are updated one batch at a time, so that
+evaluating a data set never needs to hold all of its predictions.
+"""
+
+import numpy as np
+import torch
+
+
+class StreamingMetrics():
+    """
+    Accumulates a confusion matrix and histograms of the predicted
+    probabilities batch by batch.
+
+    The ROC AUC is approximated from the histograms, which places each
+    probability in one of roc_bins equal width bins. With the default 1000
+    bins it is within about 1e-3 of the exact value.
+
+    :param num_labels: number of classes
+    :param roc_bins: number of probability bins used for the ROC AUC
+    """
+
+    def __init__(self, num_labels=2, roc_bins=1000):
+        self.num_labels = num_labels
+        self.roc_bins = roc_bins
+        # confusion[label, prediction]
+        self.confusion = torch.zeros(num_labels * num_labels, dtype=torch.long)
+        # histograms[label, bin, is_label] counts the examples whose
+        # probability of label falls in bin
+        self.histograms = torch.zeros(num_labels * roc_bins * 2, dtype=torch.long)
+        self.loss = 0.0
+        self.batches = 0
+
+    def update(self, logits, labels, loss=None):
+        """
+        :param logits: (batch size, num_labels) tensor
+        :param labels: (batch size) tensor of correct labels
+        :param loss: optional mean loss of the batch
+        """
+        logits = logits.detach().float().cpu()
+        labels = labels.detach().cpu()
+        predictions = logits.argmax(dim=1)
+        self.confusion += torch.bincount(
+            labels * self.num_labels + predictions, minlength=self.num_labels * self.num_labels
+        )
+
+        probabilities = torch.softmax(logits, dim=1)
+        bins = (probabilities * self.roc_bins).long().clamp_(max=self.roc_bins - 1)
+        classes = torch.arange(self.num_labels).unsqueeze(0)
+        is_label = (labels.unsqueeze(1) == classes).long()
+        index = (classes * self.roc_bins + bins) * 2 + is_label
+        self.histograms += torch.bincount(index.flatten(), minlength=self.histograms.numel())
+
+        if loss is not None:
+            self.loss += float(loss)
+            self.batches += 1
+
+    def confusion_matrix(self):
+        """
+        :return: a (num_labels, num_labels) NumPy array where [i, j] is the
+                 number of examples with label i that were predicted as j
+        """
+        return self.confusion.view(self.num_labels, self.num_labels).numpy()
+
+    def roc_auc(self, label):
+        """
+        :return: the approximate one-vs-rest ROC AUC of label, or None if
+                 all of the examples have, or all don't have, the label
+        """
+        histogram = self.histograms.view(self.num_labels, self.roc_bins, 2)[label].double()
+        # walk the thresholds from the highest bin to the lowest
+        negatives, positives = histogram[:, 0].flip(0), histogram[:, 1].flip(0)
+        if positives.sum() == 0 or negatives.sum() == 0:
+            return None
+        true_positive_rate = torch.cat([torch.zeros(1, dtype=torch.double), positives.cumsum(0)]) / positives.sum()
+        false_positive_rate = torch.cat([torch.zeros(1, dtype=torch.double), negatives.cumsum(0)]) / negatives.sum()
+        return float(torch.trapz(true_positive_rate, false_positive_rate))
+
+    def report(self):
+        """
+        :return: a dictionary with the accuracy, precision, recall, F1 and
+                 ROC AUC. For binary classification these are for label 1,
+                 otherwise they are averaged over the labels. Binary
+                 reports also contain the counts of the confusion matrix
+        """
+        confusion = self.confusion_matrix().astype(np.float64)
+        total = confusion.sum()
+        true_positives = np.diag(confusion)
+        predicted = confusion.sum(axis=0)
+        actual = confusion.sum(axis=1)
+        precision = np.divide(true_positives, predicted, out=np.zeros_like(true_positives), where=predicted > 0)
+        recall = np.divide(true_positives, actual, out=np.zeros_like(true_positives), where=actual > 0)
+        f1_denominator = precision + recall
+        f1 = np.divide(2 * precision * recall, f1_denominator,
+                       out=np.zeros_like(true_positives), where=f1_denominator > 0)
+
+        report = {}
+        if self.num_labels == 2:
+            report.update({
+                "true_positive": int(confusion[1, 1]),
+                "true_negative": int(confusion[0, 0]),
+                "false_positive": int(confusion[0, 1]),
+                "false_negative": int(confusion[1, 0])
+            })
+            labels = [1]
+        else:
+            labels = list(range(self.num_labels))
+        roc_aucs = [self.roc_auc(label) for label in labels]
+        roc_aucs = [roc_auc for roc_auc in roc_aucs if roc_auc is not None]
+
+        report.update({
+            "accuracy": float(true_positives.sum() / total) if total else 0.0,
+            "precision": float(np.mean(precision[labels])),
+            "recall": float(np.mean(recall[labels])),
+            "f1": float(np.mean(f1[labels])),
+            "roc_auc": float(np.mean(roc_aucs)) if roc_aucs else None
+        })
+        if self.batches:
+            report["loss"] = self.loss / self.batches
+        return report
+
+
+class EarlyStopping():
+    """
+    Tracks a metric of the evaluations run while training, to keep the
+    best model and stop training once the metric stops improving.
+
+    :param metric: a key of the StreamingMetrics report. "loss" is
+                   minimized, the other metrics are maximized
+    :param patience: number of evaluations in a row without improvement
+                     after which training stops. None to never stop
+    """
+
+    def __init__(self, metric='loss', patience=None):
+        self.metric = metric
+        self.patience = patience
+        self.best_score = None
+        self.best_step = None
+        self.evaluations_without_improvement = 0
+
+    def update(self, step, report):
+        """
+        :param step: the training step of the evaluation
+        :param report: a StreamingMetrics report
+        :return: True if the score is the best one so far
+        """
+        score = report[self.metric]
+        if score is None:
+            improved = False
+        elif self.best_score is None:
+            improved = True
+        elif self.metric == 'loss':
+            improved = score < self.best_score
+        else:
+            improved = score > self.best_score
+
+        if improved:
+            self.best_score = score
+            self.best_step = step
+            self.evaluations_without_improvement = 0
+        else:
+            self.evaluations_without_improvement += 1
+        return improved
+
+    @property
+    def should_stop(self):
+        """
+        True once patience evaluations in a row did not improve the metric
+        """
+        return self.patience is not None and self.evaluations_without_improvement >= self.patience
+
+    def state_dict(self):
+        """
+        :return: the state to save in checkpoints
+        """
+        return {
+            'best_score': self.best_score,
+            'best_step': self.best_step,
+            'evaluations_without_improvement': self.evaluations_without_improvement
+        }
+
+    def load_state_dict(self, state):
+        """
+        :param state: a state returned by state_dict()
+        """
+        self.best_score = state['best_score']
+        self.best_step = state['best_step']
+        self.evaluations_without_improvement = state['evaluations_without_improvement']
@@ -8,7 +8,9 @@ under
 
 """
 
+import contextlib
 import logging
+import math
 import os
 import random
 
@@ -16,10 +18,16 @@ import numpy as np
 import torch
 from torch.utils.data import (DataLoader, Dataset, RandomSampler,
                               SequentialSampler)
-from tqdm import trange
-from tqdm.notebook import tqdm_notebook
+from tqdm import tqdm, trange
 from transformers import (AdamW)
 
+from happytransformer.checkpoint import (AsyncCheckpointer, latest_checkpoint,
+                                         load_checkpoint, rng_state,
+                                         set_rng_state)
+from happytransformer.batching import LengthGroupedSampler
+from happytransformer.packed_dataset import create_packed_dataset
+from happytransformer.telemetry import Telemetry
+
 try:
     from transformers import get_linear_schedule_with_warmup
 except ImportError:
@@ -43,14 +51,140 @@ class TextDataset(Dataset):
             tokenized_text = tokenizer.encode(line, max_length=block_size,
                                               add_special_tokens=True, pad_to_max_length=True)  # Get ids from text
             self.examples.append(tokenized_text)
+        self.pad_token_id = tokenizer.pad_token_id
 
     def __len__(self):
         return len(self.examples)
 
+    def lengths(self):
+        """
+        :return: the number of tokens of each example, without its padding
+        """
+        return [sum(token != self.pad_token_id for token in example) for example in self.examples]
+
     def __getitem__(self, item):
         return torch.tensor(self.examples[item])
 
 
+def _word_continuation_ids(tokenizer):
+    """
+    :return: a bool tensor that is True for the ids of tokens that continue
+             the word of the token before them: WordPiece tokens that start
+             with "##", and byte-level BPE and SentencePiece tokens that
+             don't start with a space marker
+    """
+    tokens = tokenizer.convert_ids_to_tokens(list(range(len(tokenizer))))
+    if any(token.startswith('##') for token in tokens):
+        continues = [token.startswith('##') for token in tokens]
+    else:
+        space = '\u0120' if any(token.startswith('\u0120') for token in tokens) else '\u2581'
+        continues = [not token.startswith(space) for token in tokens]
+    continues = torch.tensor(continues, dtype=torch.bool)
+    continues[tokenizer.all_special_ids] = False
+    return continues
+
+
+class MaskingCollator():
+    """
+    collate_fn that stacks examples and masks them for masked language
+    modeling, so that masking runs in the DataLoader's worker processes
+    while the model trains on earlier batches. Special tokens, including
+    padding, are found with a lookup tensor of the tokenizer's ids instead
+    of one tokenizer call per example, and are never masked.
+
+    Only tensors are kept, so the collator is cheap to send to the workers.
+
+    :param tokenizer: the model's tokenizer
+    :param mlm_probability: the share of the tokens, or of the words with
+           whole_word_mask, that are masked
+    :param whole_word_mask: mask every token of the words that are chosen,
+           instead of choosing tokens on their own
+    :param trim_padding: drop the columns that are padding in every
+           example, for examples that are padded on the right, so that a
+           batch is only as long as its longest example
+    """
+
+    def __init__(self, tokenizer, mlm_probability=0.15, whole_word_mask=False,
+                 trim_padding=False):
+        self.mlm_probability = mlm_probability
+        self.trim_padding = trim_padding
+        self.pad_token_id = tokenizer.pad_token_id
+        self.mask_token_id = tokenizer.convert_tokens_to_ids(
+            tokenizer.mask_token)
+        self.vocab_size = len(tokenizer)
+        self.special_ids = torch.zeros(self.vocab_size, dtype=torch.bool)
+        self.special_ids[tokenizer.all_special_ids] = True
+        self.continuation_ids = None
+        if whole_word_mask:
+            self.continuation_ids = _word_continuation_ids(tokenizer)
+
+    def __call__(self, examples):
+        batch = torch.stack(examples)
+        if self.trim_padding:
+            length = int((batch != self.pad_token_id).sum(dim=1).max())
+            batch = batch[:, :max(length, 1)]
+        return self.mask(batch)
+
+    def mask(self, inputs):
+        """
+        Masks a batch in place: of the chosen tokens, 80% are replaced with
+        the mask token, 10% with a random token and 10% are kept
+        :param inputs: a (batch size, sequence length) tensor of token ids
+        :return: the masked inputs and the labels, which are -100 for the
+                 tokens that were not chosen
+        """
+        labels = inputs.clone()
+        special = self.special_ids[inputs]
+        if self.continuation_ids is None:
+            probability_matrix = torch.full(labels.shape, self.mlm_probability)
+            probability_matrix.masked_fill_(special, value=0.0)
+            masked_indices = torch.bernoulli(probability_matrix).bool()
+        else:
+            # every token of a word looks up the draw at the position of
+            # the word's first token
+            word_starts = ~self.continuation_ids[inputs]
+            word_positions = torch.cummax(
+                torch.where(word_starts, torch.arange(inputs.shape[1]), 0),
+                dim=1).values
+            chosen_words = torch.rand(labels.shape) < self.mlm_probability
+            masked_indices = torch.gather(chosen_words, 1, word_positions) \
+                & ~special
+        labels[~masked_indices] = -100  # We only compute loss on masked tokens
+
+        indices_replaced = torch.bernoulli(torch.full(
+            labels.shape, 0.8)).bool() & masked_indices
+        inputs[indices_replaced] = self.mask_token_id
+
+        indices_random = torch.bernoulli(torch.full(
+            labels.shape, 0.5)).bool() & masked_indices & ~indices_replaced
+        random_words = torch.randint(
+            self.vocab_size, labels.shape, dtype=torch.long)
+        inputs[indices_random] = random_words[indices_random]
+        return inputs, labels
+
+
+def _dataloader(dataset, collator, batch_size, shuffle, max_tokens_per_batch,
+                num_workers=0):
+    """
+    :param collator: a MaskingCollator
+    :param max_tokens_per_batch: size the batches by their padded tokens
+           instead of batch_size examples, see batching.LengthGroupedSampler
+    :param num_workers: worker processes that collate and mask the batches
+           ahead of the training loop
+    :return: a DataLoader of masked (inputs, labels) batches
+    """
+    if max_tokens_per_batch:
+        batching = {'batch_sampler': LengthGroupedSampler(
+            dataset.lengths(), batch_size, shuffle=shuffle,
+            max_tokens=max_tokens_per_batch)}
+    else:
+        sampler = RandomSampler(dataset) if shuffle else \
+            SequentialSampler(dataset)
+        batching = {'sampler': sampler, 'batch_size': batch_size}
+    return DataLoader(dataset, collate_fn=collator, num_workers=num_workers,
+                      **batching)
+
+
 def set_seed(seed=42):
     """
     Sets seed for all random number generators available.
@@ -68,42 +202,42 @@ def mask_tokens(inputs, tokenizer):
     """ Prepare masked tokens inputs/labels for masked language modeling:
     80% MASK, 10% random, 10% original.
     * The standard implementation from Huggingface Transformers library *
+    Training masks its batches with a MaskingCollator in the DataLoader instead
+    """
+    return MaskingCollator(tokenizer).mask(inputs)
+
+
+def _num_threads(threads):
+    """
+    :param threads: number of threads torch runs operations with, or None
+    :return: a context that sets them and restores the previous number
+    """
+    if not threads:
+        return contextlib.nullcontext()
+
+    @contextlib.contextmanager
+    def set_threads():
+        previous = torch.get_num_threads()
+        torch.set_num_threads(threads)
+        try:
+            yield
+        finally:
+            torch.set_num_threads(previous)
+    return set_threads()
+
+
+def _autocast(device, bf16):
+    """
+    :return: a bfloat16 autocast context for device when bf16 is True
     """
-    labels = inputs.clone()
-    # We sample a few tokens in each sequence for masked-LM training
-    # (with probability args.mlm_probability defaults to 0.15 in Bert/RoBERTa)
-    # MLM Prob is 0.15 in examples
-    probability_matrix = torch.full(labels.shape, 0.15)
-    special_tokens_mask = [
-        tokenizer.get_special_tokens_mask(val, already_has_special_tokens=True)
-        for val in
-        labels.tolist()]
-    probability_matrix.masked_fill_(torch.tensor(
-        special_tokens_mask, dtype=torch.bool), value=0.0)
-    masked_indices = torch.bernoulli(probability_matrix).bool()
-    labels[~masked_indices] = -100  # We only compute loss on masked tokens
-
-    # 80% of the time, we replace masked input tokens with
-    # tokenizer.mask_token ([MASK])
-    indices_replaced = torch.bernoulli(torch.full(
-        labels.shape, 0.8)).bool() & masked_indices
-    inputs[indices_replaced] = tokenizer.convert_tokens_to_ids(
-        tokenizer.mask_token)
-
-    # 10% of the time, we replace masked input tokens with random word
-    indices_random = torch.bernoulli(torch.full(
-        labels.shape, 0.5)).bool() & masked_indices & ~indices_replaced
-    random_words = torch.randint(
-        len(tokenizer), labels.shape, dtype=torch.long)
-    inputs[indices_random] = random_words[indices_random]
-
-    # The rest of the time (10% of the time) we keep the masked input tokens
-    # unchanged
-    return inputs, labels
+    return torch.autocast(device_type=torch.device(device).type,
+                          dtype=torch.bfloat16, enabled=bf16)
 
 
 def train(model, tokenizer, train_dataset, batch_size, lr, adam_epsilon,
-          epochs):
+          epochs, checkpoint_dir=None, checkpoint_steps=500, resume_from=None,
+          checkpoints_to_keep=2, telemetry=None, max_tokens_per_batch=None, collator=None,
+          num_workers=0, gradient_accumulation_steps=1, bf16=False):
     """
 
     :param model: Bert Model to train
@@ -115,14 +249,37 @@ def train(model, tokenizer, train_dataset, batch_size, lr, adam_epsilon,
     1e-8
     :param epochs: Usually a single pass through the entire dataset is
     satisfactory
+    :param checkpoint_dir: Directory checkpoints are saved to in the
+    background every checkpoint_steps steps. None to disable
+    :param checkpoint_steps: Steps between checkpoints
+    :param resume_from: A checkpoint file, or a checkpoint directory to
+    resume from its latest checkpoint
+    :param checkpoints_to_keep: Number of most recent checkpoints kept,
+    older ones are deleted
+    :param telemetry: A telemetry.Telemetry that training steps are recorded to
+    :param max_tokens_per_batch: Size the batches by their tokens instead
+    of batch_size examples. Batches are then only padded to their longest line
+    :param collator: The MaskingCollator that masks the batches. By default
+    tokens are masked with a probability of 0.15
+    :param num_workers: DataLoader worker processes that mask batches while
+    the model trains
+    :param gradient_accumulation_steps: Batches whose gradients are added up
+    before each optimizer step
+    :param bf16: Run the model under bfloat16 autocast
     :return: Loss
     """
+    telemetry = telemetry or Telemetry()
+    device = next(model.parameters()).device
+    collator = collator or MaskingCollator(
+        tokenizer, trim_padding=bool(max_tokens_per_batch))
 
-    train_sampler = RandomSampler(train_dataset)
-    train_dataloader = DataLoader(
-        train_dataset, sampler=train_sampler, batch_size=batch_size)
+    train_dataloader = _dataloader(train_dataset, collator, batch_size,
+                                   True, max_tokens_per_batch, num_workers)
 
-    t_total = len(train_dataloader) // batch_size  # Total Steps
+    accumulation_steps = gradient_accumulation_steps
+    # Total optimizer steps
+    t_total = math.ceil(len(train_dataloader) / accumulation_steps) * \
+        int(epochs)
 
     # Prepare optimizer and schedule (linear warmup and decay)
     no_decay = ['bias', 'LayerNorm.weight']
@@ -137,61 +294,129 @@ def train(model, tokenizer, train_dataset, batch_size, lr, adam_epsilon,
     scheduler = get_linear_schedule_with_warmup(
         optimizer, 0, t_total)
 
-    # ToDo Case for fp16
-
     # Start of training loop
     logger.info("***** Running training *****")
     logger.info("  Num examples = %d", len(train_dataset))
     logger.info("  Batch size = %d", batch_size)
+    logger.info("  Gradient accumulation steps = %d", accumulation_steps)
+    logger.info("  Device = %s", device)
 
     model.train()
     global_step = 0
-    tr_loss, logging_loss = 0.0, 0.0
+    tr_loss = 0.0
     model.resize_token_embeddings(len(tokenizer))
+    start_epoch, start_step = 0, 0
+    training_state = None
+    resume_from = latest_checkpoint(resume_from)
+    if resume_from is not None:
+        training_state = load_checkpoint(resume_from, model, optimizer,
+                                         scheduler)
+        start_epoch = training_state['epoch']
+        start_step = training_state['step']
+        global_step = training_state['global_step']
+        tr_loss = training_state['tr_loss']
+        logger.info("Resuming training from %s at step %d", resume_from,
+                    global_step)
+        if start_step >= len(train_dataloader):
+            start_epoch, start_step = start_epoch + 1, 0
+            training_state['epoch_rng'] = training_state['rng']
+    checkpointer = None
+    if checkpoint_dir is not None:
+        checkpointer = AsyncCheckpointer(checkpoint_dir, keep=checkpoints_to_keep)
+
     model.zero_grad()
-    train_iterator = trange(int(epochs), desc="Epoch")
-    for _ in train_iterator:
-        epoch_iterator = tqdm_notebook(train_dataloader, desc="Iteration")
-        for batch in epoch_iterator:
-            inputs, labels = mask_tokens(batch, tokenizer)
-            inputs = inputs.to('cuda')  # Don't bother if you don't have a gpu
-            labels = labels.to('cuda')
-
-            outputs = model(inputs, masked_lm_labels=labels)
+    train_iterator = trange(start_epoch, int(epochs), desc="Epoch")
+    timer = telemetry.timer()
+    step_loss = 0.0
+    for epoch in train_iterator:
+        resuming = training_state is not None and epoch == start_epoch
+        if resuming:
+            # the batch order is drawn when the epoch starts
+            set_rng_state(training_state['epoch_rng'])
+        epoch_rng = rng_state()
+        batches = iter(train_dataloader)
+        if resuming:
+            for _ in range(start_step):
+                next(batches)
+            set_rng_state(training_state['rng'])
+        first_step = start_step if resuming else 0
+        epoch_iterator = tqdm(batches, desc="Iteration",
+                              total=len(train_dataloader),
+                              initial=first_step)
+        for step, (inputs, labels) in enumerate(timer(epoch_iterator),
+                                                start=first_step):
+            timer.add_batch(inputs != tokenizer.pad_token_id)
+            inputs = inputs.to(device)
+            labels = labels.to(device)
+
+            with _autocast(device, bf16):
+                outputs = model(inputs, labels=labels)
             # model outputs are always tuple in transformers (see doc)
-            loss = outputs[0]
+            # gradients of the accumulated batches add up to the gradient
+            # of their mean loss
+            loss = outputs[0] / accumulation_steps
 
             loss.backward()
             tr_loss += loss.item()
+            step_loss += loss.item()
 
-            # if (step + 1) % 1 == 0: # 1 here is a placeholder for gradient
-            # accumulation steps
+            # the last batches of an epoch update the model even if there
+            # are fewer than accumulation_steps of them
+            if (step + 1) % accumulation_steps and \
+                    step + 1 != len(train_dataloader):
+                continue
             torch.nn.utils.clip_grad_norm_(model.parameters(), max_norm=1)
             optimizer.step()
+            telemetry.train_step(global_step + 1, timer, step_loss,
+                                 scheduler.get_last_lr()[0])
+            step_loss = 0.0
             scheduler.step()
             model.zero_grad()
             global_step += 1
 
+            if checkpointer is not None and \
+                    global_step % checkpoint_steps == 0:
+                checkpointer.save(global_step, model, optimizer, scheduler, {
+                    'epoch': epoch, 'step': step + 1,
+                    'global_step': global_step, 'tr_loss': tr_loss,
+                    'epoch_rng': epoch_rng
+                })
+
+    if checkpointer is not None:
+        checkpointer.close()
+
     logger.info(" global_step = %s, average loss = %s", global_step, tr_loss)
 
     return model, tokenizer
 
 
-def create_dataset(tokenizer, file_path, block_size=512):
+def create_dataset(tokenizer, file_path, block_size=512, packed=False,
+                   cache_dir=None):
     """
     Creates a dataset object from file path.
     :param tokenizer: Bert tokenizer to create dataset
     :param file_path: Path where data is stored
     :param block_size: Should be in range of [0,512], viable choices are 64,
     128, 256, 512
+    :param packed: Concatenate the tokens of the file into full blocks of
+    block_size tokens instead of padding each line to block_size, see
+    packed_dataset.py
+    :param cache_dir: Where packed blocks are saved and reused. None keeps
+    them in memory
     :return: The dataset
     """
+    if packed:
+        return create_packed_dataset(tokenizer, file_path,
+                                     block_size=block_size,
+                                     cache_dir=cache_dir)
     dataset = TextDataset(tokenizer, file_path=file_path,
                           block_size=block_size)
     return dataset
 
 
-def evaluate(model, tokenizer, eval_dataset, batch_size):
+def evaluate(model, tokenizer, eval_dataset, batch_size, telemetry=None,
+             max_tokens_per_batch=None, collator=None, num_workers=0,
+             bf16=False):
     """
 
     :param model: Newly trained Bert model
@@ -199,11 +424,20 @@ def evaluate(model, tokenizer, eval_dataset, batch_size):
     :param eval_dataset:
     :param batch_size: More flexible than training, the user can get away
     with picking a higher batch_size
+    :param telemetry: A telemetry.Telemetry that the evaluation is recorded to
+    :param max_tokens_per_batch: Size the batches by their tokens instead
+    of batch_size examples
+    :param collator: The MaskingCollator that masks the batches
+    :param num_workers: DataLoader worker processes that mask batches
+    :param bf16: Run the model under bfloat16 autocast
     :return: The perplexity of the dataset
     """
-    eval_sampler = SequentialSampler(eval_dataset)  # Same order samplinng
-    eval_dataloader = DataLoader(
-        eval_dataset, sampler=eval_sampler, batch_size=batch_size)
+    telemetry = telemetry or Telemetry()
+    device = next(model.parameters()).device
+    collator = collator or MaskingCollator(
+        tokenizer, trim_padding=bool(max_tokens_per_batch))
+    eval_dataloader = _dataloader(eval_dataset, collator, batch_size,
+                                  False, max_tokens_per_batch, num_workers)
 
     # Eval!
     logger.info("***** Running evaluation *****")
@@ -214,14 +448,14 @@ def evaluate(model, tokenizer, eval_dataset, batch_size):
     model.eval()
 
     # Evaluation loop
-
-    for batch in tqdm_notebook(eval_dataloader, desc='Evaluating'):
-        inputs, labels = mask_tokens(batch, tokenizer)
-        inputs = inputs.to('cuda')
-        labels = labels.to('cuda')
-
-        with torch.no_grad():
-            outputs = model(inputs, masked_lm_labels=labels)
+    timer = telemetry.timer()
+    for inputs, labels in timer(tqdm(eval_dataloader, desc='Evaluating')):
+        timer.add_batch(inputs != tokenizer.pad_token_id)
+        inputs = inputs.to(device)
+        labels = labels.to(device)
+
+        with torch.no_grad(), _autocast(device, bf16):
+            outputs = model(inputs, labels=labels)
             lm_loss = outputs[0]
             eval_loss += lm_loss.mean().item()
         nb_eval_steps += 1
@@ -233,6 +467,7 @@ def evaluate(model, tokenizer, eval_dataset, batch_size):
         'perplexity': perplexity,
         'eval_loss': eval_loss
     }
+    telemetry.emit('eval', {**result, **timer.report()})
 
     return result
 
@@ -241,7 +476,23 @@ word_prediction_args = {
     "batch_size": 1,
     "epochs": 1,
     "lr": 5e-5,
-    "adam_epsilon": 1e-8
+    "adam_epsilon": 1e-8,
+    "checkpoint_dir": None,
+    "checkpoint_steps": 500,
+    "checkpoints_to_keep": 2,
+    "resume_from": None,
+    "telemetry_path": None,
+    "telemetry_steps": 1,
+    "max_tokens_per_batch": None,
+    "mlm_probability": 0.15,
+    "whole_word_mask": False,
+    "num_workers": 2,
+    "num_threads": None,
+    "gradient_accumulation_steps": 1,
+    "bf16": False,
+    "block_size": 512,
+    "packed": True,
+    "feature_cache_dir": None
 
 }
 
@@ -263,35 +514,94 @@ class FinetuneMlm():
 
     """
 
-    def __init__(self, mlm, args, tokenizer, logger):
+    def __init__(self, mlm, args, tokenizer, logger, callbacks=None,
+                 device=None):
         self.mlm = mlm
         self.tokenizer = tokenizer
         self.args = args
         self.logger = logger
+        self.device = torch.device(
+            device or ("cuda" if torch.cuda.is_available() else "cpu"))
+        # functions that are called with each telemetry record
+        self.callbacks = [] if callbacks is None else callbacks
+
+    def __create_dataset(self, file_path):
+        cache_dir = self.args.get("feature_cache_dir",
+                                  word_prediction_args["feature_cache_dir"])
+        if cache_dir is not None:
+            cache_dir = os.path.join(os.path.expanduser(cache_dir),
+                                     'mlm_blocks')
+        return create_dataset(self.tokenizer, file_path=file_path,
+                              block_size=self.args.get("block_size", 512),
+                              packed=self.args.get("packed", True),
+                              cache_dir=cache_dir)
+
+    def __collator(self):
+        return MaskingCollator(
+            self.tokenizer,
+            mlm_probability=self.args.get("mlm_probability", 0.15),
+            whole_word_mask=self.args.get("whole_word_mask", False),
+            trim_padding=bool(self.args.get("max_tokens_per_batch")))
+
+    def __num_threads(self):
+        """
+        :return: a context with the torch threads to train or evaluate with.
+                 On a CPU the cores that DataLoader workers don't use by default
+        """
+        threads = self.args.get("num_threads")
+        if threads is None and self.device.type == "cpu":
+            threads = max(1, torch.get_num_threads() -
+                          self.args.get("num_workers", 2))
+        return _num_threads(threads)
+
+    def __telemetry(self):
+        return Telemetry(self.callbacks, self.args.get("telemetry_path"),
+                         self.args.get("telemetry_steps", 1),
+                         device=self.device)
 
     def train(self, train_path):
         self.mlm.resize_token_embeddings(len(self.tokenizer))
         # Start Train
-        self.mlm.cuda()
-        train_dataset = create_dataset(
-            self.tokenizer, file_path=train_path)
-        self.mlm, self.tokenizer = train(self.mlm, self.tokenizer,
-                                         train_dataset,
-                                         batch_size=self.args["batch_size"],
-                                         epochs=self.args["epochs"],
-                                         lr=self.args["lr"],
-                                         adam_epsilon=self.args[
-                                             "adam_epsilon"])
+        self.mlm.to(self.device)
+        train_dataset = self.__create_dataset(train_path)
+        telemetry = self.__telemetry()
+        with self.__num_threads():
+            self.mlm, self.tokenizer = train(
+                self.mlm, self.tokenizer, train_dataset,
+                batch_size=self.args["batch_size"],
+                epochs=self.args["epochs"],
+                lr=self.args["lr"],
+                adam_epsilon=self.args["adam_epsilon"],
+                checkpoint_dir=self.args.get("checkpoint_dir"),
+                checkpoint_steps=self.args.get("checkpoint_steps", 500),
+                resume_from=self.args.get("resume_from"),
+                checkpoints_to_keep=self.args.get("checkpoints_to_keep", 2),
+                telemetry=telemetry,
+                max_tokens_per_batch=self.args.get("max_tokens_per_batch"),
+                collator=self.__collator(),
+                num_workers=self.args.get("num_workers", 2),
+                gradient_accumulation_steps=self.args.get(
+                    "gradient_accumulation_steps", 1),
+                bf16=self.args.get("bf16", False))
+        telemetry.close()
 
         del train_dataset
         self.mlm.cpu()
         return self.mlm, self.tokenizer
 
     def evaluate(self, test_path, batch_size):
-        self.mlm.cuda()
-        test_dataset = create_dataset(self.tokenizer, file_path=test_path)
-        result = evaluate(self.mlm, self.tokenizer, test_dataset,
-                          batch_size=batch_size)
+        self.mlm.to(self.device)
+        test_dataset = self.__create_dataset(test_path)
+        telemetry = self.__telemetry()
+        with self.__num_threads():
+            result = evaluate(
+                self.mlm, self.tokenizer, test_dataset,
+                batch_size=batch_size, telemetry=telemetry,
+                max_tokens_per_batch=self.args.get("max_tokens_per_batch"),
+                collator=self.__collator(),
+                num_workers=self.args.get("num_workers", 2),
+                bf16=self.args.get("bf16", False))
+        telemetry.close()
         del test_dataset
         self.mlm.cpu()
         return result
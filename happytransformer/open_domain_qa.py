@@ -0,0 +1,106 @@
+"""
+Open-domain question answering: retrieve passages from a PassageIndex
+with BM25, then read them with HappyBERT's question answering model.
+"""
+
+from collections import namedtuple
+
+from happytransformer.passage_index import PassageIndex
+
+OpenDomainAnswer = namedtuple('OpenDomainAnswer', [
+    'text', 'softmax', 'logit', 'passage_id', 'source', 'probability'
+])
+
+
+class OpenDomainQA():
+    """
+    Retriever-reader pipeline over a corpus of text files.
+
+    :param happy_bert: a HappyBERT object, used to read the passages
+    :param index: a PassageIndex, or a path to one
+    :param top_n: number of passages retrieved and read for each question
+    """
+
+    def __init__(self, happy_bert, index, top_n=10):
+        self.happy_bert = happy_bert
+        self.index = index if isinstance(index, PassageIndex) else PassageIndex(index)
+        self.top_n = top_n
+
+    def add_files(self, file_paths):
+        """
+        Adds text files to the index. Only new or changed files are indexed.
+        :param file_paths: list of paths to text files
+        :return: number of passages added
+        """
+        return self.index.add_files(file_paths)
+
+    def answers_to_questions(self, questions, k=3):
+        """
+        Answers questions against the whole corpus. The reader runs over
+        every retrieved (question, passage) pair in batches of
+        happy_bert.qa_args["batch_size"], and the answers from all passages
+        are ranked together by their probability within their passage.
+        Unlike span logits, these probabilities can be compared between
+        passages, and between the models of a QA cascade.
+
+        :param questions: list of questions to be answered
+        :param k: number of answers to return per question
+        :return: a list containing a list of OpenDomainAnswers for each
+                 question. probability is the answer's probability within
+                 its passage, softmax normalizes the probabilities of the
+                 k answers returned
+        """
+        tokenizer = self.happy_bert.tokenizer
+        question_ids = []
+        context_ids = []
+        retrieved = []
+        for question in questions:
+            ids = tokenizer.encode(question, add_special_tokens=False)
+            # [CLS] question [SEP] passage [SEP] must fit in the model
+            max_context_length = min(tokenizer.model_max_length, 512) - len(ids) - 3
+            passages = self.index.search(question, self.top_n)
+            retrieved.append(passages)
+            for passage in passages:
+                question_ids.append(ids)
+                context_ids.append(
+                    tokenizer.encode(passage.text, add_special_tokens=False)[:max_context_length]
+                )
+
+        all_spans = iter(self.happy_bert._spans_to_question_ids(question_ids, context_ids, k))
+        all_context_ids = iter(context_ids)
+        results = []
+        for passages in retrieved:
+            candidates = []
+            for passage in passages:
+                passage_ids = next(all_context_ids)
+                candidates.extend(
+                    (span.confidence, span.logit,
+                     tokenizer.decode(passage_ids[span.start_idx:span.end_idx + 1]), passage)
+                    for span in next(all_spans)
+                )
+            candidates = sorted(candidates, key=lambda candidate: candidate[0], reverse=True)[:k]
+            total = sum(confidence for confidence, _, _, _ in candidates)
+            results.append([
+                OpenDomainAnswer(
+                    text=text, softmax=confidence / total if total else 0.0, logit=logit,
+                    passage_id=passage.passage_id, source=passage.source, probability=confidence
+                )
+                for confidence, logit, text, passage in candidates
+            ])
+        return results
+
+    def answers_to_question(self, question, k=3):
+        """
+        :param question: The question to be answered
+        :param k: number of answers to return
+        :return: a list of OpenDomainAnswers, sorted by descending probability
+        """
+        return self.answers_to_questions([question], k)[0]
+
+    def answer_question(self, question):
+        """
+        :param question: The question to be answered
+        :return: The best answer found in the corpus, as a string
+        """
+        answers = self.answers_to_question(question, 1)
+        return answers[0].text if answers else ""
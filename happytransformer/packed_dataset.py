@@ -0,0 +1,213 @@
+"""
+Packed-block data set for masked language model fine-tuning.
+
+A text file is tokenized once, a chunk of lines at a time, and its tokens
+are concatenated and cut into blocks of block_size tokens, so that no
+compute is spent on padding. Each block starts and ends with the model's
+special tokens. The tokens at the end of the file that don't fill a block
+make a last block that is padded on the right, so that files shorter than
+a block can be used and evaluation covers every token. The blocks are written to a raw binary file and memory-mapped, so the
+corpus does not need to fit in memory. With a cache directory the file is
+kept in an entry named after the text file, the tokenizer and block_size,
+so training on the same file again skips tokenization. Otherwise it is
+written to a temporary directory that is removed with the data set.
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+
+import numpy as np
+import torch
+from torch.utils.data import Dataset
+
+from happytransformer.feature_cache import cache_entry, file_sha256, tokenizer_fingerprint
+
+BLOCKS_FILE = 'blocks.bin'
+METADATA_FILE = 'blocks.json'
+
+
+def packed_blocks_key(data_hash, tokenizer, block_size):
+    """
+    :param data_hash: hash of the text file, such as file_sha256(path)
+    :param tokenizer: the tokenizer used to build the blocks
+    :param block_size: number of tokens per block
+    :return: the name of the cache entry for these blocks
+    """
+    key = json.dumps([data_hash, tokenizer_fingerprint(tokenizer), block_size])
+    return hashlib.sha256(key.encode()).hexdigest()
+
+
+def _token_dtype(tokenizer):
+    """
+    :return: the smallest NumPy dtype that holds the tokenizer's ids
+    """
+    return 'uint16' if len(tokenizer) <= np.iinfo(np.uint16).max + 1 else 'int32'
+
+
+def _line_chunks(file_path, chunk_lines):
+    """
+    Yields lists of up to chunk_lines non-blank lines of a text file
+    """
+    chunk = []
+    with open(file_path, encoding="utf-8") as text_file:
+        for line in text_file:
+            line = line.strip()
+            if line:
+                chunk.append(line)
+            if len(chunk) == chunk_lines:
+                yield chunk
+                chunk = []
+    if chunk:
+        yield chunk
+
+
+def pack_blocks(tokenizer, file_path, block_size, chunk_lines=10000):
+    """
+    Yields (number of blocks, block_size) arrays of the packed blocks of a
+    text file. Tokens left over at the end of the file that do not fill a
+    block are yielded last, in a block that is padded on the right
+    """
+    prefix = tokenizer.build_inputs_with_special_tokens([])
+    content_size = block_size - len(prefix)
+    if content_size <= 0:
+        raise ValueError("block_size must be larger than {}".format(len(prefix)))
+    # the positions of the tokens of a block within build_inputs_with_special_tokens
+    marker = -1
+    template = np.array(tokenizer.build_inputs_with_special_tokens([marker] * content_size))
+    content = template == marker
+    dtype = _token_dtype(tokenizer)
+    leftover = np.zeros(0, dtype=np.int64)
+    for lines in _line_chunks(file_path, chunk_lines):
+        ids = tokenizer(lines, add_special_tokens=False)['input_ids']
+        tokens = np.concatenate([leftover] + [np.asarray(line_ids, dtype=np.int64) for line_ids in ids])
+        num_blocks = len(tokens) // content_size
+        leftover = tokens[num_blocks * content_size:]
+        if not num_blocks:
+            continue
+        blocks = np.tile(template, (num_blocks, 1))
+        blocks[:, content] = tokens[:num_blocks * content_size].reshape(num_blocks, content_size)
+        yield blocks.astype(dtype)
+    if len(leftover):
+        ids = tokenizer.build_inputs_with_special_tokens(leftover.tolist())
+        block = np.full((1, block_size), tokenizer.pad_token_id, dtype=np.int64)
+        block[0, :len(ids)] = ids
+        yield block.astype(dtype)
+
+
+class PackedBlockDataset(Dataset):
+    """
+    The (number of blocks, block_size) token ids of a text file, see
+    pack_blocks(). Every block is full except for the last one, which may
+    be padded on the right.
+
+    :param blocks: an array of blocks, usually a memory map
+    :param pad_token_id: the tokenizer's padding id
+    :param temporary_dir: a tempfile.TemporaryDirectory that holds the
+           blocks file, kept until the data set is garbage collected
+    """
+
+    def __init__(self, blocks, pad_token_id, temporary_dir=None):
+        self.blocks = blocks
+        self.pad_token_id = pad_token_id
+        self.temporary_dir = temporary_dir
+
+    def __len__(self):
+        return len(self.blocks)
+
+    def lengths(self):
+        """
+        :return: the number of tokens of each block, without its padding
+        """
+        if not len(self):
+            return []
+        # only the last block can be padded
+        last = int(np.count_nonzero(self.blocks[-1] != self.pad_token_id))
+        return [self.blocks.shape[1]] * (len(self) - 1) + [last]
+
+    def __getitem__(self, item):
+        return torch.from_numpy(self.blocks[item].astype(np.int64))
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        if isinstance(self.blocks, np.memmap):
+            # DataLoader workers that are spawned map the file again
+            # instead of receiving a copy of every block
+            state['blocks'] = (self.blocks.filename, self.blocks.dtype.str, self.blocks.shape)
+        # the main process removes the temporary directory, not the workers
+        state['temporary_dir'] = None
+        return state
+
+    def __setstate__(self, state):
+        if isinstance(state['blocks'], tuple):
+            filename, dtype, shape = state['blocks']
+            state['blocks'] = np.memmap(filename, dtype=dtype, mode='r', shape=shape)
+        self.__dict__.update(state)
+
+
+def load_packed_blocks(cache_dir, key):
+    """
+    :return: a memory map of the cached blocks, or None if they are not cached
+    """
+    entry = os.path.join(cache_dir, key)
+    if not os.path.isdir(entry):
+        return None
+    return _load_blocks(entry)
+
+
+def _load_blocks(entry):
+    """
+    :return: a memory map of the blocks written to a directory by _write_blocks()
+    """
+    with open(os.path.join(entry, METADATA_FILE)) as metadata_file:
+        metadata = json.load(metadata_file)
+    if not metadata['count']:
+        return np.zeros((0, metadata['block_size']), dtype=metadata['dtype'])
+    return np.memmap(os.path.join(entry, BLOCKS_FILE), dtype=metadata['dtype'], mode='r',
+                     shape=(metadata['count'], metadata['block_size']))
+
+
+def create_packed_dataset(tokenizer, file_path, block_size=512, cache_dir=None, chunk_lines=10000):
+    """
+    :param tokenizer: a transformers tokenizer
+    :param file_path: path to a text file
+    :param block_size: number of tokens per block
+    :param cache_dir: the blocks are saved here and reused. With None they
+           are written to a temporary directory
+    :param chunk_lines: number of lines tokenized at a time
+    :return: a PackedBlockDataset of the file
+    """
+    dataset = _create_packed_dataset(tokenizer, file_path, block_size, cache_dir, chunk_lines)
+    if not len(dataset):
+        raise ValueError("{} has no text".format(file_path))
+    return dataset
+
+
+def _write_blocks(entry, tokenizer, file_path, block_size, chunk_lines):
+    """
+    Writes the packed blocks of a text file and their metadata to a directory
+    """
+    count = 0
+    with open(os.path.join(entry, BLOCKS_FILE), 'wb') as blocks_file:
+        for chunk in pack_blocks(tokenizer, file_path, block_size, chunk_lines):
+            blocks_file.write(chunk.tobytes())
+            count += len(chunk)
+    with open(os.path.join(entry, METADATA_FILE), 'w') as metadata_file:
+        json.dump({'count': count, 'block_size': block_size, 'dtype': _token_dtype(tokenizer)},
+                  metadata_file)
+
+
+def _create_packed_dataset(tokenizer, file_path, block_size, cache_dir, chunk_lines):
+    if cache_dir is None:
+        temporary_dir = tempfile.TemporaryDirectory()
+        _write_blocks(temporary_dir.name, tokenizer, file_path, block_size, chunk_lines)
+        return PackedBlockDataset(_load_blocks(temporary_dir.name), tokenizer.pad_token_id, temporary_dir)
+
+    key = packed_blocks_key(file_sha256(file_path), tokenizer, block_size)
+    blocks = load_packed_blocks(cache_dir, key)
+    if blocks is None:
+        with cache_entry(cache_dir, key) as entry:
+            _write_blocks(entry, tokenizer, file_path, block_size, chunk_lines)
+        blocks = load_packed_blocks(cache_dir, key)
+    return PackedBlockDataset(blocks, tokenizer.pad_token_id)
@@ -0,0 +1,208 @@
+"""
+An on-disk BM25 passage index used to retrieve passages for
+open-domain question answering.
+
+The index is a single SQLite file that holds the passages and an inverted
+index from terms to the passages that contain them. Corpus statistics are
+read at search time, so new files can be appended to an existing index
+without rebuilding it.
+"""
+
+from collections import Counter, defaultdict, namedtuple
+import heapq
+import math
+import os
+import re
+import sqlite3
+
+RetrievedPassage = namedtuple('RetrievedPassage', [
+    'passage_id', 'source', 'text', 'score'
+])
+
+_TERM_PATTERN = re.compile(r"\w+")
+
+
+def _terms(text):
+    """
+    :param text: any string
+    :return: list of lower cased word terms in the text
+    """
+    return _TERM_PATTERN.findall(text.lower())
+
+
+def split_passages(text, passage_words=100):
+    """
+    Splits a document into passages. Paragraphs (separated by blank lines)
+    are kept together when they are short enough, and long paragraphs
+    are split into windows of passage_words words.
+    :param text: the text of a document
+    :param passage_words: maximum number of words in a passage
+    :return: list of passage strings
+    """
+    passages = []
+    for paragraph in re.split(r"\n\s*\n", text):
+        words = paragraph.split()
+        for start in range(0, len(words), passage_words):
+            passages.append(" ".join(words[start:start + passage_words]))
+    return passages
+
+
+class PassageIndex():
+    """
+    BM25 index over passages, stored in a SQLite file.
+
+    :param index_path: path to the index file. It is created if it does
+    not exist, otherwise new passages are appended to it
+    :param passage_words: maximum number of words in each passage
+    :param k1: BM25 term frequency saturation parameter
+    :param b: BM25 length normalization parameter
+    """
+
+    def __init__(self, index_path, passage_words=100, k1=1.5, b=0.75):
+        self.index_path = index_path
+        self.passage_words = passage_words
+        self.k1 = k1
+        self.b = b
+        self.connection = sqlite3.connect(index_path)
+        with self.connection:
+            self.connection.executescript("""
+                CREATE TABLE IF NOT EXISTS sources (
+                    source TEXT PRIMARY KEY, modified REAL, size INTEGER
+                );
+                CREATE TABLE IF NOT EXISTS passages (
+                    passage_id INTEGER PRIMARY KEY, source TEXT,
+                    text TEXT, length INTEGER
+                );
+                CREATE TABLE IF NOT EXISTS postings (
+                    term TEXT, passage_id INTEGER, frequency INTEGER
+                );
+                CREATE TABLE IF NOT EXISTS statistics (
+                    name TEXT PRIMARY KEY, value INTEGER
+                );
+                INSERT OR IGNORE INTO statistics VALUES ('passages', 0), ('length', 0);
+                CREATE INDEX IF NOT EXISTS postings_term ON postings (term);
+                CREATE INDEX IF NOT EXISTS postings_passage ON postings (passage_id);
+                CREATE INDEX IF NOT EXISTS passages_source ON passages (source);
+            """)
+
+    def __len__(self):
+        return self.connection.execute(
+            "SELECT value FROM statistics WHERE name = 'passages'"
+        ).fetchone()[0]
+
+    def close(self):
+        self.connection.close()
+
+    def add_files(self, file_paths):
+        """
+        Indexes text files. Files that were already indexed and have not
+        changed since are skipped. Files that have changed are re-indexed.
+        :param file_paths: list of paths to text files
+        :return: number of passages added
+        """
+        added = 0
+        for file_path in file_paths:
+            source = os.path.abspath(file_path)
+            status = os.stat(source)
+            indexed = self.connection.execute(
+                "SELECT modified, size FROM sources WHERE source = ?", (source,)
+            ).fetchone()
+            if indexed == (status.st_mtime, status.st_size):
+                continue
+            with open(source, encoding="utf-8") as text_file:
+                text = text_file.read()
+            with self.connection:
+                self._remove_source(source)
+                added += self._add_passages(split_passages(text, self.passage_words), source)
+                self.connection.execute(
+                    "INSERT OR REPLACE INTO sources VALUES (?, ?, ?)",
+                    (source, status.st_mtime, status.st_size)
+                )
+        return added
+
+    def add_texts(self, texts, source=None):
+        """
+        Indexes documents that are already in memory
+        :param texts: list of document strings
+        :param source: optional name stored with each passage
+        :return: number of passages added
+        """
+        with self.connection:
+            return sum(
+                self._add_passages(split_passages(text, self.passage_words), source)
+                for text in texts
+            )
+
+    def _add_passages(self, passages, source):
+        added = 0
+        for passage in passages:
+            terms = _terms(passage)
+            if not terms:
+                continue
+            cursor = self.connection.execute(
+                "INSERT INTO passages (source, text, length) VALUES (?, ?, ?)",
+                (source, passage, len(terms))
+            )
+            self.connection.executemany(
+                "INSERT INTO postings VALUES (?, ?, ?)",
+                [(term, cursor.lastrowid, frequency) for term, frequency in Counter(terms).items()]
+            )
+            self._update_statistics(1, len(terms))
+            added += 1
+        return added
+
+    def _remove_source(self, source):
+        count, length = self.connection.execute(
+            "SELECT COUNT(*), COALESCE(SUM(length), 0) FROM passages WHERE source = ?",
+            (source,)
+        ).fetchone()
+        if count == 0:
+            return
+        self.connection.execute(
+            "DELETE FROM postings WHERE passage_id IN "
+            "(SELECT passage_id FROM passages WHERE source = ?)", (source,)
+        )
+        self.connection.execute("DELETE FROM passages WHERE source = ?", (source,))
+        self._update_statistics(-count, -length)
+
+    def _update_statistics(self, passages, length):
+        self.connection.executemany(
+            "UPDATE statistics SET value = value + ? WHERE name = ?",
+            [(passages, 'passages'), (length, 'length')]
+        )
+
+    def search(self, query, top_n=10):
+        """
+        Finds the passages that best match the query with BM25
+        :param query: the text to search for, such as a question
+        :param top_n: number of passages to return
+        :return: list of RetrievedPassages, sorted by descending score
+        """
+        statistics = dict(self.connection.execute("SELECT name, value FROM statistics"))
+        passage_count = statistics['passages']
+        if passage_count == 0:
+            return []
+        average_length = statistics['length'] / passage_count
+
+        scores = defaultdict(float)
+        for term in set(_terms(query)):
+            postings = self.connection.execute(
+                "SELECT postings.passage_id, frequency, length FROM postings "
+                "JOIN passages ON postings.passage_id = passages.passage_id "
+                "WHERE term = ?", (term,)
+            ).fetchall()
+            if not postings:
+                continue
+            idf = math.log(1 + (passage_count - len(postings) + 0.5) / (len(postings) + 0.5))
+            for passage_id, frequency, length in postings:
+                normalization = self.k1 * (1 - self.b + self.b * length / average_length)
+                scores[passage_id] += idf * frequency * (self.k1 + 1) / (frequency + normalization)
+
+        best = heapq.nlargest(top_n, scores.items(), key=lambda item: item[1])
+        passages = []
+        for passage_id, score in best:
+            source, text = self.connection.execute(
+                "SELECT source, text FROM passages WHERE passage_id = ?", (passage_id,)
+            ).fetchone()
+            passages.append(RetrievedPassage(passage_id, source, text, score))
+        return passages
@@ -0,0 +1,266 @@
+"""
+Writers that stream the predictions of a sequence classifier to a csv,
+Parquet or .npy file, for test data too large to keep its predictions in
+memory.
+
+Batches arrive in any order, since they are grouped by length, and are
+written in input order. Rows are committed chunk_size at a time, so when
+a run is interrupted, opening the same output again resumes after the
+last committed row.
+
+Each output row has the predicted label and the probability of each
+label. csv files have a header with the "label" and "probability_<label
+index>" columns and Parquet files have the same columns. .npy files hold
+a (rows, labels) float32 array of probabilities, whose argmax is the
+predicted label.
+"""
+
+import csv
+import glob
+import os
+import shutil
+
+import numpy as np
+
+CSV_EXTENSIONS = ('.csv',)
+PARQUET_EXTENSIONS = ('.parquet', '.pq')
+NPY_EXTENSIONS = ('.npy',)
+# suffixes of the files that hold an unfinished output
+PARTS_SUFFIX = '.parts'
+ROWS_SUFFIX = '.rows'
+
+
+def _import_pyarrow():
+    try:
+        import pyarrow  # pylint: disable=import-outside-toplevel
+    except ImportError:
+        raise ImportError("Writing Parquet files requires pyarrow: pip install pyarrow")
+    return pyarrow
+
+
+def _column_names(num_labels):
+    return ['label'] + ['probability_{}'.format(label) for label in range(num_labels)]
+
+
+def _replace_text(path, text):
+    with open(path + '.tmp', 'w') as text_file:
+        text_file.write(text)
+    os.replace(path + '.tmp', path)
+
+
+class PredictionWriter():
+    """
+    Base class of the writers, which put the rows added by add() in input
+    order and pass them to _write() once they follow the rows written so far
+
+    :param output_path: path of the output file
+    :param num_rows: number of rows of the test data
+    :param num_labels: number of labels of the classifier
+    :param chunk_size: rows added between writes. Rows are only committed
+           when they are written
+    """
+
+    def __init__(self, output_path, num_rows, num_labels, chunk_size=10000):
+        self.output_path = output_path
+        self.num_rows = num_rows
+        self.num_labels = num_labels
+        self.chunk_size = chunk_size
+        self.rows_written = self._open()
+        if self.rows_written > num_rows:
+            raise ValueError("{} has more rows than the test data".format(output_path))
+        self.pending_indices = []
+        self.pending_probabilities = []
+        self.num_pending = 0
+        self.write_at = chunk_size
+
+    def _open(self):
+        """
+        Opens the output, keeping the rows committed by an earlier run
+        :return: the number of committed rows
+        """
+        raise NotImplementedError
+
+    def _write(self, probabilities):
+        """
+        Appends and commits rows of probabilities
+        """
+        raise NotImplementedError
+
+    def _finish(self):
+        """
+        Called once every row has been written
+        """
+
+    def add(self, indices, probabilities):
+        """
+        :param indices: input positions of the rows, in any order
+        :param probabilities: a (len(indices), num_labels) array
+        """
+        self.pending_indices.append(np.asarray(indices, dtype=np.int64))
+        self.pending_probabilities.append(np.asarray(probabilities, dtype=np.float32))
+        self.num_pending += len(indices)
+        if self.num_pending >= self.write_at:
+            self.__write_ready()
+            # rows that wait for a missing row are only sorted again
+            # once another chunk has been added
+            self.write_at = self.num_pending + self.chunk_size
+
+    def __write_ready(self):
+        """
+        Writes the pending rows that follow the rows written so far
+        """
+        if not self.num_pending:
+            return
+        indices = np.concatenate(self.pending_indices)
+        probabilities = np.concatenate(self.pending_probabilities)
+        order = np.argsort(indices, kind='stable')
+        indices, probabilities = indices[order], probabilities[order]
+        in_place = indices == np.arange(self.rows_written, self.rows_written + len(indices))
+        ready = len(indices) if in_place.all() else int(np.argmin(in_place))
+        if ready:
+            self._write(probabilities[:ready])
+            self.rows_written += ready
+        self.pending_indices, self.pending_probabilities = [indices[ready:]], [probabilities[ready:]]
+        self.num_pending = len(indices) - ready
+
+    def close(self):
+        """
+        Writes the remaining rows and finishes the output
+        """
+        self.__write_ready()
+        if self.rows_written != self.num_rows:
+            raise ValueError("Predictions are missing for {} rows".format(self.num_rows - self.rows_written))
+        self._finish()
+
+
+class CSVPredictionWriter(PredictionWriter):
+    """
+    Appends rows to a csv file, which is flushed after every write
+    """
+
+    def _open(self):
+        if not os.path.isfile(self.output_path):
+            with open(self.output_path, 'w', newline='') as csv_file:
+                csv.writer(csv_file).writerow(_column_names(self.num_labels))
+            return 0
+        lines = 0
+        last_line_end = 0
+        position = 0
+        with open(self.output_path, 'rb') as csv_file:
+            for block in iter(lambda: csv_file.read(1 << 20), b''):
+                lines += block.count(b'\n')
+                if b'\n' in block:
+                    last_line_end = position + block.rindex(b'\n') + 1
+                position += len(block)
+        if last_line_end != position:
+            # a row that was cut off by the interruption is written again
+            with open(self.output_path, 'r+b') as csv_file:
+                csv_file.truncate(last_line_end)
+        return max(lines - 1, 0)  # the header is not a row
+
+    def _write(self, probabilities):
+        rows = np.column_stack([probabilities.argmax(axis=1), probabilities])
+        with open(self.output_path, 'a') as csv_file:
+            np.savetxt(csv_file, rows, fmt=['%d'] + ['%.7g'] * self.num_labels, delimiter=',')
+
+
+class ParquetPredictionWriter(PredictionWriter):
+    """
+    Writes each chunk to a Parquet file in a "<output_path>.parts"
+    directory, since a Parquet file can't be appended to, and joins the
+    parts into output_path once every row has been written
+    """
+
+    def _open(self):
+        _import_pyarrow()
+        import pyarrow.parquet as pq  # pylint: disable=import-outside-toplevel
+        self.parts_dir = self.output_path + PARTS_SUFFIX
+        if os.path.isfile(self.output_path) and not os.path.isdir(self.parts_dir):
+            # finished by an earlier run, which had the same test data
+            num_rows = pq.read_metadata(self.output_path).num_rows
+            if num_rows != self.num_rows:
+                raise ValueError("{} has {} rows, not {}".format(self.output_path, num_rows, self.num_rows))
+            return num_rows
+        os.makedirs(self.parts_dir, exist_ok=True)
+        return sum(pq.read_metadata(part).num_rows for part in self.__parts())
+
+    def __parts(self):
+        return sorted(glob.glob(os.path.join(self.parts_dir, 'part-*.parquet')))
+
+    def _write(self, probabilities):
+        pyarrow = _import_pyarrow()
+        import pyarrow.parquet as pq  # pylint: disable=import-outside-toplevel
+        columns = [pyarrow.array(probabilities.argmax(axis=1))]
+        columns += [pyarrow.array(probabilities[:, label]) for label in range(self.num_labels)]
+        table = pyarrow.Table.from_arrays(columns, names=_column_names(self.num_labels))
+        # parts are named after their first row, so they sort in input order
+        part = os.path.join(self.parts_dir, 'part-{:012d}.parquet'.format(self.rows_written))
+        pq.write_table(table, part + '.tmp')
+        os.replace(part + '.tmp', part)
+
+    def _finish(self):
+        if not os.path.isdir(self.parts_dir):
+            return  # finished by an earlier run
+        import pyarrow.parquet as pq  # pylint: disable=import-outside-toplevel
+        if not self.__parts():
+            # the test data is empty
+            self._write(np.zeros((0, self.num_labels), dtype=np.float32))
+        parts = self.__parts()
+        with pq.ParquetWriter(self.output_path + '.tmp', pq.read_schema(parts[0])) as parquet_writer:
+            for part in parts:
+                parquet_writer.write_table(pq.read_table(part))
+        os.replace(self.output_path + '.tmp', self.output_path)
+        shutil.rmtree(self.parts_dir)
+
+
+class NpyPredictionWriter(PredictionWriter):
+    """
+    Writes the probabilities to a memory-mapped .npy file of num_rows rows.
+    The number of committed rows is kept in "<output_path>.rows" until the
+    output is finished
+    """
+
+    def _open(self):
+        self.rows_path = self.output_path + ROWS_SUFFIX
+        shape = (self.num_rows, self.num_labels)
+        if not os.path.isfile(self.output_path):
+            self.probabilities = np.lib.format.open_memmap(self.output_path, mode='w+',
+                                                           dtype=np.float32, shape=shape)
+            _replace_text(self.rows_path, '0')
+            return 0
+        self.probabilities = np.load(self.output_path, mmap_mode='r+')
+        if self.probabilities.shape != shape:
+            raise ValueError("{} has {} probabilities, not {}".format(
+                self.output_path, self.probabilities.shape, shape))
+        if not os.path.isfile(self.rows_path):
+            return self.num_rows
+        with open(self.rows_path) as rows_file:
+            return int(rows_file.read())
+
+    def _write(self, probabilities):
+        self.probabilities[self.rows_written:self.rows_written + len(probabilities)] = probabilities
+        self.probabilities.flush()
+        _replace_text(self.rows_path, str(self.rows_written + len(probabilities)))
+
+    def _finish(self):
+        del self.probabilities
+        if os.path.isfile(self.rows_path):
+            os.remove(self.rows_path)
+
+
+def open_prediction_writer(output_path, num_rows, num_labels, chunk_size=10000):
+    """
+    :param output_path: a .csv, .parquet or .npy path. An unfinished
+           output at this path is resumed
+    :return: a PredictionWriter for the file type of output_path
+    """
+    extension = os.path.splitext(output_path)[1].lower()
+    if extension in CSV_EXTENSIONS:
+        writer_class = CSVPredictionWriter
+    elif extension in PARQUET_EXTENSIONS:
+        writer_class = ParquetPredictionWriter
+    elif extension in NPY_EXTENSIONS:
+        writer_class = NpyPredictionWriter
+    else:
+        raise ValueError("Unsupported output file type: " + output_path)
+    return writer_class(output_path, num_rows, num_labels, chunk_size)
@@ -0,0 +1,382 @@
+"""
+Structured pruning of transformer models for faster inference.
+
+Attention heads are scored by how much the loss on a user-provided data
+set changes when they are masked, following "Are Sixteen Heads Really
+Better than One?" (Michel et al., 2019), and the least important heads
+are removed from the weight matrices. Whole layers can be dropped from
+the top of the encoder. Pruned models are saved with save_pretrained,
+which records the pruned heads and the number of layers in their config,
+so from_pretrained rebuilds the smaller model.
+
+Head pruning is supported for BERT and RoBERTa models, layer dropping for
+BERT, RoBERTa and XLNet models.
+"""
+
+import itertools
+import time
+
+import torch
+from transformers import AdamW
+
+from happytransformer.distillation import count_parameters
+from happytransformer.mlm_utils import mask_tokens
+
+pruning_args = {
+    # fraction of all of the attention heads to remove, least important first.
+    # Every layer keeps at least one head
+    "head_fraction": 0.0,
+    # number of layers removed from the top of the encoder
+    "layers_to_drop": 0,
+    # fine-tuning steps after pruning to recover accuracy. 0 to skip
+    "recovery_steps": 0,
+    "learning_rate": 2e-5,
+    # examples per batch of the pruning data
+    "batch_size": 8,
+    # longer texts of the pruning data are truncated
+    "max_seq_length": 128,
+}
+
+
+def encoder_layers(model):
+    """
+    :return: the nn.ModuleList of a BERT, RoBERTa or XLNet model's layers
+    """
+    base_model = model.base_model
+    if hasattr(base_model, 'encoder'):
+        return base_model.encoder.layer
+    return base_model.layer
+
+
+def model_device(model):
+    """
+    :return: the device of a model's parameters
+    """
+    return next(model.parameters()).device
+
+
+def remaining_heads(model, layer_index):
+    """
+    :return: the original indices of the heads of a BERT or RoBERTa layer
+             that have not been pruned
+    """
+    attention = encoder_layers(model)[layer_index].attention
+    return [head for head in range(model.config.num_attention_heads) if head not in attention.pruned_heads]
+
+
+def _check_head_pruning(model):
+    if not hasattr(encoder_layers(model)[0], 'attention'):
+        raise ValueError("Attention heads can only be pruned from BERT and RoBERTa models")
+
+
+def _to_device(batch, device):
+    return {name: tensor.to(device) for name, tensor in batch.items()}
+
+
+def head_importance(model, batches):
+    """
+    Scores every head by the gradient of the loss with respect to a gate
+    on the head's output, accumulated over the batches. Scores are
+    normalized within each layer
+    :param batches: a list of dictionaries of model inputs, with labels
+    :return: a list with a tensor of scores for the remaining heads of each layer
+    """
+    _check_head_pruning(model)
+    layers = encoder_layers(model)
+    gates = [torch.ones(layer.attention.self.num_attention_heads, requires_grad=True) for layer in layers]
+    head_size = layers[0].attention.self.attention_head_size
+    device = model_device(model)
+
+    def gate_heads(gate):
+        def hook(_, inputs):
+            # the input of the output projection is the concatenated
+            # context of the heads, so scaling a slice scales one head
+            context = inputs[0]
+            gate_values = gate.to(context.device, context.dtype).repeat_interleave(head_size)
+            return (context * gate_values,)
+        return hook
+
+    handles = [
+        layer.attention.output.dense.register_forward_pre_hook(gate_heads(gate))
+        for layer, gate in zip(layers, gates)
+    ]
+    importance = [torch.zeros(len(gate)) for gate in gates]
+    was_training = model.training
+    model.eval()
+    try:
+        for batch in batches:
+            loss = model(**_to_device(batch, device)).loss
+            gradients = torch.autograd.grad(loss, gates)
+            for scores, gradient in zip(importance, gradients):
+                scores += gradient.abs().detach().cpu()
+    finally:
+        for handle in handles:
+            handle.remove()
+        model.train(was_training)
+
+    return [scores / (scores.norm() + 1e-20) for scores in importance]
+
+
+def prune_least_important_heads(model, importance, fraction):
+    """
+    :param importance: the scores returned by head_importance()
+    :param fraction: fraction of the model's remaining heads to remove
+    :return: a dictionary of the original indices of the heads that were
+             removed from each layer
+    """
+    _check_head_pruning(model)
+    num_heads = sum(len(scores) for scores in importance)
+    to_prune = int(num_heads * fraction)
+    candidates = sorted(
+        (float(score), layer, position)
+        for layer, scores in enumerate(importance)
+        for position, score in enumerate(scores)
+    )
+    kept = [len(scores) for scores in importance]
+    heads_to_prune = {}
+    for _, layer, position in candidates:
+        if to_prune == 0:
+            break
+        if kept[layer] == 1:
+            continue
+        heads_to_prune.setdefault(layer, []).append(remaining_heads(model, layer)[position])
+        kept[layer] -= 1
+        to_prune -= 1
+    model.prune_heads(heads_to_prune)
+    return heads_to_prune
+
+
+def drop_top_layers(model, num_layers):
+    """
+    Removes the top num_layers layers of the encoder
+    """
+    layers = encoder_layers(model)
+    keep = len(layers) - num_layers
+    if keep < 1:
+        raise ValueError("The model has {} layers, so at most {} can be dropped".format(len(layers), len(layers) - 1))
+    del layers[keep:]
+    model.config.num_hidden_layers = keep
+    model.config.pruned_heads = {
+        layer: heads for layer, heads in model.config.pruned_heads.items() if int(layer) < keep
+    }
+
+
+def count_flops(model, batch):
+    """
+    Counts the floating point operations of a forward pass over a batch:
+    the matrix multiplications of the linear layers and of the attention
+    :param batch: a dictionary of model inputs
+    :return: the number of operations
+    """
+    flops = [0]
+
+    def count_linear(module, inputs, _):
+        tokens = inputs[0].numel() // module.in_features
+        flops[0] += 2 * tokens * module.in_features * module.out_features
+
+    handles = [
+        module.register_forward_hook(count_linear)
+        for module in model.modules() if isinstance(module, torch.nn.Linear)
+    ]
+    inputs = {name: tensor for name, tensor in batch.items() if name in ('input_ids', 'attention_mask', 'token_type_ids')}
+    try:
+        with torch.no_grad():
+            model.eval()
+            model(**_to_device(inputs, model_device(model)))
+    finally:
+        for handle in handles:
+            handle.remove()
+
+    batch_size, seq_length = batch['input_ids'].shape
+    for layer in encoder_layers(model):
+        if hasattr(layer, 'attention'):
+            # query x key and attention x value
+            flops[0] += 4 * batch_size * seq_length ** 2 * layer.attention.self.all_head_size
+        else:
+            # the query, key, value, output and position projections of
+            # XLNet are einsums rather than linear layers
+            attention = layer.rel_attn
+            heads = attention.n_head * attention.d_head
+            flops[0] += 2 * batch_size * seq_length * attention.d_model * heads * 5
+            flops[0] += 6 * batch_size * seq_length ** 2 * heads
+    return flops[0]
+
+
+def _correct_predictions(outputs, batch):
+    """
+    :return: the number of correct predictions in a batch and the number of predictions
+    """
+    if 'start_positions' in batch:
+        correct = (outputs.start_logits.argmax(dim=1) == batch['start_positions']) & \
+                  (outputs.end_logits.argmax(dim=1) == batch['end_positions'])
+        return int(correct.sum()), correct.numel()
+    labels = batch['labels']
+    predictions = outputs.logits.argmax(dim=-1)
+    # masked language models only predict the masked tokens
+    predicted = labels != -100
+    return int((predictions[predicted] == labels[predicted]).sum()), int(predicted.sum())
+
+
+def evaluate_model(model, batches):
+    """
+    :return: a dictionary with the model's mean loss and accuracy on the
+             batches, its milliseconds per batch and examples per second,
+             its number of parameters and its FLOPs per example
+    """
+    device = model_device(model)
+    model.eval()
+    loss, correct, predictions, examples = 0.0, 0, 0, 0
+    start = time.perf_counter()
+    with torch.no_grad():
+        for batch in batches:
+            batch = _to_device(batch, device)
+            outputs = model(**batch)
+            loss += float(outputs.loss)
+            batch_correct, batch_predictions = _correct_predictions(outputs, batch)
+            correct += batch_correct
+            predictions += batch_predictions
+            examples += len(batch['input_ids'])
+    if device.type == 'cuda':
+        torch.cuda.synchronize(device)
+    seconds = time.perf_counter() - start
+
+    return {
+        'loss': loss / len(batches),
+        'accuracy': correct / predictions if predictions else 0.0,
+        'ms_per_batch': 1000 * seconds / len(batches),
+        'examples_per_second': examples / seconds if seconds else 0.0,
+        'parameters': count_parameters(model),
+        'flops_per_example': count_flops(model, batches[0]) // len(batches[0]['input_ids'])
+    }
+
+
+def fine_tune(model, batches, steps, learning_rate):
+    """
+    Trains the model for a number of steps, cycling through the batches
+    """
+    device = model_device(model)
+    optimizer = AdamW(model.parameters(), lr=learning_rate)
+    model.train()
+    for batch in itertools.islice(itertools.cycle(batches), steps):
+        loss = model(**_to_device(batch, device)).loss
+        loss.backward()
+        torch.nn.utils.clip_grad_norm_(model.parameters(), 1.0)
+        optimizer.step()
+        optimizer.zero_grad()
+    model.eval()
+
+
+def prune_model(model, batches, args=None):
+    """
+    Drops layers, removes the least important heads and fine-tunes the
+    model in place, as set by args
+    :param batches: a list of dictionaries of model inputs, with labels,
+           that heads are scored on and the model is evaluated and fine-tuned on
+    :param args: changes to pruning_args
+    :return: a dictionary with the evaluate_model() results "before" and
+             "after" pruning, and the heads that were pruned from each
+             layer under "pruned_heads"
+    """
+    args = {**pruning_args, **(args or {})}
+    report = {'before': evaluate_model(model, batches)}
+
+    if args['layers_to_drop']:
+        drop_top_layers(model, args['layers_to_drop'])
+    pruned_heads = {}
+    if args['head_fraction']:
+        importance = head_importance(model, batches)
+        pruned_heads = prune_least_important_heads(model, importance, args['head_fraction'])
+    if args['recovery_steps']:
+        fine_tune(model, batches, args['recovery_steps'], args['learning_rate'])
+
+    report['after'] = evaluate_model(model, batches)
+    report['pruned_heads'] = pruned_heads
+    return report
+
+
+def _batches(encodings, labels, batch_size):
+    """
+    :param encodings: a dictionary of padded input tensors
+    :param labels: a dictionary of label tensors
+    :return: a list of dictionaries of batch_size examples
+    """
+    tensors = {**encodings, **labels}
+    num_examples = len(tensors['input_ids'])
+    return [
+        {name: tensor[start:start + batch_size] for name, tensor in tensors.items()}
+        for start in range(0, num_examples, batch_size)
+    ]
+
+
+def _encode(tokenizer, texts, pairs, args):
+    encodings = tokenizer(texts, pairs, padding=True, truncation=True,
+                          max_length=args['max_seq_length'], return_tensors='pt')
+    return {name: encodings[name] for name in ('input_ids', 'attention_mask', 'token_type_ids') if name in encodings}
+
+
+def classifier_batches(tokenizer, texts, labels, args=None):
+    """
+    :param labels: the label of each text, as ints
+    :return: pruning batches for a sequence classifier
+    """
+    args = {**pruning_args, **(args or {})}
+    return _batches(_encode(tokenizer, texts, None, args),
+                    {'labels': torch.tensor(labels, dtype=torch.long)}, args['batch_size'])
+
+
+def mlm_batches(tokenizer, texts, args=None):
+    """
+    Masks the texts once, so that every evaluation predicts the same tokens
+    :return: pruning batches for a masked language model
+    """
+    args = {**pruning_args, **(args or {})}
+    encodings = _encode(tokenizer, texts, None, args)
+    encodings['input_ids'], labels = mask_tokens(encodings['input_ids'], tokenizer)
+    return _batches(encodings, {'labels': labels}, args['batch_size'])
+
+
+def nsp_batches(tokenizer, sentence_pairs, args=None):
+    """
+    :param sentence_pairs: (sentence_a, sentence_b, is_next) tuples, where
+           is_next is True if sentence_b follows sentence_a
+    :return: pruning batches for next sentence prediction
+    """
+    args = {**pruning_args, **(args or {})}
+    sentences_a, sentences_b, is_next = zip(*sentence_pairs)
+    # label 0 means that sentence B is a continuation of sentence A
+    labels = torch.tensor([0 if follows else 1 for follows in is_next], dtype=torch.long)
+    return _batches(_encode(tokenizer, list(sentences_a), list(sentences_b), args),
+                    {'labels': labels}, args['batch_size'])
+
+
+def _find(ids, sub_ids, start):
+    """
+    :return: the index of the first occurrence of sub_ids in ids at or after start, or None
+    """
+    for index in range(start, len(ids) - len(sub_ids) + 1):
+        if ids[index:index + len(sub_ids)] == sub_ids:
+            return index
+    return None
+
+
+def qa_batches(tokenizer, examples, args=None):
+    """
+    :param examples: (question, context, answer) tuples, where the answer
+           is a span of the context
+    :return: pruning batches for question answering. Answers that are
+             truncated away point at the first token
+    """
+    args = {**pruning_args, **(args or {})}
+    questions, contexts, answers = zip(*examples)
+    encodings = tokenizer(list(questions), list(contexts), padding=True, truncation='only_second',
+                          max_length=args['max_seq_length'], return_tensors='pt')
+    encodings = {name: encodings[name] for name in ('input_ids', 'attention_mask', 'token_type_ids')}
+    start_positions, end_positions = [], []
+    for ids, answer in zip(encodings['input_ids'].tolist(), answers):
+        answer_ids = tokenizer.encode(answer, add_special_tokens=False)
+        # the context starts after the question's separator
+        start = _find(ids, answer_ids, ids.index(tokenizer.sep_token_id) + 1) if answer_ids else None
+        start_positions.append(0 if start is None else start)
+        end_positions.append(0 if start is None else start + len(answer_ids) - 1)
+    labels = {'start_positions': torch.tensor(start_positions), 'end_positions': torch.tensor(end_positions)}
+    return _batches(encodings, labels, args['batch_size'])
@@ -48,6 +48,8 @@ def qa_logits(start_logits, end_logits):
     :returns: generator of namedtuples of the form
     (start_idx, end_idx, logit), sorted in descending order
     by score
+    NOTE: biggest_sums is a greedy walk, so pairs are not guaranteed to
+    be in true descending order. Use top_k_spans for exact results.
     """
 
     sorted_starts_tensors = torch.sort(start_logits, descending=True)
@@ -78,6 +80,90 @@ def qa_logits(start_logits, end_logits):
     return legit_answers
 
 
+def top_k_spans(start_logits, end_logits, k, max_answer_length=None, lengths=None):
+    """
+    Exact top k answer spans for a batch of examples.
+    Scores every (start, end) pair with start + end logit, keeps only
+    pairs where end >= start and the span is at most max_answer_length
+    tokens long, and takes the top k of the whole score matrix at once.
+    :param start_logits: tensor of shape (batch, length)
+    :param end_logits: tensor of shape (batch, length)
+    :param k: number of spans to return per example
+    :param max_answer_length: maximum number of tokens in a span,
+    None for no limit
+    :param lengths: optional tensor or list of the number of real
+    (non padding) positions in each row
+    :returns: tuple of (scores, start_indices, end_indices) tensors,
+    each of shape (batch, k), sorted by descending score.
+    Spans that do not exist (k larger than the number of valid spans)
+    have a score of -inf
+    """
+    seq_length = start_logits.shape[-1]
+    if max_answer_length is None or max_answer_length > seq_length:
+        max_answer_length = max(seq_length, 1)
+    # scores[b, start, offset] is the score of the span
+    # (start, start + offset), so only spans with end >= start and
+    # length <= max_answer_length are ever scored
+    padded_ends = torch.nn.functional.pad(
+        end_logits, (0, max_answer_length), value=float('-inf')
+    )
+    end_windows = padded_ends.unfold(-1, max_answer_length, 1)[:, :seq_length]
+    scores = start_logits.unsqueeze(2) + end_windows
+    if lengths is not None:
+        lengths = torch.as_tensor(lengths, device=start_logits.device)
+        span_ends = (
+            torch.arange(seq_length, device=start_logits.device).unsqueeze(1)
+            + torch.arange(max_answer_length, device=start_logits.device)
+        )
+        # a span is valid only if its end (and therefore its start) is in range
+        in_range = span_ends.unsqueeze(0) < lengths.view(-1, 1, 1)
+        scores = scores.masked_fill(~in_range, float('-inf'))
+
+    k = min(k, seq_length * max_answer_length)
+    top_scores, flat_indices = torch.topk(scores.flatten(start_dim=1), k, dim=1)
+    start_indices = flat_indices // max_answer_length
+    end_indices = start_indices + flat_indices % max_answer_length
+    return top_scores, start_indices, end_indices
+
+
+def _span_log_probabilities(start_logits, end_logits, lengths=None):
+    """
+    Log softmax of the start and end logits over the real positions of
+    each row, so that the start and end log probabilities of a span add
+    up to its log probability
+    :param start_logits: tensor of shape (batch, length)
+    :param end_logits: tensor of shape (batch, length)
+    :param lengths: optional number of real positions in each row
+    :returns: tuple of (start_log_probabilities, end_log_probabilities)
+    """
+    if lengths is not None:
+        positions = torch.arange(start_logits.shape[-1], device=start_logits.device)
+        padding = positions.unsqueeze(0) >= torch.as_tensor(lengths, device=start_logits.device).unsqueeze(1)
+        start_logits = start_logits.masked_fill(padding, float('-inf'))
+        end_logits = end_logits.masked_fill(padding, float('-inf'))
+    return torch.log_softmax(start_logits, dim=-1), torch.log_softmax(end_logits, dim=-1)
+
+
+def top_span_probabilities(start_logits, end_logits, max_answer_length=None, lengths=None):
+    """
+    Probability of the best span of each example, where the start and
+    end positions are each a softmax over the real positions of the row.
+    Unlike the probabilities of qa_probabilities, which are only relative
+    to the other top k spans, this is comparable between examples
+    and can be used as a confidence score.
+    :param start_logits: tensor of shape (batch, length)
+    :param end_logits: tensor of shape (batch, length)
+    :param max_answer_length: maximum number of tokens in an answer
+    :param lengths: optional number of real positions in each row
+    :returns: list with the probability of the best span of each example
+    """
+    start_log_probabilities, end_log_probabilities = _span_log_probabilities(start_logits, end_logits, lengths)
+    top_scores, _, _ = top_k_spans(
+        start_log_probabilities, end_log_probabilities, 1, max_answer_length, lengths
+    )
+    return top_scores[:, 0].exp().tolist()
+
+
 QAProbability = namedtuple('QaProbability', [
     'start_idx', 'end_idx', 'probability'
 ])
@@ -87,29 +173,156 @@ QAAnswer = namedtuple('QaAnswer', [
     'text', 'softmax'
 ])
 
-def qa_probabilities(start_logits, end_logits, k):
+QASpan = namedtuple('QaSpan', [
+    'start_idx', 'end_idx', 'logit', 'probability', 'confidence'
+])
+
+def qa_spans_batch(start_logits, end_logits, k, max_answer_length=None, lengths=None):
+    """
+    Computes the top k answer spans for a batch of examples, with both
+    their logits and their probabilities. The probabilities of each
+    example are a softmax over its top k spans. The confidence of a span
+    is its probability under the softmaxes of the start and end positions,
+    as in top_span_probabilities, so it can be compared between examples
+    and between models.
+    :param start_logits: tensor of shape (batch, length)
+    :param end_logits: tensor of shape (batch, length)
+    :param k: number of results to return per example
+    :param max_answer_length: maximum number of tokens in an answer
+    :param lengths: optional number of real positions in each row
+    :returns: list containing a list of QASpans for each example
+    """
+    top_scores, start_indices, end_indices = top_k_spans(
+        start_logits, end_logits, k, max_answer_length, lengths
+    )
+    probabilities = torch.nn.Softmax(dim=1)(top_scores)
+    start_log_probabilities, end_log_probabilities = _span_log_probabilities(start_logits, end_logits, lengths)
+    # spans that do not exist can end past the last position
+    confidences = (
+        start_log_probabilities.gather(1, start_indices)
+        + end_log_probabilities.gather(1, end_indices.clamp(max=start_logits.shape[-1] - 1))
+    ).exp()
+    return [
+        [
+            QASpan(start_idx=start_idx, end_idx=end_idx, logit=logit, probability=probability,
+                   confidence=confidence)
+            for start_idx, end_idx, logit, probability, confidence in zip(
+                starts, ends, logits, row_probabilities, row_confidences
+            )
+            if logit != float('-inf')
+        ]
+        for starts, ends, logits, row_probabilities, row_confidences in zip(
+            start_indices.tolist(), end_indices.tolist(),
+            top_scores.tolist(), probabilities.tolist(), confidences.tolist()
+        )
+    ]
+
+def qa_probabilities_batch(start_logits, end_logits, k, max_answer_length=None, lengths=None):
+    """
+    Computes the top k qa probabilities for a batch of examples.
+    :param start_logits: tensor of shape (batch, length)
+    :param end_logits: tensor of shape (batch, length)
+    :param k: number of results to return per example
+    :param max_answer_length: maximum number of tokens in an answer
+    :param lengths: optional number of real positions in each row
+    :returns: list containing a list of QAProbabilities for each example
+    """
+    return [
+        [
+            QAProbability(start_idx=span.start_idx, end_idx=span.end_idx, probability=span.probability)
+            for span in spans
+        ]
+        for spans in qa_spans_batch(start_logits, end_logits, k, max_answer_length, lengths)
+    ]
+
+def qa_probabilities(start_logits, end_logits, k, max_answer_length=None):
     """
     Computes the top k qa probabilities, in terms of indices.
     :param start_logits: tensor from qa model output
     :param end_logits: tensor from qa model output
     :param k: number of results to return
-    :returns: list of namedtuples of the form (text,probability)
+    :param max_answer_length: maximum number of tokens in an answer
+    :returns: list of namedtuples of the form (start_idx, end_idx, probability)
     """
-    top_answers = [
-        qa_logit
-        for qa_logit, _ in zip(qa_logits(start_logits, end_logits), range(k))
-    ]
-    logit_scores = torch.tensor([
-        answer.logit
-        for answer in top_answers
-    ])
+    return qa_probabilities_batch(
+        start_logits.unsqueeze(0), end_logits.unsqueeze(0), k, max_answer_length
+    )[0]
 
-    probabilities = torch.nn.Softmax(dim=0)(logit_scores).tolist()
-    return [
-        QAProbability(
-            start_idx=answer.start_idx,
-            end_idx=answer.end_idx,
-            probability=probability
+
+qa_args = {
+    # number of questions sent through the QA model in a single forward pass
+    "batch_size": 8,
+    # longest answer span considered, in tokens. None for no limit
+    "max_answer_length": None,
+    # used by HappyBERT.init_qa_cascade(). questions are escalated to the
+    # large model when the cascade model's best answer is less likely than this
+    "cascade_threshold": 0.5,
+}
+
+
+class QADocument():
+    """
+    A context that is tokenized once so that many questions can be
+    answered against it without re-encoding the context each time.
+    Questions are answered in padded batches of qa_args["batch_size"].
+
+    Create one with HappyBERT.prepare_context(context)
+    """
+
+    def __init__(self, happy_bert, context):
+        self.happy_bert = happy_bert
+        self.context = context
+        # ids of the context without any special tokens.
+        # the question and special tokens are added around these ids
+        # for every question, so the context is only tokenized here.
+        self.context_ids = happy_bert.tokenizer.encode(
+            context, add_special_tokens=False
         )
-        for answer, probability in zip(top_answers, probabilities)
-    ]
+        self.pending_questions = []
+
+    def add_question(self, question):
+        """
+        Queues a question to be answered by the next answer_pending() call
+        :param question: The question to be answered
+        """
+        self.pending_questions.append(question)
+
+    def answer_pending(self, k=3):
+        """
+        Answers all of the queued questions in batched forward passes
+        :param k: number of answers to return per question
+        :return: a list containing a list of QAAnswers for each queued
+        question, in the order the questions were added
+        """
+        questions = self.pending_questions
+        self.pending_questions = []
+        return self.answers_to_questions(questions, k)
+
+    def answers_to_questions(self, questions, k=3):
+        """
+        :param questions: list of questions about the context
+        :param k: number of answers to return per question
+        :return: a list containing a list of QAAnswers for each question
+        """
+        question_ids = [
+            self.happy_bert.tokenizer.encode(question, add_special_tokens=False)
+            for question in questions
+        ]
+        return self.happy_bert._answers_to_question_ids(
+            question_ids, [self.context_ids] * len(question_ids), k
+        )
+
+    def answers_to_question(self, question, k=3):
+        """
+        :param question: The question to be answered
+        :param k: number of answers to return
+        :return: a list of QAAnswers, sorted by descending probability
+        """
+        return self.answers_to_questions([question], k)[0]
+
+    def answer_question(self, question):
+        """
+        :param question: The question to be answered
+        :return: The answer to the given question, as a string
+        """
+        return self.answers_to_question(question, 1)[0].text
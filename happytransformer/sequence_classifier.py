@@ -12,15 +12,16 @@ Credit: This code is a modified version of the code found in this repository und
 # pylint: disable=C0301
 
 from __future__ import absolute_import, division, print_function
+import contextlib
+import json
 import math
+import os
+import socket
+import tempfile
 import numpy as np
 from tqdm import tqdm, trange
-from sklearn.metrics import confusion_matrix
 import torch
-from torch.utils.data import (
-    DataLoader, RandomSampler, SequentialSampler,
-    TensorDataset
-)
+from torch.utils.data import DataLoader, IterableDataset
 
 from transformers import (
     BertForSequenceClassification,
@@ -30,19 +31,73 @@ from transformers import (
 
 from transformers import AdamW, get_linear_schedule_with_warmup
 
+from happytransformer.classifier_args import classifier_args
 from happytransformer.classifier_utils import (
-    convert_examples_to_features,
+    featurize_texts,
+    FeatureDataset,
     output_modes,
     processors
 )
+from happytransformer.feature_cache import (
+    feature_cache_key,
+    load_features,
+    model_fingerprint,
+    save_features
+)
+from happytransformer.streaming_dataset import StreamingCSVDataset
+from happytransformer.checkpoint import (
+    BEST_CHECKPOINT,
+    AsyncCheckpointer,
+    latest_checkpoint,
+    load_checkpoint,
+    rng_state,
+    set_rng_state
+)
+from happytransformer.metrics import EarlyStopping, StreamingMetrics
+from happytransformer.distillation import (
+    distillation_loss,
+    distillation_report,
+    teacher_logits_file
+)
+from happytransformer.frozen_features import (
+    FEATURES_FILE,
+    FrozenFeatures,
+    encoder_features,
+    frozen_features_key,
+    frozen_fingerprint_skip,
+    head_logits,
+    load_frozen_features,
+    save_frozen_features,
+    trainable_modules
+)
+from happytransformer.batching import (
+    BatchStats,
+    LengthGroupedSampler,
+    PaddingCollator
+)
+from happytransformer.prediction_writer import open_prediction_writer
+from happytransformer.telemetry import Telemetry
+
+CLASSIFIER_ARGS_FILE = 'classifier_args.json'
+
+
+def _free_port():
+    """
+    :return: a TCP port that is free on this machine
+    """
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as free_socket:
+        free_socket.bind(('127.0.0.1', 0))
+        return free_socket.getsockname()[1]
+
 
 class SequenceClassifier():
     """
     Sequence Classifier with fine tuning capabilities
     """
 
-    def __init__(self, args, tokenizer, logger, gpu_support, model, model_name):
-        self.args = args
+    def __init__(self, args, tokenizer, logger, gpu_support, model, model_name, callbacks=None):
+        # settings missing from custom args fall back to the defaults
+        self.args = {**classifier_args, **args}
         self.processor = None
         self.train_dataset = None
         self.eval_dataset = None
@@ -51,20 +106,51 @@ class SequenceClassifier():
             'XLNET': XLNetForSequenceClassification,
             'ROBERTA': RobertaForSequenceClassification
         }
-        self.train_list_data = None
-        self.eval_list_data = None
-        self.test_list_data = None
         self.tokenizer = tokenizer
         self.logger = logger
         self.gpu_support = gpu_support
         self.model_name = model_name
 
         self.model_class = self.model_classes[model_name]
-
-        self.model = self.model_class.from_pretrained(model)
+        # throughput and padding ratio of the last train, eval and test runs
+        self.stats = {}
+        # hashes of the train, eval and test data, used as feature cache keys
+        self.data_hashes = {}
+        # csv paths of the train, eval and test data when self.args['streaming'] is True
+        self.data_paths = {}
+        # ClassifierData of the train, eval and test data, dropped once featurized
+        self.data = {}
+        # data set evaluated while training, see train_model()
+        self.train_eval_dataset = None
+        # results of the evaluations run while training, with their "step"
+        self.eval_history = []
+        # whether the data of each task has labels. Students can be
+        # distilled from unlabelled train data, see train_model()
+        self.labelled = {'train': True, 'eval': True, 'test': False}
+        # logits of the teacher on the train data while distilling
+        self.teacher_logits = None
+        # functions that are called with each telemetry record, see telemetry.Telemetry
+        self.callbacks = [] if callbacks is None else callbacks
+
+        if isinstance(model, torch.nn.Module):
+            self.model = model
+        else:
+            self.model = self.model_class.from_pretrained(model)
         self.model.to(self.gpu_support)
 
 
+    def save(self, path):
+        """
+        Saves the model, the tokenizer and self.args to a directory that
+        SequenceClassifier can be initialized from
+        :param path: a directory
+        """
+        os.makedirs(path, exist_ok=True)
+        self.model.save_pretrained(path)
+        self.tokenizer.save_pretrained(path)
+        with open(os.path.join(path, CLASSIFIER_ARGS_FILE), 'w') as args_file:
+            json.dump(self.args, args_file, indent=4)
+
     def check_task(self):
         "Checks to make sure the task is valid. Currently only \"Binary\" is accepted"
         task = self.args['task_mode']
@@ -75,35 +161,334 @@ class SequenceClassifier():
             raise KeyError(f'{task} is not available')
 
 
-    def train_model(self):
+    def train_model(self, num_processes=1, num_nodes=1, node_rank=0, rendezvous_address=None,
+                    evaluate_during_training=False, teacher=None):
         """
-        Does the proper checks and initializations before training self.model. Then, saves the model
+        Does the proper checks and initializations before training self.model.
+        Checkpoints are saved while training when self.args['checkpoint_dir']
+        is set, and training continues from self.args['resume_from'] when it
+        is set
+        :param num_processes: number of data-parallel training processes on this machine
+        :param num_nodes: number of machines training together
+        :param node_rank: the index of this machine, from 0 to num_nodes - 1
+        :param rendezvous_address: "host:port" of the machine with node_rank
+               0, which every machine connects to. Only needed with several nodes
+        :param evaluate_during_training: evaluate the eval data every
+               self.args['eval_steps'] steps, or every epoch, to stop
+               early and keep the best model, see classifier_args
+        :param teacher: a trained SequenceClassifier to distill into
+               self.model, which then learns from the teacher's logits
+               on the train data, see distillation.distillation_loss.
+               With evaluate_during_training, the teacher and the
+               student are compared on the eval data in self.stats["distillation"]
         :return:
         """
         self.check_task()
+        if teacher is not None and self.args['freeze_encoder']:
+            raise ValueError("A student can't be distilled with a frozen encoder")
 
         self.train_dataset = self.__load_and_cache_examples("train")
-        self.__train()
-
-        # Takes care of distributed/parallel training
-        model_to_save = self.model.module if hasattr(self.model, 'module') else self.model
-
-        self.model = model_to_save # new
+        self.eval_history = []
+        if evaluate_during_training:
+            self.train_eval_dataset = self.__load_and_cache_examples("eval")
+        if teacher is not None:
+            self.teacher_logits = self.__teacher_logits(teacher)
+        if self.args['freeze_encoder']:
+            self.__train_frozen()
+        elif num_processes * num_nodes > 1:
+            self.__train_distributed(num_processes, num_nodes, node_rank, rendezvous_address)
+        else:
+            self.__train()
+        if teacher is not None and self.train_eval_dataset is not None:
+            teacher_results = teacher.__evaluate_dataset(self.train_eval_dataset)
+            student_results = self.__evaluate_dataset(self.train_eval_dataset)
+            self.stats['distillation'] = distillation_report(
+                teacher_results, teacher.stats['eval'], student_results, self.stats['eval'],
+                teacher.model, self.model
+            )
+            self.logger.info("Distilled a student that is %.2fx as fast, with %+.4f accuracy",
+                             self.stats['distillation']['speedup'] or 0.0,
+                             self.stats['distillation']['accuracy_change'])
         del self.train_dataset
+        self.train_eval_dataset = None
+        self.teacher_logits = None
 
+    def __frozen_features(self, task, dataset):
+        """
+        Runs the frozen part of self.model over a data set once. The
+        features are memory-mapped, and cached in self.args['feature_cache_dir'],
+        under the data's feature cache key and a hash of the frozen weights,
+        so that training again with other settings reuses them. Without a
+        cache they are written to a temporary directory
+        :return: FrozenFeatures of the data set
+        """
+        unfrozen_layers = self.args['unfrozen_layers']
+        offsets = None
+        if unfrozen_layers:
+            offsets = np.concatenate([[0], np.cumsum(dataset.lengths())])
+
+        cache_dir, cache_key = None, None
+        features_key = self.__feature_cache_key(task)
+        if features_key is not None:
+            cache_dir = os.path.join(self.args['feature_cache_dir'], 'frozen_features')
+            fingerprint = model_fingerprint(self.model, frozen_fingerprint_skip(self.model, unfrozen_layers))
+            cache_key = frozen_features_key(features_key, fingerprint, unfrozen_layers, self.args['bf16'])
+            cached = load_frozen_features(cache_dir, cache_key, offsets)
+            if cached is not None:
+                self.logger.info("Loaded cached frozen %s features", task)
+                return cached
+
+        shape = (int(offsets[-1]) if unfrozen_layers else len(dataset), self.model.config.hidden_size)
+        temporary_dir = None
+        if cache_dir is None:
+            temporary_dir = tempfile.TemporaryDirectory()
+            features_path = os.path.join(temporary_dir.name, FEATURES_FILE)
+        else:
+            os.makedirs(cache_dir, exist_ok=True)
+            features_path = os.path.join(cache_dir, '{}.{}.tmp.npy'.format(cache_key, os.getpid()))
+        features = np.lib.format.open_memmap(features_path, mode='w+', dtype=np.float32, shape=shape)
+
+        self.model.eval()
+        for input_ids, attention_mask, token_type_ids, _, indices in tqdm(
+                self.__get_dataloader(dataset, shuffle=False), desc="Extracting features"):
+            with torch.inference_mode(), self.__autocast():
+                batch_features = encoder_features(
+                    self.model, input_ids.to(self.gpu_support), attention_mask.to(self.gpu_support),
+                    token_type_ids.to(self.gpu_support), unfrozen_layers
+                ).float().cpu().numpy()
+            if not unfrozen_layers:
+                features[indices.numpy()] = batch_features
+                continue
+            # BERT and RoBERTa batches are padded on the right
+            for row, index in enumerate(indices.tolist()):
+                start, end = offsets[index], offsets[index + 1]
+                features[start:end] = batch_features[row, :end - start]
+
+        features.flush()
+        if cache_dir is None:
+            return FrozenFeatures(features, offsets, temporary_dir)
+        del features
+        save_frozen_features(cache_dir, cache_key, features_path)
+        return load_frozen_features(cache_dir, cache_key, offsets)
+
+    def __train_frozen(self):
+        """
+        Trains the classification head, and the top self.args['unfrozen_layers']
+        encoder layers, on cached features of the frozen encoder. With
+        eval data, the model is evaluated after every epoch to stop early
+        and keep the best model. Training takes seconds, so no checkpoints
+        are saved or resumed from
+        """
+        if isinstance(self.train_dataset, IterableDataset):
+            raise ValueError("Streamed data can't be used with a frozen encoder")
+        if self.args['checkpoint_dir'] is not None or self.args['resume_from'] is not None:
+            raise ValueError("Checkpoints can't be used with a frozen encoder")
+        unfrozen_layers = self.args['unfrozen_layers']
+        modules = trainable_modules(self.model, unfrozen_layers)
+        train_features = self.__frozen_features("train", self.train_dataset)
+        eval_features = None
+        if self.train_eval_dataset is not None:
+            eval_features = self.__frozen_features("eval", self.train_eval_dataset)
+        labels = torch.as_tensor(np.asarray(self.train_dataset.arrays.label_ids), dtype=torch.long)
+
+        # per example features take the same compute whatever the length of the text
+        sampler = LengthGroupedSampler(
+            self.train_dataset.lengths() if unfrozen_layers else [0] * len(self.train_dataset),
+            self.args['batch_size'], shuffle=True,
+            max_tokens=self.args['max_tokens_per_batch'] if unfrozen_layers else None
+        )
+        accumulation_steps = self.args['gradient_accumulation_steps']
+        t_total = math.ceil(len(sampler) / accumulation_steps) * self.args['num_epochs']
+        no_decay = ['bias', 'LayerNorm.weight']
+        named_parameters = [(name, parameter) for module in modules for name, parameter in module.named_parameters()]
+        optimizer_grouped_parameters = [
+            {'params': [p for n, p in named_parameters if not any(nd in n for nd in no_decay)],
+             'weight_decay': self.args['weight_decay']},
+            {'params': [p for n, p in named_parameters if any(nd in n for nd in no_decay)], 'weight_decay': 0.0}
+        ]
+        warmup_steps = self.args['warmup_steps'] or math.ceil(t_total * self.args['warmup_ratio'])
+        optimizer = AdamW(optimizer_grouped_parameters, lr=self.args['learning_rate'], eps=self.args['adam_epsilon'])
+        scheduler = get_linear_schedule_with_warmup(optimizer, num_warmup_steps=warmup_steps, num_training_steps=t_total)
+
+        early_stopping = None
+        best_state = None
+        if eval_features is not None:
+            early_stopping = EarlyStopping(self.args['early_stopping_metric'], self.args['early_stopping_patience'])
+        batch_stats = BatchStats(self.gpu_support)
+        telemetry = self.__telemetry()
+        timer = telemetry.timer()
+        global_step = 0
+        step_loss = 0.0
+        for _ in trange(int(self.args['num_epochs']), desc="Epoch"):
+            for module in modules:
+                module.train()
+            for step, indices in enumerate(timer(sampler)):
+                features, attention_mask = train_features.batch(indices, self.gpu_support)
+                # per example features count as one token
+                tokens = attention_mask if attention_mask is not None else torch.ones((len(indices), 1), dtype=torch.long)
+                batch_stats.update(tokens)
+                timer.add_batch(tokens)
+                with self.__autocast():
+                    logits = head_logits(self.model, features, attention_mask, unfrozen_layers)
+                loss = torch.nn.functional.cross_entropy(logits.float(), labels[indices].to(self.gpu_support))
+                loss = loss / accumulation_steps
+                loss.backward()
+                step_loss += loss.item()
+                if (step + 1) % accumulation_steps and step + 1 != len(sampler):
+                    continue
+                torch.nn.utils.clip_grad_norm_([p for _, p in named_parameters], self.args['max_grad_norm'])
+                optimizer.step()
+                telemetry.train_step(global_step + 1, timer, step_loss, scheduler.get_last_lr()[0])
+                step_loss = 0.0
+                scheduler.step()
+                optimizer.zero_grad()
+                global_step += 1
+
+            if early_stopping is not None:
+                report = self.__evaluate_frozen(eval_features, telemetry, global_step)
+                self.eval_history.append({'step': global_step, **report})
+                if early_stopping.update(global_step, report):
+                    best_state = [
+                        {name: tensor.detach().to('cpu', copy=True) for name, tensor in module.state_dict().items()}
+                        for module in modules
+                    ]
+                if early_stopping.should_stop:
+                    self.logger.info("Stopping early at step %d, the best %s was %s at step %d", global_step,
+                                     early_stopping.metric, early_stopping.best_score, early_stopping.best_step)
+                    break
+
+        telemetry.close()
+        if best_state is not None and self.args['load_best_model']:
+            for module, state in zip(modules, best_state):
+                module.load_state_dict(state)
+            self.logger.info("Loaded the best model, from step %d", early_stopping.best_step)
+        self.model.eval()
+        self.__log_stats("train", batch_stats.report())
+
+    def __evaluate_frozen(self, eval_features, telemetry, step):
+        """
+        :param eval_features: FrozenFeatures of self.train_eval_dataset
+        :param telemetry: the Telemetry of the training run, which gets an "eval" record
+        :param step: the training step
+        :return: the StreamingMetrics report of the eval data
+        """
+        unfrozen_layers = self.args['unfrozen_layers']
+        labels = torch.as_tensor(np.asarray(self.train_eval_dataset.arrays.label_ids), dtype=torch.long)
+        sampler = LengthGroupedSampler(
+            self.train_eval_dataset.lengths() if unfrozen_layers else [0] * len(self.train_eval_dataset),
+            self.args['batch_size'], shuffle=False,
+            max_tokens=self.args['max_tokens_per_batch'] if unfrozen_layers else None
+        )
+        metrics = StreamingMetrics(len(self.processor.get_labels()))
+        timer = telemetry.timer()
+        self.model.eval()
+        with torch.inference_mode(), self.__autocast():
+            for indices in timer(sampler):
+                features, attention_mask = eval_features.batch(indices, self.gpu_support)
+                timer.add_batch(attention_mask if attention_mask is not None
+                                else torch.ones((len(indices), 1), dtype=torch.long))
+                logits = head_logits(self.model, features, attention_mask, unfrozen_layers)
+                batch_labels = labels[indices].to(self.gpu_support)
+                metrics.update(logits, batch_labels, torch.nn.functional.cross_entropy(logits.float(), batch_labels))
+        results = metrics.report()
+        telemetry.emit('eval', {'step': step, **results, **timer.report()})
+        return results
+
+    def __teacher_logits(self, teacher):
+        """
+        Runs the teacher over self.train_dataset. The logits are cached in
+        self.args['feature_cache_dir'], under the data's feature cache key
+        and a hash of the teacher's weights, so that distilling more
+        students from the same teacher and data doesn't run the teacher again
+        :param teacher: a trained SequenceClassifier with the same tokenizer
+        :return: a (number of train examples, number of labels) array
+        """
+        teacher.check_task()
+        cache_key = self.__feature_cache_key("train")
+        if cache_key is None:
+            return teacher.__predict_dataset(self.train_dataset, teacher.__logits_buffer(self.train_dataset, None))[1]
+
+        logits_dir = os.path.join(self.args['feature_cache_dir'], 'teacher_logits')
+        logits_path = os.path.join(logits_dir, teacher_logits_file(
+            cache_key, model_fingerprint(teacher.model), teacher.args['bf16']))
+        if os.path.isfile(logits_path):
+            self.logger.info("Loaded cached teacher logits")
+            return np.load(logits_path, mmap_mode='r')
+
+        os.makedirs(logits_dir, exist_ok=True)
+        # written under a temporary name, so a crash never leaves partial logits
+        temporary = logits_path + '.{}.tmp'.format(os.getpid())
+        all_logits = teacher.__logits_buffer(self.train_dataset, temporary)
+        teacher.__predict_dataset(self.train_dataset, all_logits)
+        all_logits.flush()
+        del all_logits
+        os.replace(temporary, logits_path)
+        return np.load(logits_path, mmap_mode='r')
+
+    def __train_distributed(self, num_processes, num_nodes, node_rank, rendezvous_address):
+        """
+        Trains on the CPU with num_processes processes per node that each
+        train on their own share of the batches and average their gradients
+        with torch.distributed's gloo backend. The trained weights are
+        loaded back into self.model
+        """
+        if isinstance(self.train_dataset, IterableDataset):
+            raise ValueError("Streamed data can't be used for distributed training")
+        if rendezvous_address is None:
+            if num_nodes > 1:
+                raise ValueError("A rendezvous_address is needed to train on several nodes")
+            rendezvous_address = '127.0.0.1:{}'.format(_free_port())
+
+        self.model.to('cpu')
+        # functions can't be sent to the training processes, which only
+        # record telemetry to self.args['telemetry_path']
+        callbacks, self.callbacks = self.callbacks, []
+        with tempfile.TemporaryDirectory() as result_dir:
+            result_path = os.path.join(result_dir, 'result.pt')
+            torch.multiprocessing.spawn(
+                self._train_process, nprocs=num_processes,
+                args=(num_processes, node_rank, num_processes * num_nodes,
+                      'tcp://' + rendezvous_address, result_path)
+            )
+            result = torch.load(result_path, map_location='cpu')
+        self.callbacks = callbacks
+        self.model.load_state_dict(result['model'])
+        self.model.to(self.gpu_support)
+        self.eval_history = result['eval_history']
+        self.__log_stats("train", result['stats'])
 
-    def __train(self):
+    def _train_process(self, local_rank, num_processes, node_rank, world_size, init_method, result_path):
+        """
+        Runs in each distributed training process, see __train_distributed()
+        """
+        rank = node_rank * num_processes + local_rank
+        torch.distributed.init_process_group('gloo', init_method=init_method, rank=rank, world_size=world_size)
+        try:
+            # the processes of a node share its cores
+            torch.set_num_threads(max(1, (os.cpu_count() or 1) // num_processes))
+            self.gpu_support = torch.device('cpu')
+            # every process draws the same batches from rank 0's seed
+            seed = torch.randint(2 ** 31, (1,))
+            torch.distributed.broadcast(seed, src=0)
+            self.__train(rank=rank, world_size=world_size, seed=int(seed))
+            if local_rank == 0:
+                torch.save({'model': self.model.state_dict(), 'stats': self.stats['train'],
+                            'eval_history': self.eval_history}, result_path)
+        finally:
+            torch.distributed.destroy_process_group()
+
+    def __train(self, rank=0, world_size=1, seed=0):
         """
         Trains the binary sequence classifier
+        :param rank: the rank of this process in distributed training
+        :param world_size: number of distributed training processes
+        :param seed: seed that distributed processes draw their batches from
         """
-        sampler = RandomSampler(self.train_dataset)
-        train_dataloader = DataLoader(self.train_dataset,
-                                      sampler=sampler,
-                                      batch_size=self.args['batch_size'])
+        train_dataloader = self.__get_dataloader(self.train_dataset, shuffle=True,
+                                                 num_replicas=world_size, rank=rank, seed=seed)
 
-        t_total = len(train_dataloader) \
-            // self.args['gradient_accumulation_steps'] * \
-            self.args['num_epochs']
+        accumulation_steps = self.args['gradient_accumulation_steps']
+        t_total = math.ceil(len(train_dataloader) / accumulation_steps) * self.args['num_epochs']
 
         no_decay = ['bias', 'LayerNorm.weight']
         optimizer_grouped_parameters = [
@@ -119,192 +504,530 @@ class SequenceClassifier():
         scheduler = get_linear_schedule_with_warmup(optimizer, num_warmup_steps=self.args['warmup_steps'], num_training_steps=t_total)
 
         global_step = 0
-        tr_loss, logging_loss = 0.0, 0.0
-        self.model.zero_grad()
-        train_iterator = trange(int(self.args['num_epochs']), desc="Epoch")
+        tr_loss = 0.0
+        start_epoch, start_step = 0, 0
+        training_state = None
+        resume_from = latest_checkpoint(self.args['resume_from'])
+        if resume_from is not None:
+            training_state = load_checkpoint(resume_from, self.model, optimizer, scheduler)
+            start_epoch, start_step = training_state['epoch'], training_state['step']
+            global_step, tr_loss = training_state['global_step'], training_state['tr_loss']
+            self.logger.info("Resuming training from %s at step %d", resume_from, global_step)
+            if start_step >= len(train_dataloader):
+                # the checkpoint was saved at the end of an epoch
+                start_epoch, start_step = start_epoch + 1, 0
+                training_state['epoch_rng'] = training_state['rng']
+
+        early_stopping = None
+        best_model = None
+        if self.train_eval_dataset is not None:
+            early_stopping = EarlyStopping(self.args['early_stopping_metric'], self.args['early_stopping_patience'])
+            if training_state is not None and training_state.get('early_stopping') is not None:
+                early_stopping.load_state_dict(training_state['early_stopping'])
+                best_path = os.path.join(os.path.dirname(resume_from), BEST_CHECKPOINT)
+                if os.path.isfile(best_path):
+                    best_model = torch.load(best_path, map_location='cpu')['model']
+
+        model = self.model
+        if world_size > 1:
+            # averages the gradients of the processes during backward()
+            model = torch.nn.parallel.DistributedDataParallel(self.model)
+            torch.manual_seed(seed + rank + global_step)  # different dropout in each process
+
+        checkpointer = None
+        if self.args['checkpoint_dir'] is not None and rank == 0:
+            checkpointer = AsyncCheckpointer(self.args['checkpoint_dir'], keep=self.args['checkpoints_to_keep'])
+        last_checkpoint_step = global_step
 
-        for _ in train_iterator:
-            epoch_iterator = tqdm(train_dataloader, desc="Iteration")
-            for step, batch in enumerate(epoch_iterator):
+        self.model.zero_grad()
+        train_iterator = trange(start_epoch, int(self.args['num_epochs']), desc="Epoch", disable=rank != 0)
+        batch_stats = BatchStats(self.gpu_support)
+        telemetry = self.__telemetry() if rank == 0 else Telemetry()
+        timer = telemetry.timer()
+        step_loss = 0.0
+
+        for epoch in train_iterator:
+            if world_size > 1:
+                train_dataloader.batch_sampler.set_epoch(epoch)
+            resuming = training_state is not None and epoch == start_epoch
+            if resuming:
+                # the order of the batches is drawn when the epoch starts
+                set_rng_state(training_state['epoch_rng'])
+            epoch_rng = rng_state()
+            batches = iter(train_dataloader)
+            if resuming:
+                # skip the batches that were trained on before the checkpoint
+                for _ in range(start_step):
+                    next(batches)
+                set_rng_state(training_state['rng'])
+                if world_size > 1:
+                    torch.manual_seed(seed + rank + global_step)
+            first_step = start_step if resuming else 0
+            epoch_iterator = tqdm(batches, desc="Iteration", total=len(train_dataloader),
+                                  initial=first_step, disable=rank != 0)
+            for step, batch in enumerate(timer(epoch_iterator), start=first_step):
                 self.model.train()
+                batch_stats.update(batch[1])
+                timer.add_batch(batch[1])
                 batch = tuple(t.to(self.gpu_support) for t in batch)
 
                 inputs = {'input_ids': batch[0],
                           'attention_mask': batch[1],
-                          'token_type_ids': batch[2],
-                          'labels': batch[3]}
-                outputs = self.model(**inputs)
-                loss = outputs[0]  # model outputs are always tuple in pytorch-transformers (see doc)
-                # print("\r%f" % loss, end='')
-
-                if self.args['gradient_accumulation_steps'] > 1:
-                    loss = loss / self.args['gradient_accumulation_steps']
-
-                else:
+                          'token_type_ids': batch[2]}
+                if self.teacher_logits is None:
+                    inputs['labels'] = batch[3]
+                # the last batches of an epoch update the model even if
+                # there are fewer than accumulation_steps of them
+                update = (step + 1) % accumulation_steps == 0 or step + 1 == len(train_dataloader)
+                # distributed processes only need to average the gradients before updates
+                with contextlib.nullcontext() if update or world_size == 1 else model.no_sync():
+                    with self.__autocast():
+                        outputs = model(**inputs)
+                    loss = outputs[0]  # model outputs are always tuple in pytorch-transformers (see doc)
+                    if self.teacher_logits is not None:
+                        # without labels the first output is the logits
+                        loss = self.__distillation_loss(loss, batch)
+
+                    # gradients of the accumulated batches add up to the
+                    # gradient of their mean loss
+                    loss = loss / accumulation_steps
                     loss.backward()
-                    torch.nn.utils.clip_grad_norm_(self.model.parameters(), self.args['max_grad_norm'])
 
                 tr_loss += loss.item()
-                if (step + 1) % self.args['gradient_accumulation_steps'] == 0:
+                step_loss += loss.item()
+                if update:
+                    torch.nn.utils.clip_grad_norm_(self.model.parameters(), self.args['max_grad_norm'])
                     optimizer.step()
+                    telemetry.train_step(global_step + 1, timer, step_loss, scheduler.get_last_lr()[0])
+                    step_loss = 0.0
                     scheduler.step()  # Update learning rate schedule
                     self.model.zero_grad()
                     global_step += 1
 
-    def __get_eval_report(self, labels, preds):
+                    end_of_epoch = step + 1 == len(train_dataloader)
+                    if early_stopping is not None and (
+                            global_step % self.args['eval_steps'] == 0 if self.args['eval_steps']
+                            else end_of_epoch):
+                        best_model = self.__evaluate_during_training(
+                            early_stopping, global_step, checkpointer, best_model)
+
+                    if checkpointer is not None and global_step % self.args['checkpoint_steps'] == 0:
+                        checkpointer.save(global_step, self.model, optimizer, scheduler, {
+                            'epoch': epoch, 'step': step + 1, 'global_step': global_step,
+                            'tr_loss': tr_loss, 'epoch_rng': epoch_rng,
+                            'early_stopping': early_stopping and early_stopping.state_dict()
+                        })
+                        last_checkpoint_step = global_step
+
+                    if early_stopping is not None and early_stopping.should_stop:
+                        break
+            if early_stopping is not None and early_stopping.should_stop:
+                self.logger.info("Stopping early at step %d, the best %s was %s at step %d", global_step,
+                                 early_stopping.metric, early_stopping.best_score, early_stopping.best_step)
+                break
+
+        if checkpointer is not None:
+            if last_checkpoint_step != global_step:
+                checkpointer.save(global_step, self.model, optimizer, scheduler, {
+                    'epoch': int(self.args['num_epochs']) - 1, 'step': len(train_dataloader),
+                    'global_step': global_step, 'tr_loss': tr_loss, 'epoch_rng': rng_state(),
+                    'early_stopping': early_stopping and early_stopping.state_dict()
+                })
+            checkpointer.close()
+
+        telemetry.close()
+        if best_model is not None and self.args['load_best_model']:
+            self.model.load_state_dict(best_model)
+            self.logger.info("Loaded the best model, from step %d", early_stopping.best_step)
+
+        if world_size > 1:
+            totals = torch.tensor([batch_stats.examples, batch_stats.real_tokens, batch_stats.padded_tokens],
+                                  dtype=torch.float64)
+            torch.distributed.all_reduce(totals)
+            batch_stats.examples, batch_stats.real_tokens, batch_stats.padded_tokens = (
+                int(total) for total in totals.tolist()
+            )
+        self.__log_stats("train", batch_stats.report())
+
+    def __distillation_loss(self, logits, batch):
+        """
+        :param logits: the student's logits for a training batch
+        :return: the loss of the student against self.teacher_logits
+        """
+        # batches are sorted by length, so look the teacher logits up by index
+        teacher_logits = torch.as_tensor(self.teacher_logits[batch[4].cpu().numpy()])
+        return distillation_loss(
+            logits, teacher_logits.to(logits.device),
+            labels=batch[3] if self.labelled['train'] else None,
+            temperature=self.args['distillation_temperature'],
+            alpha=self.args['distillation_alpha']
+        )
+
+    def __evaluate_during_training(self, early_stopping, global_step, checkpointer, best_model):
+        """
+        Evaluates self.train_eval_dataset and keeps the model if it is the best so far
+        :param checkpointer: saves the best model when it is not None
+        :return: the state dict of the best model, on the CPU
+        """
+        report = self.__evaluate_dataset(self.train_eval_dataset, step=global_step)
+        self.eval_history.append({'step': global_step, **report})
+        self.logger.info("Step %d: eval %s %s", global_step, early_stopping.metric,
+                         report[early_stopping.metric])
+        if early_stopping.update(global_step, report):
+            best_model = {
+                name: tensor.detach().to('cpu', copy=True)
+                for name, tensor in self.model.state_dict().items()
+            }
+            if checkpointer is not None:
+                checkpointer.save_best(global_step, self.model, report)
+        return best_model
+
+    def __get_dataloader(self, dataset, shuffle, batch_size=None, num_replicas=1, rank=0, seed=0,
+                         first_index=0, sorted_bucket_size=None):
+        """
+        Batches examples of similar length together when
+        self.args['group_by_length'] is True and pads each batch only to
+        its longest example. With self.args['max_tokens_per_batch'],
+        batches are sized by their padded tokens instead of batch_size
+        :param dataset: a FeatureDataset or a StreamingCSVDataset
+        :param shuffle: True for training, False for evaluation and testing
+        :param batch_size: self.args['batch_size'] by default
+        :param num_replicas: number of distributed training processes
+        :param rank: the rank of this process, which gets every
+               num_replicas-th batch
+        :param seed: seed shared by the distributed processes
+        :param first_index: examples before it are skipped. Streaming data
+               sets skip rows with their own start_row instead
+        :param sorted_bucket_size: without shuffling, sort examples by
+               length within buckets of this many examples, see LengthGroupedSampler
+        :return: a DataLoader that yields (input_ids, attention_mask,
+                 token_type_ids, labels, indices) batches
+        """
+        collator = PaddingCollator(
+            pad_token=self.tokenizer.convert_tokens_to_ids([self.tokenizer.pad_token])[0],
+            pad_token_segment_id=4 if self.model_name in ['XLNET'] else 0,
+            pad_on_left=bool(self.model_name in ['XLNET'])
+        )
+        if isinstance(dataset, IterableDataset):
+            # streaming data sets batch, shuffle and tokenize in the workers
+            return DataLoader(dataset, batch_size=None, collate_fn=collator,
+                              num_workers=self.args['num_workers'])
+
+        lengths = dataset.lengths()
+        max_tokens = self.args['max_tokens_per_batch']
+        if not self.args['group_by_length'] and not max_tokens:
+            # constant lengths keep the original (shuffled or sequential) order
+            lengths = [0] * len(lengths)
+        batch_sampler = LengthGroupedSampler(lengths, batch_size or self.args['batch_size'], shuffle=shuffle,
+                                             num_replicas=num_replicas, rank=rank, seed=seed,
+                                             first_index=first_index, sorted_bucket_size=sorted_bucket_size,
+                                             max_tokens=max_tokens)
+        return DataLoader(dataset, batch_sampler=batch_sampler, collate_fn=collator)
+
+    def __autocast(self):
         """
-        :param labels: Correct answers
-        :param preds: predictions
-        :return: a confusion matrix
+        :return: a bfloat16 autocast context when self.args['bf16'] is True
         """
-        assert len(preds) == len(labels)
+        return torch.autocast(device_type=self.gpu_support.type, dtype=torch.bfloat16,
+                              enabled=self.args['bf16'])
 
-        true_negative, false_positive, false_negative, true_positive = confusion_matrix(labels, preds).ravel()
-        return {
-            "true_positive": true_positive,
-            "true_negative": true_negative,
-            "false_positive": false_positive,
-            "false_negative": false_negative
-        }
+    def __telemetry(self):
+        """
+        :return: a Telemetry that sends records to self.callbacks and
+                 self.args['telemetry_path']
+        """
+        return Telemetry(self.callbacks, self.args['telemetry_path'], self.args['telemetry_steps'],
+                         self.gpu_support)
 
-    def evaluate(self):
+    @staticmethod
+    def __num_examples(dataset):
+        if isinstance(dataset, StreamingCSVDataset):
+            return dataset.num_rows
+        return len(dataset)
+
+    def __log_stats(self, task, stats):
+        """
+        Logs and stores the throughput, padding ratio and peak memory of a run
+        :param stats: a BatchStats report
+        """
+        self.stats[task] = stats
+        self.logger.info(
+            "%s: %.1f examples/s, %.1f tokens/s, %.1f%% padding, %s MB peak memory", task,
+            self.stats[task]["examples_per_second"],
+            self.stats[task]["tokens_per_second"],
+            100 * self.stats[task]["padding_ratio"],
+            "?" if self.stats[task]["peak_memory_mb"] is None else "%.0f" % self.stats[task]["peak_memory_mb"]
+        )
+
+    def __logits_buffer(self, dataset, logits_path):
         """
-        Evaluates the model against a set of questions to determine accuracy
-        :return: a dictionary confusion martrix
+        :param logits_path: path of a .npy file to memory-map the logits
+               to, or None to keep them in memory
+        :return: a zeroed (number of examples, number of labels) array
+        """
+        shape = (self.__num_examples(dataset), len(self.processor.get_labels()))
+        if logits_path is None:
+            return np.zeros(shape, dtype=np.float32)
+        return np.lib.format.open_memmap(logits_path, mode='w+', dtype=np.float32, shape=shape)
+
+    def evaluate(self, return_logits=False, logits_path=None):
+        """
+        Evaluates the model against a set of questions to determine accuracy.
+        Metrics are updated batch by batch, so the predictions are only
+        kept when they are requested
+        :param return_logits: add the logits of every example, in data set
+               order, to the results under "logits"
+        :param logits_path: path of a .npy file that the returned logits
+               are memory-mapped to, instead of being held in memory
+        :return: a dictionary with the confusion matrix counts, accuracy,
+                 precision, recall, F1, approximate ROC AUC and loss
         """
-        # Loop to handle MNLI double evaluation (matched, mis-matched)
         self.check_task()
 
         self.eval_dataset = self.__load_and_cache_examples("eval")
 
-        results = {}
-
-        eval_sampler = SequentialSampler(self.eval_dataset)
-        eval_dataloader = DataLoader(self.eval_dataset, sampler=eval_sampler, batch_size=self.args['batch_size'])
+        all_logits = None
+        if return_logits or logits_path is not None:
+            all_logits = self.__logits_buffer(self.eval_dataset, logits_path)
+        results = self.__evaluate_dataset(self.eval_dataset, all_logits)
+        if all_logits is not None:
+            results["logits"] = all_logits
+        del self.eval_dataset
+        return results
 
-        # Eval!
-        eval_loss = 0.0
-        nb_eval_steps = 0
-        preds = None
-        out_label_ids = None
-        for batch in tqdm(eval_dataloader, desc="Evaluating"):
-            self.model.eval()
+    def __evaluate_dataset(self, dataset, all_logits=None, step=None):
+        """
+        Runs the model over a labelled data set in inference mode
+        :param all_logits: an array the logits are written to, in data set order
+        :param step: the training step, when evaluating during training
+        :return: the StreamingMetrics report of the data set
+        """
+        eval_dataloader = self.__get_dataloader(dataset, shuffle=False)
+
+        metrics = StreamingMetrics(len(self.processor.get_labels()))
+        batch_stats = BatchStats(self.gpu_support)
+        telemetry = self.__telemetry()
+        timer = telemetry.timer()
+        self.model.eval()
+        for batch in timer(tqdm(eval_dataloader, desc="Evaluating")):
+            batch_stats.update(batch[1])
+            timer.add_batch(batch[1])
             batch = tuple(t.to(self.gpu_support) for t in batch)
 
-            with torch.no_grad():
+            with torch.inference_mode(), self.__autocast():
                 inputs = {'input_ids': batch[0],
                           'attention_mask': batch[1],
                           'token_type_ids': batch[2],
                           'labels': batch[3]}
-                outputs = self.model(**inputs)
-                tmp_eval_loss, logits = outputs[:2]
-
-                eval_loss += tmp_eval_loss.mean().item()
-            nb_eval_steps += 1
-            if preds is None:
-                preds = logits.detach().cpu().numpy()
-                out_label_ids = inputs['labels'].detach().cpu().numpy()
-            else:
-                preds = np.append(preds, logits.detach().cpu().numpy(), axis=0)
-                out_label_ids = np.append(out_label_ids, inputs['labels'].detach().cpu().numpy(), axis=0)
-
-
-        preds = np.argmax(preds, axis=1)
-
-
-        result = self.__get_eval_report(out_label_ids, preds)
-
-        results.update(result)
-        del self.eval_dataset
+                loss, logits = self.model(**inputs)[:2]
+                metrics.update(logits, batch[3], loss.mean())
+            if all_logits is not None:
+                # batches are sorted by length, so put them back in dataset order
+                all_logits[batch[4].cpu().numpy()] = logits.float().cpu().numpy()
+        self.__log_stats("eval", batch_stats.report())
+        results = metrics.report()
+        telemetry.emit('eval', {'step': step, **results, **timer.report()})
+        telemetry.close()
         return results
 
-    def test(self):
+    def test(self, return_logits=False, logits_path=None, output_path=None):
         """
         Generates answers for an input
 
+        :param return_logits: also return the logits of every example
+        :param logits_path: path of a .npy file that the returned logits
+               are memory-mapped to, instead of being held in memory
+        :param output_path: path of a .csv, .parquet or .npy file that the
+               predicted labels and label probabilities are streamed to
+               instead of being returned, see prediction_writer. An
+               unfinished output at this path is resumed
         :return: a list of answers where each index contains the answer 1 or 0
-                for the corresponding test question with the same index
+                for the corresponding test question with the same index.
+                With return_logits, a (answers, logits) tuple. With
+                output_path, None
         """
-        # Loop to handle MNLI double evaluation (matched, mis-matched)
         self.check_task()
 
         self.eval_dataset = self.__load_and_cache_examples("test")
+        if output_path is not None:
+            self.__predict_to_file(self.eval_dataset, output_path)
+            del self.eval_dataset
+            return None
+
+        all_logits = None
+        if return_logits or logits_path is not None:
+            all_logits = self.__logits_buffer(self.eval_dataset, logits_path)
+        preds, all_logits = self.__predict_dataset(self.eval_dataset, all_logits)
+        del self.eval_dataset
 
-        eval_sampler = SequentialSampler(self.eval_dataset)
-        eval_dataloader = DataLoader(self.eval_dataset, sampler=eval_sampler, batch_size=self.args['batch_size'])
+        if all_logits is not None:
+            return preds.tolist(), all_logits
+        return preds.tolist()
 
-        # Eval!
-        eval_loss = 0.0
-        nb_eval_steps = 0
-        preds = None
-        for batch in tqdm(eval_dataloader, desc="Evaluating"):
-            self.model.eval()
+    def __predict_dataset(self, dataset, all_logits=None):
+        """
+        Runs the model over a data set in inference mode, without labels
+        :param all_logits: an array the logits are written to, in data set order
+        :return: a (predictions, all_logits) tuple
+        """
+        eval_dataloader = self.__get_dataloader(dataset, shuffle=False)
+
+        preds = np.zeros(self.__num_examples(dataset), dtype=np.int64)
+        batch_stats = BatchStats(self.gpu_support)
+        telemetry = self.__telemetry()
+        timer = telemetry.timer()
+        self.model.eval()
+        for batch in timer(tqdm(eval_dataloader, desc="Evaluating")):
+            batch_stats.update(batch[1])
+            timer.add_batch(batch[1])
             batch = tuple(t.to(self.gpu_support) for t in batch)
 
-            with torch.no_grad():
+            with torch.inference_mode(), self.__autocast():
+                # test data has no labels, so no loss is computed
                 inputs = {'input_ids': batch[0],
                           'attention_mask': batch[1],
-                          'token_type_ids': batch[2],
-                          'labels': batch[3]}
-                outputs = self.model(**inputs)
-                tmp_eval_loss, logits = outputs[:2]
-
-                eval_loss += tmp_eval_loss.mean().item()
-            nb_eval_steps += 1
-            if preds is None:
-                preds = logits.detach().cpu().numpy()
-            else:
-                preds = np.append(preds, logits.detach().cpu().numpy(), axis=0)
-
-        preds = np.argmax(preds, axis=1)
-
+                          'token_type_ids': batch[2]}
+                logits = self.model(**inputs)[0]
+            # batches are sorted by length, so put them back in dataset order
+            indices = batch[4].cpu().numpy()
+            preds[indices] = logits.argmax(dim=1).cpu().numpy()
+            if all_logits is not None:
+                all_logits[indices] = logits.float().cpu().numpy()
+        self.__log_stats("test", batch_stats.report())
+        telemetry.emit('test', timer.report())
+        telemetry.close()
+        return preds, all_logits
+
+    def __predict_to_file(self, dataset, output_path):
+        """
+        Runs the model over a data set in inference mode and streams the
+        label probabilities to output_path in data set order. Examples are
+        sorted by length within chunks of self.args['stream_chunk_size'],
+        so only about a chunk of predictions is held in memory
+        """
+        chunk_size = self.args['stream_chunk_size']
+        writer = open_prediction_writer(output_path, self.__num_examples(dataset),
+                                        len(self.processor.get_labels()), chunk_size)
+        if writer.rows_written:
+            self.logger.info("Resuming %s after %d rows", output_path, writer.rows_written)
+        if isinstance(dataset, StreamingCSVDataset):
+            dataset.start_row = writer.rows_written
+        dataloader = self.__get_dataloader(dataset, shuffle=False, first_index=writer.rows_written,
+                                           sorted_bucket_size=chunk_size)
+
+        batch_stats = BatchStats(self.gpu_support)
+        telemetry = self.__telemetry()
+        timer = telemetry.timer()
+        self.model.eval()
+        for input_ids, attention_mask, token_type_ids, _, indices in timer(tqdm(dataloader, desc="Testing")):
+            batch_stats.update(attention_mask)
+            timer.add_batch(attention_mask)
+            with torch.inference_mode(), self.__autocast():
+                logits = self.model(
+                    input_ids=input_ids.to(self.gpu_support),
+                    attention_mask=attention_mask.to(self.gpu_support),
+                    token_type_ids=token_type_ids.to(self.gpu_support)
+                )[0]
+            writer.add(indices.numpy(), torch.softmax(logits.float(), dim=1).cpu().numpy())
+        writer.close()
+        self.__log_stats("test", batch_stats.report())
+        telemetry.emit('test', timer.report())
+        telemetry.close()
+
+    def predict(self, texts, batch_size=None, return_probabilities=True):
+        """
+        Classifies a list of texts in memory. Texts are batched by length
+        and padded per batch, and the model runs without computing a loss.
+
+        :param texts: list of strings
+        :param batch_size: number of texts per batch, self.args['batch_size']
+               by default. Not used with self.args['max_tokens_per_batch']
+        :param return_probabilities: False to return the predicted labels
+        :return: a NumPy array with a row of label probabilities for each
+                 text, or the predicted label of each text
+        """
+        self.check_task()
+        label_list = self.processor.get_labels()
+        features = featurize_texts(
+            texts, [label_list[0]] * len(texts), label_list,
+            self.args['max_seq_length'], self.tokenizer, show_progress=False
+        )
+        dataloader = self.__get_dataloader(FeatureDataset(features), shuffle=False, batch_size=batch_size)
+
+        probabilities = np.zeros((len(texts), len(label_list)), dtype=np.float32)
+        self.model.eval()
+        with torch.inference_mode(), self.__autocast():
+            for input_ids, attention_mask, token_type_ids, _, indices in dataloader:
+                logits = self.model(
+                    input_ids=input_ids.to(self.gpu_support),
+                    attention_mask=attention_mask.to(self.gpu_support),
+                    token_type_ids=token_type_ids.to(self.gpu_support)
+                )[0]
+                # batches are sorted by length, so put them back in input order
+                probabilities[indices.numpy()] = torch.softmax(logits.float(), dim=1).cpu().numpy()
+
+        if return_probabilities:
+            return probabilities
+        return probabilities.argmax(axis=1)
+
+    def __feature_cache_key(self, task):
+        """
+        :return: the feature cache key of the data set in self.data_hashes
+                 for the task, or None if the cache can't be used
+        """
+        data_hash = self.data_hashes.get(task)
+        if self.args['feature_cache_dir'] is None or data_hash is None:
+            return None
+        return feature_cache_key(data_hash, self.tokenizer, self.model_name,
+                                 self.args['max_seq_length'], labelled=self.labelled[task])
 
-        return preds.tolist()
+    def has_cached_features(self, task):
+        """
+        :param task: "train", "eval" or "test"
+        :return: True if the features of the data in self.data_hashes[task]
+                 are cached, in which case self.data[task] does not need
+                 to be set
+        """
+        key = self.__feature_cache_key(task)
+        return key is not None and os.path.isdir(os.path.join(self.args['feature_cache_dir'], key))
 
     def __load_and_cache_examples(self, task):
         """
-        Converts the proper list_data variable to a TensorDataset for the current task
-        :return: a TensorDataset for the requested task
+        Converts self.data[task] to a FeatureDataset for the current task.
+        Features are loaded from, or saved to, self.args['feature_cache_dir']
+        when the task's data hash is known
+        :return: a FeatureDataset of unpadded features for the requested task
         """
         self.processor = processors[self.args["task_mode"]]()
-        output_mode = "classification"
 
         label_list = self.processor.get_labels()
 
-        if task == 'eval':
-            examples = self.processor.get_dev_examples(self.eval_list_data)
-            del self.eval_list_data
-        elif task == 'train':
-            examples = self.processor.get_train_examples(self.train_list_data)
-            del self.train_list_data
-        else:
-            examples = self.processor.get_dev_examples(self.test_list_data)
-            del self.test_list_data
-
-
-        features = convert_examples_to_features(examples, label_list, self.args['max_seq_length'], self.tokenizer,
-                                                output_mode,
-                                                cls_token_at_end=bool(self.model_name  in ['XLNET']),
-                                                # xlnet has a cls token at the end
-                                                cls_token=self.tokenizer.cls_token,
-                                                cls_token_segment_id=2 if self.model_name  in [
-                                                    'XLNET'] else 0,
-                                                sep_token=self.tokenizer.sep_token,
-                                                sep_token_extra=bool(self.model_name  in ['ROBERTA']),
-                                                # roberta uses an extra separator b/w pairs of sentences, cf. github.com/pytorch/fairseq/commit/1684e166e3da03f5b600dbb7855cb98ddfcd0805
-                                                pad_on_left=bool(self.model_name  in ['XLNET']),
-                                                # pad on the left for xlnet
-                                                pad_token=self.tokenizer.convert_tokens_to_ids([self.tokenizer.pad_token])[0],
-                                                pad_token_segment_id=4 if self.model_name  in [
-                                                    'XLNET'] else 0)
-
-        all_input_ids = torch.tensor([f.input_ids for f in features], dtype=torch.long)
-        all_input_mask = torch.tensor([f.input_mask for f in features], dtype=torch.long)
-        all_segment_ids = torch.tensor([f.segment_ids for f in features], dtype=torch.long)
-        all_label_ids = torch.tensor([f.label_id for f in features], dtype=torch.long)
-
-
-        dataset = TensorDataset(all_input_ids, all_input_mask, all_segment_ids, all_label_ids)
-        del all_input_ids, all_input_mask, all_segment_ids, all_label_ids
-
-        return dataset
+        if self.args['streaming']:
+            return StreamingCSVDataset(
+                self.data_paths[task], self.tokenizer, label_list,
+                self.args['max_seq_length'], self.args['batch_size'],
+                labelled=self.labelled[task], shuffle=task == 'train',
+                group_by_length=self.args['group_by_length'],
+                chunk_size=self.args['stream_chunk_size'],
+                shuffle_buffer_size=self.args['shuffle_buffer_size'],
+                num_workers=self.args['num_workers']
+            )
+
+        cache_key = self.__feature_cache_key(task)
+        if cache_key is not None:
+            features = load_features(self.args['feature_cache_dir'], cache_key)
+            if features is not None:
+                self.logger.info("Loaded cached %s features", task)
+                self.data.pop(task, None)
+                return FeatureDataset(features)
+
+        data = self.data.pop(task)
+        features = featurize_texts(
+            data.texts, data.labels, label_list, self.args['max_seq_length'], self.tokenizer
+        )
+        del data
+        if cache_key is not None:
+            save_features(self.args['feature_cache_dir'], cache_key, features)
+
+        # features are padded per batch by self.__get_dataloader()
+        return FeatureDataset(features)
@@ -0,0 +1,157 @@
+"""
+Streaming classifier data set for csv files that are too large to load
+into memory. The csv is read in chunks, each chunk is tokenized inside a
+DataLoader worker, and examples are shuffled with a bounded buffer.
+"""
+
+import random
+
+import pandas as pd
+import torch
+from torch.utils.data import IterableDataset, get_worker_info
+
+from happytransformer.classifier_utils import featurize_texts
+
+
+def read_csv_chunks(csv_path, chunk_size):
+    """
+    :return: an iterator over DataFrames of chunk_size rows of a headerless csv file
+    """
+    return pd.read_csv(csv_path, header=None, chunksize=chunk_size, dtype=str, keep_default_na=False)
+
+
+def count_csv_rows(csv_path, chunk_size=10000):
+    """
+    Counts the rows of a csv file without loading it into memory. Rows are
+    parsed the same way as StreamingCSVDataset reads them, so blank lines
+    and quoted line breaks are counted the same way
+    """
+    return sum(len(chunk) for chunk in read_csv_chunks(csv_path, chunk_size))
+
+
+class StreamingCSVDataset(IterableDataset):
+    """
+    Yields batches of (index, input_ids, segment_ids, label_id) examples,
+    to be padded by batching.PaddingCollator, from a csv file that is read
+    chunk_size rows at a time. Memory use depends on chunk_size and
+    shuffle_buffer_size, not on the size of the file.
+
+    With several DataLoader workers, each worker tokenizes every
+    num_workers-th chunk and yields its own last, partial batch.
+
+    :param csv_path: path to the csv file. Labelled files have the label in
+    the first column and the text in the second, test files only have text
+    :param tokenizer: a transformers tokenizer
+    :param label_list: list of the possible labels
+    :param max_seq_length: maximum number of tokens per example
+    :param batch_size: number of examples per batch
+    :param labelled: False for test files, which have no label column
+    :param shuffle: shuffle the examples with a buffer of shuffle_buffer_size
+    examples. Without shuffling, examples keep the order of the file
+    :param group_by_length: sort examples by length within windows of
+    batch_size * 50 examples before batching them, to reduce padding
+    :param start_row: rows before it are skipped without being tokenized,
+    to resume inference
+    :param num_workers: number of DataLoader workers that read the file,
+    which __len__ needs to count their partial batches
+    """
+
+    def __init__(self, csv_path, tokenizer, label_list, max_seq_length, batch_size,
+                 labelled=True, shuffle=True, group_by_length=True,
+                 chunk_size=10000, shuffle_buffer_size=10000, start_row=0, num_workers=0):
+        self.csv_path = csv_path
+        self.tokenizer = tokenizer
+        self.label_list = label_list
+        self.max_seq_length = max_seq_length
+        self.batch_size = batch_size
+        self.labelled = labelled
+        self.shuffle = shuffle
+        self.group_by_length = group_by_length
+        self.chunk_size = chunk_size
+        self.shuffle_buffer_size = shuffle_buffer_size
+        self.start_row = start_row
+        self.num_workers = num_workers
+        self.num_rows = count_csv_rows(csv_path, chunk_size)
+
+    def __len__(self):
+        # the main process reads the whole file when there are no workers
+        num_workers = max(self.num_workers, 1)
+        worker_rows = [0] * num_workers
+        for chunk_number, first_index in enumerate(range(0, self.num_rows, self.chunk_size)):
+            last_index = min(first_index + self.chunk_size, self.num_rows)
+            worker_rows[chunk_number % num_workers] += max(last_index - max(first_index, self.start_row), 0)
+        return sum((rows + self.batch_size - 1) // self.batch_size for rows in worker_rows)
+
+    def __chunks(self):
+        """
+        Yields (first row index, texts, labels) for the chunks of this worker
+        """
+        worker_info = get_worker_info()
+        worker_id, num_workers = (0, 1) if worker_info is None else (worker_info.id, worker_info.num_workers)
+        text_column = 1 if self.labelled else 0
+        for chunk_number, chunk in enumerate(read_csv_chunks(self.csv_path, self.chunk_size)):
+            first_index = chunk_number * self.chunk_size
+            if chunk_number % num_workers != worker_id or first_index + len(chunk) <= self.start_row:
+                continue
+            if first_index < self.start_row:
+                chunk = chunk.iloc[self.start_row - first_index:]
+                first_index = self.start_row
+            texts = chunk[text_column].str.replace('\n', ' ').tolist()
+            if self.labelled:
+                labels = chunk[0].astype(int).astype(str).tolist()
+            else:
+                labels = [self.label_list[0]] * len(texts)
+            yield first_index, texts, labels
+
+    def __examples(self, rng):
+        """
+        Tokenizes chunks and yields their examples, shuffled with a buffer
+        """
+        buffer = []
+        for first_index, texts, labels in self.__chunks():
+            # one progress bar per chunk and worker would only clutter the output
+            arrays = featurize_texts(texts, labels, self.label_list, self.max_seq_length,
+                                     self.tokenizer, parallel_threshold=float('inf'), show_progress=False)
+            for row in range(len(texts)):
+                start, end = arrays.offsets[row], arrays.offsets[row + 1]
+                example = (first_index + row, arrays.input_ids[start:end],
+                           arrays.segment_ids[start:end], arrays.label_ids[row])
+                if not self.shuffle:
+                    yield example
+                    continue
+                if len(buffer) < self.shuffle_buffer_size:
+                    buffer.append(example)
+                    continue
+                # swap the new example in for a random one from the buffer
+                position = rng.randrange(len(buffer))
+                yield buffer[position]
+                buffer[position] = example
+        rng.shuffle(buffer)
+        yield from buffer
+
+    def __iter__(self):
+        # drawn from torch's generator, which DataLoader reseeds in every
+        # worker and which moves on between epochs in the main process
+        seed = torch.randint(2 ** 63 - 1, ()).item()
+        worker_info = get_worker_info()
+        rng = random.Random(seed + (worker_info.id if worker_info is not None else 0))
+        window_size = self.batch_size * 50 if self.group_by_length else self.batch_size
+        window = []
+        for example in self.__examples(rng):
+            window.append(example)
+            if len(window) == window_size:
+                yield from self.__batches(window, rng)
+                window = []
+        if window:
+            yield from self.__batches(window, rng)
+
+    def __batches(self, window, rng):
+        if self.group_by_length:
+            window = sorted(window, key=lambda example: len(example[1]), reverse=True)
+        batches = [
+            window[start:start + self.batch_size]
+            for start in range(0, len(window), self.batch_size)
+        ]
+        if self.shuffle:
+            rng.shuffle(batches)
+        return batches
@@ -0,0 +1,195 @@
+"""
+Telemetry of training, evaluation and testing loops.
+
+A loop wraps its batches with a LoopTimer, which splits the loop's time
+into waiting for the DataLoader and computing, and counts the examples
+and tokens of the batches. Telemetry turns the timer's reports into
+records that are sent to sinks: any callable that takes a dictionary,
+such as a JSONLSink or a Python function.
+
+Every record has an "event", "time", and "peak_rss_mb" entry, plus
+"peak_device_mb" on a GPU:
+    - "train_step": every log_steps optimizer steps, the "step", the mean
+      "loss" and the "learning_rate", with the timer's report since the
+      last record
+    - "eval" and "test": once per evaluation or test run, the timer's
+      report and, for "eval", the results
+The timer's reports have "examples", "tokens", "seconds",
+"examples_per_second", "tokens_per_second", "data_wait_seconds",
+"compute_seconds" and "data_wait_fraction".
+"""
+
+import json
+import time
+
+import torch
+
+from happytransformer.batching import peak_memory_mb
+
+
+def _json_value(value):
+    """
+    :return: a NumPy or torch scalar as a Python number
+    """
+    if hasattr(value, 'item'):
+        return value.item()
+    raise TypeError("{} is not JSON serializable".format(type(value).__name__))
+
+
+class JSONLSink():
+    """
+    Appends each record to a JSON lines file, which is flushed after every
+    record so that it can be followed while training
+
+    :param path: path of the file
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'a')
+
+    def __call__(self, record):
+        self.file.write(json.dumps(record, default=_json_value) + '\n')
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+class LoopTimer():
+    """
+    Times a loop over batches. The time spent in the DataLoader's next()
+    is data wait time and the time spent in the body of the loop is
+    compute time
+
+    :param device: the torch device the model runs on. On a GPU, queued
+           work is waited for at the end of each batch when synchronize is True
+    :param synchronize: whether to wait for the GPU, which gives the
+           real compute time at the cost of some speed
+    """
+
+    def __init__(self, device=None, synchronize=False):
+        self.synchronize = synchronize and device is not None and torch.device(device).type == 'cuda'
+        self.reset()
+
+    def reset(self):
+        """
+        Starts a new report
+        """
+        self.examples = 0
+        self.tokens = 0
+        self.data_wait_seconds = 0.0
+        self.compute_seconds = 0.0
+
+    def __call__(self, batches):
+        """
+        :param batches: an iterable of batches, such as a DataLoader
+        :return: a generator of the same batches
+        """
+        iterator = iter(batches)
+        while True:
+            start = time.perf_counter()
+            try:
+                batch = next(iterator)
+            except StopIteration:
+                return
+            computing = time.perf_counter()
+            self.data_wait_seconds += computing - start
+            yield batch
+            if self.synchronize:
+                torch.cuda.synchronize()
+            self.compute_seconds += time.perf_counter() - computing
+
+    def add_batch(self, attention_mask):
+        """
+        Counts the examples and real tokens of a batch
+        """
+        self.examples += attention_mask.shape[0]
+        self.tokens += int(attention_mask.sum())
+
+    def report(self):
+        """
+        :return: a dictionary with the counts and times since the last reset()
+        """
+        seconds = max(self.data_wait_seconds + self.compute_seconds, 1e-9)
+        return {
+            'examples': self.examples,
+            'tokens': self.tokens,
+            'seconds': seconds,
+            'examples_per_second': self.examples / seconds,
+            'tokens_per_second': self.tokens / seconds,
+            'data_wait_seconds': self.data_wait_seconds,
+            'compute_seconds': self.compute_seconds,
+            'data_wait_fraction': self.data_wait_seconds / seconds
+        }
+
+
+class Telemetry():
+    """
+    Sends the records of a loop to sinks. Without sinks nothing is
+    recorded, so a loop can always use a Telemetry
+
+    :param callbacks: callables that are called with each record
+    :param jsonl_path: path of a JSON lines file the records are appended to, or None
+    :param log_steps: optimizer steps per "train_step" record
+    :param device: the torch device the model runs on
+    """
+
+    def __init__(self, callbacks=(), jsonl_path=None, log_steps=1, device=None):
+        self.sinks = list(callbacks)
+        self.jsonl_sink = None
+        if jsonl_path is not None:
+            self.jsonl_sink = JSONLSink(jsonl_path)
+            self.sinks.append(self.jsonl_sink)
+        self.log_steps = max(log_steps, 1)
+        self.device = device
+        self.step_losses = []
+
+    @property
+    def enabled(self):
+        return bool(self.sinks)
+
+    def timer(self):
+        """
+        :return: a LoopTimer for a loop of this Telemetry. GPU work is only
+                 waited for when records are sent
+        """
+        return LoopTimer(self.device, synchronize=self.enabled)
+
+    def emit(self, event, record):
+        """
+        Sends a record to the sinks
+        """
+        if not self.enabled:
+            return
+        record = {'event': event, 'time': time.time(), **record, 'peak_rss_mb': peak_memory_mb()}
+        if self.device is not None and torch.device(self.device).type == 'cuda':
+            record['peak_device_mb'] = peak_memory_mb(self.device)
+        for sink in self.sinks:
+            sink(record)
+
+    def train_step(self, step, timer, loss, learning_rate):
+        """
+        Records an optimizer step, and every log_steps steps sends a
+        "train_step" record and resets the timer
+        :param step: the number of optimizer steps so far
+        :param loss: the loss of the step
+        """
+        self.step_losses.append(loss)
+        if step % self.log_steps:
+            return
+        self.emit('train_step', {
+            'step': step,
+            'loss': sum(self.step_losses) / len(self.step_losses),
+            'learning_rate': learning_rate,
+            **timer.report()
+        })
+        self.step_losses = []
+        timer.reset()
+
+    def close(self):
+        """
+        Closes the JSON lines file
+        """
+        if self.jsonl_sink is not None:
+            self.jsonl_sink.close()
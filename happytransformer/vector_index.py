@@ -0,0 +1,219 @@
+"""
+An on-disk index of normalized vectors for similarity search, used with
+the sentence embeddings of HappyTransformer.encode().
+
+The vectors are appended to a raw binary file that is memory-mapped for
+searching, so an index can be larger than memory and new vectors can be
+added without rebuilding it. Exact search multiplies the queries with
+blocks of vectors at a time. An optional inverted file (IVF) groups the
+vectors by their nearest k-means centroid, so that a search only scores
+the groups of the nprobe centroids closest to each query.
+"""
+
+import json
+import os
+
+import numpy as np
+import torch
+
+VECTORS_FILE = 'vectors.bin'
+METADATA_FILE = 'index.json'
+CENTROIDS_FILE = 'ivf_centroids.npy'
+ORDER_FILE = 'ivf_order.npy'
+OFFSETS_FILE = 'ivf_offsets.npy'
+
+
+def normalize(vectors):
+    """
+    :param vectors: a (number of vectors, dimension) array
+    :return: float32 copies of the vectors with a length of 1
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def _merge_top_k(best_scores, best_ids, scores, ids, k):
+    """
+    :param best_scores: (number of queries, at most k) tensor of the best scores so far
+    :param best_ids: tensor of the ids of best_scores
+    :param scores: (number of queries, number of vectors) tensor of new scores
+    :param ids: (number of vectors) tensor of the ids of the new scores
+    :return: the k highest scores of each query and their ids, from the highest
+    """
+    scores = torch.cat([best_scores, scores], dim=1)
+    ids = torch.cat([best_ids, ids.expand(len(scores), -1)], dim=1)
+    top = torch.topk(scores, min(k, scores.shape[1]), dim=1)
+    return top.values, torch.gather(ids, 1, top.indices)
+
+
+class VectorIndex():
+    """
+    Cosine similarity index over vectors stored in a directory.
+
+    :param index_dir: directory of the index. It is created if it does not
+           exist, otherwise new vectors are appended to it
+    :param dimension: number of values in each vector. Only needed to
+           create an index
+    :param dtype: "float32", or "float16" to store the vectors in half
+           the space. Only used when the index is created
+    :param block_size: number of vectors multiplied with the queries at a time
+    """
+
+    def __init__(self, index_dir, dimension=None, dtype='float32', block_size=65536):
+        self.index_dir = index_dir
+        self.block_size = block_size
+        metadata_path = os.path.join(index_dir, METADATA_FILE)
+        if os.path.isfile(metadata_path):
+            with open(metadata_path) as metadata_file:
+                self.metadata = json.load(metadata_file)
+        else:
+            if dimension is None:
+                raise ValueError("The dimension of the vectors is needed to create an index")
+            if dtype not in ('float32', 'float16'):
+                raise ValueError("dtype must be \"float32\" or \"float16\"")
+            os.makedirs(index_dir, exist_ok=True)
+            self.metadata = {'dimension': dimension, 'dtype': dtype, 'count': 0, 'ivf_count': 0}
+            open(os.path.join(index_dir, VECTORS_FILE), 'wb').close()
+            self.__save_metadata()
+        self.centroids, self.order, self.offsets = None, None, None
+        if self.metadata['ivf_count']:
+            self.centroids = np.load(os.path.join(index_dir, CENTROIDS_FILE))
+            self.order = np.load(os.path.join(index_dir, ORDER_FILE), mmap_mode='r')
+            self.offsets = np.load(os.path.join(index_dir, OFFSETS_FILE))
+
+    def __len__(self):
+        return self.metadata['count']
+
+    def __save_metadata(self):
+        path = os.path.join(self.index_dir, METADATA_FILE)
+        with open(path + '.tmp', 'w') as metadata_file:
+            json.dump(self.metadata, metadata_file)
+        os.replace(path + '.tmp', path)
+
+    def vectors(self):
+        """
+        :return: a memory map of the (count, dimension) normalized vectors
+        """
+        if not len(self):
+            return np.zeros((0, self.metadata['dimension']), dtype=self.metadata['dtype'])
+        # copy-on-write maps give writable arrays that torch can wrap
+        # without copying the file into memory
+        return np.memmap(os.path.join(self.index_dir, VECTORS_FILE), dtype=self.metadata['dtype'],
+                         mode='c', shape=(len(self), self.metadata['dimension']))
+
+    def add(self, vectors):
+        """
+        Normalizes and appends vectors to the index
+        :param vectors: a (number of vectors, dimension) array, such as
+               the output of HappyTransformer.encode()
+        :return: the ids of the new vectors, which are their positions in the index
+        """
+        vectors = normalize(vectors)
+        if vectors.ndim != 2 or vectors.shape[1] != self.metadata['dimension']:
+            raise ValueError("Expected vectors with {} values".format(self.metadata['dimension']))
+        start = len(self)
+        with open(os.path.join(self.index_dir, VECTORS_FILE), 'r+b') as vectors_file:
+            # a failed append before is overwritten
+            vectors_file.seek(start * self.metadata['dimension'] * np.dtype(self.metadata['dtype']).itemsize)
+            vectors_file.write(vectors.astype(self.metadata['dtype']).tobytes())
+            vectors_file.truncate()
+        self.metadata['count'] += len(vectors)
+        self.__save_metadata()
+        return np.arange(start, len(self))
+
+    def build_ivf(self, num_lists=None, iterations=10, sample_size=100000, seed=0):
+        """
+        Groups the vectors by their nearest of num_lists centroids, found by
+        k-means on a sample of the vectors. Vectors added later are searched
+        exactly until build_ivf is called again
+        :param num_lists: number of centroids, about the square root of the
+               number of vectors by default
+        :param sample_size: number of vectors the centroids are trained on
+        """
+        if not len(self):
+            raise ValueError("Add vectors to the index before building an IVF")
+        vectors = self.vectors()
+        num_lists = min(num_lists or max(1, int(np.sqrt(len(self)))), len(self))
+        generator = np.random.default_rng(seed)
+        sample = np.sort(generator.choice(len(self), min(len(self), max(sample_size, num_lists)), replace=False))
+        sample = normalize(vectors[sample])
+        centroids = sample[generator.choice(len(sample), num_lists, replace=False)]
+        for _ in range(iterations):
+            assignments = np.argmax(sample @ centroids.T, axis=1)
+            for centroid in range(num_lists):
+                members = sample[assignments == centroid]
+                if len(members):
+                    centroids[centroid] = members.sum(axis=0)
+            # spherical k-means keeps the centroids on the unit sphere
+            centroids = normalize(centroids)
+
+        assignments = np.concatenate([
+            np.argmax(vectors[start:start + self.block_size].astype(np.float32) @ centroids.T, axis=1)
+            for start in range(0, len(self), self.block_size)
+        ])
+        order = np.argsort(assignments, kind='stable')
+        offsets = np.concatenate([[0], np.cumsum(np.bincount(assignments, minlength=num_lists))])
+        np.save(os.path.join(self.index_dir, CENTROIDS_FILE), centroids)
+        np.save(os.path.join(self.index_dir, ORDER_FILE), order)
+        np.save(os.path.join(self.index_dir, OFFSETS_FILE), offsets)
+        self.centroids, self.order, self.offsets = centroids, order, offsets
+        self.metadata['ivf_count'] = len(self)
+        self.__save_metadata()
+
+    def search(self, queries, k=10, nprobe=None):
+        """
+        :param queries: a (number of queries, dimension) array, or a single vector
+        :param k: number of results per query
+        :param nprobe: with an IVF, the number of centroid lists searched
+               for each query. None searches every vector exactly
+        :return: a (scores, ids) tuple of (number of queries, k) arrays
+                 with the cosine similarities and ids of each query's
+                 nearest vectors, from the most to the least similar.
+                 When an IVF search finds fewer than k vectors, the
+                 missing results have an id of -1
+        """
+        queries = normalize(np.atleast_2d(queries))
+        k = min(k, len(self))
+        if k == 0:
+            return np.zeros((len(queries), 0), dtype=np.float32), np.zeros((len(queries), 0), dtype=np.int64)
+        vectors = self.vectors()
+        query_tensor = torch.from_numpy(queries)
+        best_scores = torch.zeros((len(queries), 0))
+        best_ids = torch.zeros((len(queries), 0), dtype=torch.long)
+
+        exact_start = 0
+        if nprobe is not None and self.centroids is not None:
+            exact_start = self.metadata['ivf_count']
+            best_scores, best_ids = self.__search_ivf(query_tensor, vectors, k, nprobe)
+        for start in range(exact_start, len(self), self.block_size):
+            block = torch.from_numpy(vectors[start:start + self.block_size]).float()
+            best_scores, best_ids = _merge_top_k(
+                best_scores, best_ids, query_tensor @ block.T, torch.arange(start, start + len(block)), k
+            )
+        return best_scores.numpy(), best_ids.numpy()
+
+    def __search_ivf(self, queries, vectors, k, nprobe):
+        """
+        :param queries: (number of queries, dimension) tensor of normalized queries
+        :return: the top k (scores, ids) tensors of each query among the
+                 vectors in the lists of its nprobe nearest centroids
+        """
+        nprobe = min(nprobe, len(self.centroids))
+        probes = torch.topk(queries @ torch.from_numpy(self.centroids).T, nprobe, dim=1).indices
+        probed = torch.zeros((len(queries), len(self.centroids)), dtype=torch.bool)
+        probed.scatter_(1, probes, True)
+        all_scores = torch.full((len(queries), k), -float('inf'))
+        all_ids = torch.full((len(queries), k), -1, dtype=torch.long)
+        # each probed list is read once and scored against every query that probes it
+        for centroid in torch.nonzero(probed.any(dim=0)).flatten().tolist():
+            rows = torch.nonzero(probed[:, centroid]).flatten()
+            # reading the ids in order keeps the reads of the memory map sequential
+            ids = np.sort(self.order[self.offsets[centroid]:self.offsets[centroid + 1]])
+            for start in range(0, len(ids), self.block_size):
+                block_ids = ids[start:start + self.block_size]
+                block = torch.from_numpy(vectors[block_ids]).float()
+                all_scores[rows], all_ids[rows] = _merge_top_k(
+                    all_scores[rows], all_ids[rows], queries[rows] @ block.T, torch.from_numpy(block_ids), k
+                )
+        return all_scores, all_ids
@@ -25,10 +25,12 @@ setup(
             'torch',
             'pandas',
             'tqdm',
-            'scikit_learn',
             'transformers>=4.0.0',
 
       ],
+    extras_require={
+            'parquet': ['pyarrow'],
+      },
     classifiers=[
         'Development Status :: 3 - Alpha',
         'Intended Audience :: Developers',
@@ -0,0 +1,70 @@
+"""
+Tests for the samplers and collate functions found within batching.py
+"""
+
+from happytransformer.batching import LengthGroupedSampler, PaddingCollator
+
+LENGTHS = [5, 1, 9, 3, 7, 2, 8, 4, 6]
+
+def test_length_grouped_sampler_sorted():
+    batches = list(LengthGroupedSampler(LENGTHS, batch_size=4, shuffle=False))
+    assert batches == [[2, 6, 4, 8], [0, 7, 3, 5], [1]]
+    assert len(LengthGroupedSampler(LENGTHS, batch_size=4)) == 3
+
+def test_length_grouped_sampler_resumed():
+    sampler = LengthGroupedSampler(LENGTHS, batch_size=2, shuffle=False, first_index=3, sorted_bucket_size=4)
+    # examples 3 to 6 are sorted together, then examples 7 and 8
+    assert list(sampler) == [[6, 4], [3, 5], [8, 7]]
+    assert len(sampler) == 3
+
+def test_length_grouped_sampler_max_tokens():
+    sampler = LengthGroupedSampler(LENGTHS, batch_size=2, shuffle=False, max_tokens=16)
+    # each batch holds as many examples as fit in 16 padded tokens
+    assert list(sampler) == [[2], [6, 4], [8, 0], [7, 3, 5, 1]]
+    assert len(sampler) == 4
+    shuffled = LengthGroupedSampler(LENGTHS, batch_size=2, shuffle=True, max_tokens=16)
+    assert len(shuffled) == 4
+    assert sorted(list(shuffled)) == sorted(sampler)
+    # an example longer than max_tokens gets a batch of its own
+    assert list(LengthGroupedSampler([30, 2], batch_size=2, shuffle=False, max_tokens=16)) == [[0], [1]]
+
+def test_length_grouped_sampler_shuffled():
+    batches = list(LengthGroupedSampler(LENGTHS, batch_size=2, shuffle=True, bucket_batches=100))
+    # every example is sampled exactly once
+    assert sorted(index for batch in batches for index in batch) == list(range(len(LENGTHS)))
+    # a single bucket is sorted by length, so each batch holds neighbouring lengths
+    for batch in batches:
+        assert max(LENGTHS[index] for index in batch) - min(LENGTHS[index] for index in batch) <= 1
+
+def test_length_grouped_sampler_distributed():
+    replicas = [
+        LengthGroupedSampler(LENGTHS, batch_size=2, num_replicas=2, rank=rank, seed=3)
+        for rank in range(2)
+    ]
+    batches = [list(sampler) for sampler in replicas]
+    # the 5 batches are padded to 3 per replica and every example is sampled
+    assert [len(rank_batches) for rank_batches in batches] == [3, 3]
+    assert len(replicas[0]) == 3
+    sampled = [index for rank_batches in batches for batch in rank_batches for index in batch]
+    assert set(sampled) == set(range(len(LENGTHS)))
+    # replicas draw new batches each epoch
+    for sampler in replicas:
+        sampler.set_epoch(1)
+    assert [list(sampler) for sampler in replicas] != batches
+
+def test_padding_collator():
+    examples = [(3, [101, 7, 102], [0, 0, 0], 1), (5, [101, 102], [0, 0], 0)]
+    input_ids, attention_mask, token_type_ids, labels, indices = PaddingCollator(pad_token=0)(examples)
+    assert input_ids.tolist() == [[101, 7, 102], [101, 102, 0]]
+    assert attention_mask.tolist() == [[1, 1, 1], [1, 1, 0]]
+    assert token_type_ids.tolist() == [[0, 0, 0], [0, 0, 0]]
+    assert labels.tolist() == [1, 0]
+    assert indices.tolist() == [3, 5]
+
+    # XLNet pads on the left
+    input_ids, attention_mask, token_type_ids, _, _ = PaddingCollator(
+        pad_token=5, pad_token_segment_id=4, pad_on_left=True
+    )(examples)
+    assert input_ids.tolist() == [[101, 7, 102], [5, 101, 102]]
+    assert attention_mask.tolist() == [[1, 1, 1], [0, 1, 1]]
+    assert token_type_ids.tolist() == [[0, 0, 0], [4, 0, 0]]
@@ -0,0 +1,61 @@
+"""
+Tests for the checkpoints found within checkpoint.py
+"""
+
+import pytest
+import torch
+
+from happytransformer.checkpoint import (
+    AsyncCheckpointer,
+    latest_checkpoint,
+    load_checkpoint,
+    set_rng_state
+)
+
+def _training_objects():
+    model = torch.nn.Linear(4, 2)
+    optimizer = torch.optim.AdamW(model.parameters(), lr=0.1)
+    scheduler = torch.optim.lr_scheduler.StepLR(optimizer, step_size=1)
+    return model, optimizer, scheduler
+
+def _step(model, optimizer, scheduler):
+    model(torch.randn(3, 4)).sum().backward()
+    optimizer.step()
+    scheduler.step()
+    optimizer.zero_grad()
+
+def test_checkpoint_round_trip(tmp_path):
+    """
+    a restored checkpoint continues training exactly like the original run
+    """
+    model, optimizer, scheduler = _training_objects()
+    checkpointer = AsyncCheckpointer(str(tmp_path), keep=2)
+    for step in range(1, 5):
+        _step(model, optimizer, scheduler)
+        checkpointer.save(step, model, optimizer, scheduler, {'step': step})
+    checkpointer.close()
+    assert sorted(path.name for path in tmp_path.iterdir()) == ['checkpoint-3.pt', 'checkpoint-4.pt']
+    assert latest_checkpoint(str(tmp_path)).endswith('checkpoint-4.pt')
+    _step(model, optimizer, scheduler)
+
+    restored_model, restored_optimizer, restored_scheduler = _training_objects()
+    training_state = load_checkpoint(str(tmp_path), restored_model, restored_optimizer, restored_scheduler)
+    assert training_state['step'] == 4
+    set_rng_state(training_state['rng'])
+    _step(restored_model, restored_optimizer, restored_scheduler)
+    assert torch.equal(model.weight, restored_model.weight)
+    assert restored_scheduler.last_epoch == scheduler.last_epoch
+
+def test_latest_checkpoint_empty(tmp_path):
+    assert latest_checkpoint(str(tmp_path)) is None
+    assert latest_checkpoint(None) is None
+
+def test_keep_at_least_one(tmp_path):
+    with pytest.raises(ValueError):
+        AsyncCheckpointer(str(tmp_path), keep=0)
+    model, optimizer, scheduler = _training_objects()
+    checkpointer = AsyncCheckpointer(str(tmp_path), keep=1)
+    for step in range(1, 3):
+        checkpointer.save(step, model, optimizer, scheduler, {'step': step})
+    checkpointer.close()
+    assert sorted(path.name for path in tmp_path.iterdir()) == ['checkpoint-2.pt']
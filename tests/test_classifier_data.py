@@ -0,0 +1,69 @@
+"""
+Tests for the readers found within classifier_data.py
+"""
+
+import pandas as pd
+import pytest
+
+from happytransformer.classifier_data import classifier_data_hash, read_classifier_data, text_list
+
+TEXTS = ["I love you.", "I hate\ncats", "dogs"]
+LABELS = [1, 0, 1]
+EXPECTED_TEXTS = ["I love you.", "I hate cats", "dogs"]
+EXPECTED_LABELS = ["1", "0", "1"]
+
+def _data_frame():
+    return pd.DataFrame({"label": LABELS, "text": TEXTS, "other": [0.5, 1.5, 2.5]})
+
+def test_read_csv(tmp_path):
+    csv_path = tmp_path / "data.csv"
+    _data_frame()[["label", "text"]].to_csv(csv_path, header=False, index=False)
+    data = read_classifier_data(str(csv_path))
+    assert text_list(data.texts) == EXPECTED_TEXTS
+    assert data.labels.tolist() == EXPECTED_LABELS
+
+    test_path = tmp_path / "test.csv"
+    _data_frame()[["text"]].to_csv(test_path, header=False, index=False)
+    data = read_classifier_data(str(test_path), labelled=False)
+    assert text_list(data.texts) == EXPECTED_TEXTS
+    assert data.labels.tolist() == ["0", "0", "0"]
+
+def test_read_jsonl(tmp_path):
+    jsonl_path = tmp_path / "data.jsonl"
+    _data_frame().to_json(jsonl_path, orient="records", lines=True)
+    data = read_classifier_data(str(jsonl_path))
+    assert text_list(data.texts) == EXPECTED_TEXTS
+    assert data.labels.tolist() == EXPECTED_LABELS
+
+def test_read_json(tmp_path):
+    json_path = tmp_path / "data.json"
+    _data_frame().to_json(json_path, orient="records")
+    data = read_classifier_data(str(json_path))
+    assert text_list(data.texts) == EXPECTED_TEXTS
+    assert data.labels.tolist() == EXPECTED_LABELS
+
+def test_read_parquet(tmp_path):
+    pytest.importorskip("pyarrow")
+    parquet_path = tmp_path / "data.parquet"
+    _data_frame().to_parquet(parquet_path)
+    data = read_classifier_data(str(parquet_path))
+    # the texts stay in Arrow memory until they are tokenized
+    assert not isinstance(data.texts, list)
+    assert text_list(data.texts) == EXPECTED_TEXTS
+    assert data.labels.tolist() == EXPECTED_LABELS
+    assert text_list(read_classifier_data(str(parquet_path), labelled=False).texts) == EXPECTED_TEXTS
+
+def test_read_in_memory():
+    for data in [_data_frame(), (TEXTS, LABELS)]:
+        result = read_classifier_data(data)
+        assert text_list(result.texts) == EXPECTED_TEXTS
+        assert result.labels.tolist() == EXPECTED_LABELS
+    # unnamed columns follow the csv column order
+    unnamed = pd.DataFrame(list(zip(LABELS, TEXTS)))
+    assert text_list(read_classifier_data(unnamed).texts) == EXPECTED_TEXTS
+    assert text_list(read_classifier_data(TEXTS, labelled=False).texts) == EXPECTED_TEXTS
+
+def test_classifier_data_hash():
+    data = read_classifier_data((TEXTS, LABELS))
+    assert classifier_data_hash(data) == classifier_data_hash(read_classifier_data(_data_frame()))
+    assert classifier_data_hash(data) != classifier_data_hash(read_classifier_data((TEXTS, [1, 1, 1])))
@@ -0,0 +1,48 @@
+"""
+Tests for the featurization functions found within classifier_utils.py
+"""
+
+from transformers import BertTokenizer
+
+from happytransformer.classifier_utils import (
+    _get_featurizer_pool,
+    featurize_texts,
+    FeatureDataset
+)
+
+VOCAB = ["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]", "i", "love", "hate", "you", "dogs", "cats", "."]
+TEXTS = ["I love you.", "I hate cats", "dogs", "I love dogs and cats and you. I love you. I hate you."]
+LABELS = ["1", "0", "1", "0"]
+
+def _tokenizer(tmp_path):
+    vocab_path = tmp_path / "vocab.txt"
+    vocab_path.write_text("\n".join(VOCAB))
+    return BertTokenizer(str(vocab_path))
+
+def test_featurize_texts(tmp_path):
+    """
+    featurize_texts gives [CLS] tokens [SEP] of each text, truncated to max_seq_length
+    """
+    tokenizer = _tokenizer(tmp_path)
+    arrays = featurize_texts(TEXTS, LABELS, ["0", "1"], 8, tokenizer, chunk_size=3)
+    dataset = FeatureDataset(arrays)
+    assert len(dataset) == len(TEXTS)
+    for index, (text, label) in enumerate(zip(TEXTS, LABELS)):
+        expected = tokenizer.convert_tokens_to_ids(["[CLS]"] + tokenizer.tokenize(text)[:6] + ["[SEP]"])
+        item_index, input_ids, segment_ids, label_id = dataset[index]
+        assert item_index == index
+        assert input_ids.tolist() == expected
+        assert segment_ids.tolist() == [0] * len(expected)
+        assert label_id == int(label)
+    assert dataset.lengths().tolist() == [6, 5, 3, 8]
+
+def test_featurizer_pool_follows_the_tokenizer(tmp_path):
+    """
+    The worker pool is reused for the same tokenizer, and restarted for a new one
+    """
+    tokenizer = _tokenizer(tmp_path)
+    pool = _get_featurizer_pool(tokenizer, 8, 1)
+    assert _get_featurizer_pool(tokenizer, 8, 1) is pool
+    other_pool = _get_featurizer_pool(_tokenizer(tmp_path), 8, 1)
+    assert other_pool is not pool
+    other_pool.shutdown()
@@ -0,0 +1,57 @@
+"""
+Tests for the distillation of sequence classifiers found within distillation.py
+"""
+
+import torch
+from transformers import BertConfig, BertForSequenceClassification
+
+from happytransformer.distillation import (
+    create_student,
+    distillation_loss,
+    num_layers
+)
+from happytransformer.feature_cache import model_fingerprint
+
+def _teacher():
+    torch.manual_seed(0)
+    config = BertConfig(vocab_size=20, hidden_size=16, num_hidden_layers=4, num_attention_heads=2,
+                        intermediate_size=32, num_labels=2)
+    return BertForSequenceClassification(config)
+
+def test_distillation_loss():
+    teacher_logits = torch.tensor([[2.0, -1.0], [0.5, 1.5]])
+    labels = torch.tensor([0, 1])
+    # a student that matches the teacher has no soft target loss
+    assert distillation_loss(teacher_logits, teacher_logits).item() < 1e-6
+    student_logits = torch.tensor([[-1.0, 2.0], [0.0, 0.0]])
+    soft_loss = distillation_loss(student_logits, teacher_logits)
+    assert soft_loss.item() > 0
+    hard_loss = torch.nn.functional.cross_entropy(student_logits, labels)
+    mixed = distillation_loss(student_logits, teacher_logits, labels, alpha=0.25)
+    assert abs(mixed.item() - (0.25 * soft_loss.item() + 0.75 * hard_loss.item())) < 1e-5
+    assert abs(distillation_loss(student_logits, teacher_logits, labels, alpha=0.0).item()
+               - hard_loss.item()) < 1e-5
+
+def test_create_student():
+    teacher = _teacher()
+    student = create_student(teacher, {"num_hidden_layers": 2})
+    assert num_layers(student.state_dict()) == 2
+    assert student.config.num_labels == 2
+    teacher_state, student_state = teacher.state_dict(), student.state_dict()
+    # the student starts from the first and the last teacher layer
+    for student_layer, teacher_layer in ((0, 0), (1, 3)):
+        name = "bert.encoder.layer.{}.output.dense.weight"
+        assert student_state[name.format(student_layer)].equal(teacher_state[name.format(teacher_layer)])
+    assert student_state["classifier.weight"].equal(teacher_state["classifier.weight"])
+
+    # weights with a different shape are not copied
+    narrow = create_student(teacher, {"hidden_size": 8, "intermediate_size": 16})
+    assert narrow.classifier.weight.shape == (2, 8)
+
+def test_model_fingerprint():
+    teacher = _teacher()
+    fingerprint = model_fingerprint(teacher)
+    assert fingerprint == model_fingerprint(teacher)
+    with torch.no_grad():
+        teacher.classifier.bias += 1
+    assert fingerprint != model_fingerprint(teacher)
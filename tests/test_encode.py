@@ -0,0 +1,36 @@
+"""
+Tests for the sentence embeddings of HappyTransformer.encode()
+"""
+
+import numpy as np
+
+from happytransformer import HappyBERT
+from happytransformer.vector_index import VectorIndex
+
+happy = HappyBERT()
+TEXTS = [
+    "The cat sat on the mat.",
+    "How old are you?",
+    "A kitten was sitting on a rug.",
+    "I am 40 years old and I live in Paris."
+]
+
+def test_encode_batching():
+    '''batching by length must not change the embeddings'''
+    embeddings = happy.encode(TEXTS, batch_size=3)
+    assert embeddings.shape == (len(TEXTS), 768)
+    assert embeddings.dtype == np.float32
+    singles = np.stack([happy.encode([text])[0] for text in TEXTS])
+    assert np.allclose(embeddings, singles, atol=1e-4)
+
+def test_encode_cls_float16():
+    embeddings = happy.encode(TEXTS, pooling="cls", dtype="float16")
+    assert embeddings.shape == (len(TEXTS), 768)
+    assert embeddings.dtype == np.float16
+
+def test_encode_search(tmp_path):
+    index = VectorIndex(str(tmp_path / "index"), dimension=768, dtype="float16")
+    index.add(happy.encode(TEXTS))
+    scores, ids = index.search(happy.encode(["Is the cat sitting on the mat?"]), k=2)
+    assert ids[0, 0] == 0
+    assert scores[0, 0] >= scores[0, 1]
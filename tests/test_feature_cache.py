@@ -0,0 +1,61 @@
+"""
+Tests for the on-disk feature cache found within feature_cache.py
+"""
+
+import numpy as np
+import pytest
+from transformers import BertTokenizer
+
+from happytransformer.classifier_utils import FeatureArrays
+from happytransformer.feature_cache import (
+    cache_entry,
+    feature_cache_key,
+    file_sha256,
+    load_features,
+    save_features
+)
+
+def test_feature_cache(tmp_path):
+    data_path = tmp_path / "data.csv"
+    data_path.write_text('0,"I hate you"\n1,"I love you"\n')
+    vocab_path = tmp_path / "vocab.txt"
+    vocab_path.write_text("\n".join(["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]", "i", "love", "hate", "you"]))
+    tokenizer = BertTokenizer(str(vocab_path))
+
+    key = feature_cache_key(file_sha256(str(data_path)), tokenizer, "BERT", 128)
+    # every part of the key matters
+    assert key != feature_cache_key(file_sha256(str(data_path)), tokenizer, "BERT", 64)
+    assert key != feature_cache_key(file_sha256(str(data_path)), tokenizer, "ROBERTA", 128)
+    assert key != feature_cache_key(file_sha256(str(data_path)), tokenizer, "BERT", 128, labelled=False)
+    data_path.write_text('1,"I hate you"\n1,"I love you"\n')
+    assert key != feature_cache_key(file_sha256(str(data_path)), tokenizer, "BERT", 128)
+
+    cache_dir = str(tmp_path / "cache")
+    assert load_features(cache_dir, key) is None
+    arrays = FeatureArrays(
+        input_ids=np.array([2, 5, 7, 8, 3, 2, 5, 6, 8, 3], dtype=np.int32),
+        segment_ids=np.zeros(10, dtype=np.int8),
+        offsets=np.array([0, 5, 10], dtype=np.int64),
+        label_ids=np.array([0, 1], dtype=np.int64)
+    )
+    save_features(cache_dir, key, arrays)
+    loaded = load_features(cache_dir, key)
+    for field, array in zip(FeatureArrays._fields, arrays):
+        loaded_array = getattr(loaded, field)
+        assert isinstance(loaded_array, np.memmap)
+        assert loaded_array.dtype == array.dtype
+        assert loaded_array.tolist() == array.tolist()
+
+def test_cache_entry(tmp_path):
+    cache_dir = tmp_path / "cache"
+    with cache_entry(str(cache_dir), "first") as entry:
+        (tmp_path / entry / "data.txt").write_text("first")
+    # an entry written by another process first is kept
+    with cache_entry(str(cache_dir), "first") as entry:
+        (tmp_path / entry / "data.txt").write_text("second")
+    assert (cache_dir / "first" / "data.txt").read_text() == "first"
+    # an interrupted entry leaves nothing behind
+    with pytest.raises(KeyboardInterrupt):
+        with cache_entry(str(cache_dir), "second") as entry:
+            raise KeyboardInterrupt
+    assert sorted(path.name for path in cache_dir.iterdir()) == ["first"]
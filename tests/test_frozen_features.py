@@ -0,0 +1,69 @@
+"""
+Tests for the frozen encoder features found within frozen_features.py
+"""
+
+import numpy as np
+import torch
+from transformers import (
+    BertConfig,
+    BertForSequenceClassification,
+    RobertaConfig,
+    RobertaForSequenceClassification,
+    XLNetConfig,
+    XLNetForSequenceClassification
+)
+
+from happytransformer.feature_cache import model_fingerprint
+from happytransformer.frozen_features import (
+    FrozenFeatures,
+    encoder_features,
+    frozen_fingerprint_skip,
+    head_logits
+)
+
+def _models():
+    torch.manual_seed(0)
+    return [
+        BertForSequenceClassification(BertConfig(
+            vocab_size=20, hidden_size=16, num_hidden_layers=3, num_attention_heads=4, intermediate_size=32)),
+        RobertaForSequenceClassification(RobertaConfig(
+            vocab_size=20, hidden_size=16, num_hidden_layers=3, num_attention_heads=4, intermediate_size=32)),
+        XLNetForSequenceClassification(XLNetConfig(vocab_size=20, d_model=16, n_layer=3, n_head=4, d_inner=32))
+    ]
+
+def test_head_logits_match_the_model():
+    input_ids = torch.randint(5, 20, (3, 7), generator=torch.Generator().manual_seed(0))
+    attention_mask = torch.ones(3, 7, dtype=torch.long)
+    token_type_ids = torch.zeros(3, 7, dtype=torch.long)
+    for model in _models():
+        model.eval()
+        unfrozen = [0] if isinstance(model, XLNetForSequenceClassification) else [0, 1, 2]
+        with torch.no_grad():
+            expected = model(input_ids=input_ids, attention_mask=attention_mask,
+                             token_type_ids=token_type_ids).logits
+            for unfrozen_layers in unfrozen:
+                features = encoder_features(model, input_ids, attention_mask, token_type_ids, unfrozen_layers)
+                logits = head_logits(model, features, attention_mask, unfrozen_layers)
+                assert torch.allclose(logits, expected, atol=1e-5)
+
+def test_fingerprint_ignores_trained_weights():
+    model = _models()[0]
+    fingerprint = model_fingerprint(model, frozen_fingerprint_skip(model))
+    with torch.no_grad():
+        model.classifier.weight += 1
+    assert fingerprint == model_fingerprint(model, frozen_fingerprint_skip(model))
+    # the top layer is trained when it is unfrozen
+    fingerprint = model_fingerprint(model, frozen_fingerprint_skip(model, unfrozen_layers=1))
+    with torch.no_grad():
+        model.bert.encoder.layer[2].output.dense.bias += 1
+    assert fingerprint == model_fingerprint(model, frozen_fingerprint_skip(model, unfrozen_layers=1))
+    assert fingerprint != model_fingerprint(model, frozen_fingerprint_skip(model))
+
+def test_frozen_features_batch():
+    hidden_states = np.arange(12, dtype=np.float32).reshape(6, 2)
+    features = FrozenFeatures(hidden_states, offsets=np.array([0, 1, 4, 6]))
+    batch, attention_mask = features.batch([2, 0], 'cpu')
+    assert batch.shape == (2, 2, 2)
+    assert attention_mask.tolist() == [[1, 1], [1, 0]]
+    assert batch[0].tolist() == [[8, 9], [10, 11]]
+    assert batch[1, 0].tolist() == [0, 1]
@@ -0,0 +1,50 @@
+"""
+Tests for the MaskingCollator found within mlm_utils.py
+"""
+
+import pickle
+
+import torch
+from transformers import BertTokenizer
+
+from happytransformer.mlm_utils import MaskingCollator
+
+def make_tokenizer(tmp_path):
+    vocab_path = tmp_path / "vocab.txt"
+    vocab_path.write_text("\n".join(["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]", "i", "love", "hate", "you",
+                                     "un", "##believ", "##able"]))
+    return BertTokenizer(str(vocab_path))
+
+def test_special_tokens_are_never_masked(tmp_path):
+    tokenizer = make_tokenizer(tmp_path)
+    torch.manual_seed(0)
+    collator = MaskingCollator(tokenizer, mlm_probability=1.0)
+    examples = [torch.tensor(tokenizer.encode("i love you", padding="max_length", max_length=8))] * 4
+    inputs, labels = collator(examples)
+    special = torch.tensor([[1, 0, 0, 0, 1, 1, 1, 1]] * 4, dtype=torch.bool)
+    assert (labels[special] == -100).all()
+    assert (labels[~special] == torch.stack(examples)[~special]).all()
+    assert (inputs[special] == torch.stack(examples)[special]).all()
+
+def test_whole_word_mask(tmp_path):
+    tokenizer = make_tokenizer(tmp_path)
+    collator = MaskingCollator(tokenizer, mlm_probability=0.5, whole_word_mask=True)
+    example = torch.tensor(tokenizer.encode("i unbelievable you"))
+    assert tokenizer.convert_ids_to_tokens(example.tolist()) == [
+        "[CLS]", "i", "un", "##believ", "##able", "you", "[SEP]"]
+    torch.manual_seed(0)
+    _, labels = collator([example] * 200)
+    chosen = labels != -100
+    # the pieces of "unbelievable" are masked together
+    assert (chosen[:, 2] == chosen[:, 3]).all() and (chosen[:, 2] == chosen[:, 4]).all()
+    assert chosen[:, 2].any() and not chosen[:, 2].all()
+    assert not chosen[:, [0, 6]].any()
+
+def test_trim_padding_and_pickling(tmp_path):
+    tokenizer = make_tokenizer(tmp_path)
+    collator = pickle.loads(pickle.dumps(MaskingCollator(tokenizer, mlm_probability=0.0, trim_padding=True)))
+    examples = [torch.tensor(tokenizer.encode(text, padding="max_length", max_length=10))
+                for text in ("i love you", "i hate")]
+    inputs, labels = collator(examples)
+    assert inputs.shape == (2, 5)
+    assert (labels == -100).all()
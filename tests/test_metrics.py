@@ -0,0 +1,86 @@
+"""
+Tests for the StreamingMetrics found within metrics.py
+"""
+
+import numpy as np
+import torch
+
+from happytransformer.metrics import EarlyStopping, StreamingMetrics
+
+def _exact_roc_auc(scores, labels):
+    positives = scores[labels == 1]
+    negatives = scores[labels == 0]
+    greater = (positives[:, None] > negatives[None, :]).sum()
+    ties = (positives[:, None] == negatives[None, :]).sum()
+    return (greater + 0.5 * ties) / (len(positives) * len(negatives))
+
+def test_binary_metrics():
+    """
+    metrics accumulated over batches match metrics computed at once
+    """
+    generator = torch.Generator().manual_seed(0)
+    labels = torch.randint(0, 2, (1000,), generator=generator)
+    logits = torch.randn(1000, 2, generator=generator)
+    logits[:, 1] += labels.float()
+
+    metrics = StreamingMetrics()
+    for start in range(0, 1000, 64):
+        metrics.update(logits[start:start + 64], labels[start:start + 64], loss=1.0)
+    report = metrics.report()
+
+    predictions = logits.argmax(dim=1)
+    true_positive = int(((predictions == 1) & (labels == 1)).sum())
+    false_positive = int(((predictions == 1) & (labels == 0)).sum())
+    false_negative = int(((predictions == 0) & (labels == 1)).sum())
+    assert report["true_positive"] == true_positive
+    assert report["false_positive"] == false_positive
+    assert report["false_negative"] == false_negative
+    assert report["true_negative"] == 1000 - true_positive - false_positive - false_negative
+    assert report["accuracy"] == int((predictions == labels).sum()) / 1000
+    precision = true_positive / (true_positive + false_positive)
+    recall = true_positive / (true_positive + false_negative)
+    assert abs(report["precision"] - precision) < 1e-9
+    assert abs(report["recall"] - recall) < 1e-9
+    assert abs(report["f1"] - 2 * precision * recall / (precision + recall)) < 1e-9
+    assert report["loss"] == 1.0
+
+    scores = torch.softmax(logits, dim=1)[:, 1].numpy()
+    assert abs(report["roc_auc"] - _exact_roc_auc(scores, labels.numpy())) < 2e-3
+
+def test_multiclass_metrics():
+    labels = torch.tensor([0, 1, 2, 2])
+    logits = torch.eye(3)[torch.tensor([0, 1, 2, 1])] * 5
+    metrics = StreamingMetrics(num_labels=3)
+    metrics.update(logits, labels)
+    report = metrics.report()
+    assert metrics.confusion_matrix().tolist() == [[1, 0, 0], [0, 1, 0], [0, 1, 1]]
+    assert report["accuracy"] == 0.75
+    assert abs(report["recall"] - np.mean([1, 1, 0.5])) < 1e-9
+    assert "true_positive" not in report
+    assert "loss" not in report
+
+def test_roc_auc_single_class():
+    metrics = StreamingMetrics()
+    metrics.update(torch.randn(4, 2), torch.ones(4, dtype=torch.long))
+    assert metrics.report()["roc_auc"] is None
+
+def test_early_stopping():
+    early_stopping = EarlyStopping(metric='loss', patience=2)
+    assert early_stopping.update(1, {'loss': 0.5})
+    assert early_stopping.update(2, {'loss': 0.4})
+    assert not early_stopping.update(3, {'loss': 0.45})
+    assert not early_stopping.should_stop
+    assert not early_stopping.update(4, {'loss': 0.4})
+    assert early_stopping.should_stop
+    assert (early_stopping.best_step, early_stopping.best_score) == (2, 0.4)
+
+    restored = EarlyStopping(metric='loss', patience=2)
+    restored.load_state_dict(early_stopping.state_dict())
+    assert restored.should_stop
+
+def test_early_stopping_maximizes_metrics():
+    early_stopping = EarlyStopping(metric='accuracy')
+    early_stopping.update(1, {'accuracy': 0.5})
+    assert early_stopping.update(2, {'accuracy': 0.6})
+    assert not early_stopping.update(3, {'accuracy': 0.55})
+    assert not early_stopping.should_stop
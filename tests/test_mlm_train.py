@@ -0,0 +1,37 @@
+"""
+Tests for masked word prediction fine-tuning on the CPU, found within mlm_utils.py
+"""
+
+import logging
+
+import torch
+from transformers import BertConfig, BertForMaskedLM, BertTokenizer
+
+from happytransformer.mlm_utils import FinetuneMlm, word_prediction_args
+
+def test_train_and_evaluate_on_cpu(tmp_path):
+    vocab_path = tmp_path / "vocab.txt"
+    vocab_path.write_text("\n".join(["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]", "i", "love", "hate", "you"]))
+    tokenizer = BertTokenizer(str(vocab_path))
+    text_path = tmp_path / "train.txt"
+    text_path.write_text("i love you\ni hate you\n" * 20)
+    torch.manual_seed(0)
+    config = BertConfig(vocab_size=len(tokenizer), hidden_size=16, num_hidden_layers=1,
+                        num_attention_heads=2, intermediate_size=32)
+    records = []
+    args = {**word_prediction_args, "batch_size": 2, "epochs": 2, "block_size": 8, "num_workers": 0,
+            "gradient_accumulation_steps": 2, "feature_cache_dir": str(tmp_path / "cache")}
+    trainer = FinetuneMlm(BertForMaskedLM(config), args, tokenizer, logging.getLogger(__name__),
+                          callbacks=[records.append], device="cpu")
+    trainer.train(str(text_path))
+
+    # 120 tokens make 20 blocks of 6 tokens between [CLS] and [SEP], so each
+    # epoch has 10 batches and 5 optimizer steps
+    steps = [record for record in records if record["event"] == "train_step"]
+    assert [record["step"] for record in steps] == list(range(1, 11))
+    assert sum(record["examples"] for record in steps) == 40
+    # the learning rate decays over every step of training
+    assert steps[-1]["learning_rate"] == args["lr"] / 10
+
+    result = trainer.evaluate(str(text_path), batch_size=4)
+    assert result["perplexity"] > 1
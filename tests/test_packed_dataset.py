@@ -0,0 +1,64 @@
+"""
+Tests for the packed-block MLM data set found within packed_dataset.py
+"""
+
+import os
+import pickle
+
+import numpy as np
+import pytest
+from transformers import BertTokenizer
+
+from happytransformer.packed_dataset import create_packed_dataset
+
+def make_tokenizer(tmp_path):
+    vocab_path = tmp_path / "vocab.txt"
+    vocab_path.write_text("\n".join(["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]", "i", "love", "hate", "you"]))
+    return BertTokenizer(str(vocab_path))
+
+def test_packed_dataset(tmp_path):
+    tokenizer = make_tokenizer(tmp_path)
+    text_path = tmp_path / "train.txt"
+    # blank lines add no tokens and the last two tokens don't fill a block
+    text_path.write_text("i love you\n\ni hate you\n\ni love i hate you\n")
+    dataset = create_packed_dataset(tokenizer, str(text_path), block_size=5, chunk_lines=2)
+    # each block holds 3 tokens between [CLS] and [SEP], across line and chunk
+    # boundaries, and the last block is padded
+    assert [tokenizer.convert_ids_to_tokens(dataset[i].tolist()) for i in range(len(dataset))] == [
+        ["[CLS]", "i", "love", "you", "[SEP]"],
+        ["[CLS]", "i", "hate", "you", "[SEP]"],
+        ["[CLS]", "i", "love", "i", "[SEP]"],
+        ["[CLS]", "hate", "you", "[SEP]", "[PAD]"],
+    ]
+    assert dataset.lengths() == [5, 5, 5, 4]
+    # without a cache the blocks are memory-mapped from a temporary directory
+    assert isinstance(dataset.blocks, np.memmap)
+    assert os.path.dirname(dataset.blocks.filename) == dataset.temporary_dir.name
+    assert pickle.loads(pickle.dumps(dataset)).temporary_dir is None
+
+    cache_dir = str(tmp_path / "cache")
+    cached = create_packed_dataset(tokenizer, str(text_path), block_size=5, cache_dir=cache_dir)
+    assert isinstance(cached.blocks, np.memmap)
+    assert cached.blocks.dtype == np.uint16
+    assert np.array_equal(cached.blocks, dataset.blocks)
+    # DataLoader workers map the cached file again
+    unpickled = pickle.loads(pickle.dumps(cached))
+    assert isinstance(unpickled.blocks, np.memmap)
+    assert np.array_equal(unpickled.blocks, dataset.blocks)
+    # the blocks of an unchanged file are read from the cache
+    create_packed_dataset(tokenizer, str(text_path), block_size=5, cache_dir=cache_dir)
+    assert len(os.listdir(cache_dir)) == 1
+
+    text_path.write_text("\n")
+    with pytest.raises(ValueError):
+        create_packed_dataset(tokenizer, str(text_path), block_size=5, cache_dir=cache_dir)
+
+def test_shorter_than_a_block(tmp_path):
+    tokenizer = make_tokenizer(tmp_path)
+    text_path = tmp_path / "short.txt"
+    text_path.write_text("i love\n")
+    for cache_dir in (None, str(tmp_path / "cache")):
+        dataset = create_packed_dataset(tokenizer, str(text_path), block_size=512, cache_dir=cache_dir)
+        assert len(dataset) == 1
+        assert tokenizer.convert_ids_to_tokens(dataset[0][:5].tolist()) == ["[CLS]", "i", "love", "[SEP]", "[PAD]"]
+        assert dataset.lengths() == [4]
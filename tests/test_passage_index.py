@@ -0,0 +1,63 @@
+"""
+Tests for the BM25 PassageIndex used by open-domain question answering
+"""
+
+import os
+
+from happytransformer.passage_index import PassageIndex, split_passages
+
+DOCUMENTS = {
+    'mcgill.txt': 'McGill is a university located in Montreal. It was founded in 1821.',
+    'toronto.txt': 'The University of Toronto is a university located in Toronto.',
+    'nile.txt': 'The Nile is the longest river in Africa.',
+}
+
+def _write_documents(directory):
+    paths = []
+    for name, text in DOCUMENTS.items():
+        path = os.path.join(str(directory), name)
+        with open(path, 'w') as text_file:
+            text_file.write(text)
+        paths.append(path)
+    return paths
+
+def test_split_passages():
+    text = 'one two three four five\n\nsix seven'
+    assert split_passages(text, passage_words=2) == ['one two', 'three four', 'five', 'six seven']
+
+def test_search(tmp_path):
+    index = PassageIndex(str(tmp_path / 'corpus.index'))
+    paths = _write_documents(tmp_path)
+    assert index.add_files(paths) == 3
+    assert len(index) == 3
+
+    results = index.search('Which university is located in Montreal?', top_n=2)
+    assert len(results) == 2
+    assert results[0].source.endswith('mcgill.txt')
+    assert results[0].score > results[1].score
+    assert index.search('longest river', top_n=1)[0].source.endswith('nile.txt')
+    assert index.search('zebra') == []
+
+def test_incremental_add(tmp_path):
+    index_path = str(tmp_path / 'corpus.index')
+    paths = _write_documents(tmp_path)
+    index = PassageIndex(index_path)
+    index.add_files(paths[:2])
+    index.close()
+
+    # reopening the index appends to it, and unchanged files are skipped
+    index = PassageIndex(index_path)
+    assert index.add_files(paths) == 1
+    assert len(index) == 3
+
+    # changed files replace their old passages
+    with open(paths[2], 'w') as text_file:
+        text_file.write('The Amazon is a river in South America.')
+    os.utime(paths[2], (0, 0))
+    assert index.add_files(paths) == 1
+    assert len(index) == 3
+    assert index.search('Nile') == []
+    assert index.search('Amazon')[0].source.endswith('nile.txt')
+
+    assert index.add_texts(['Paris is the capital of France.'], source='memory') == 1
+    assert index.search('capital of France')[0].source == 'memory'
@@ -0,0 +1,91 @@
+"""
+Tests for the prediction writers found within prediction_writer.py
+"""
+
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from happytransformer.prediction_writer import open_prediction_writer
+
+def _probabilities(count, seed=0):
+    probabilities = np.random.default_rng(seed).random((count, 2)).astype(np.float32)
+    return probabilities / probabilities.sum(axis=1, keepdims=True)
+
+def _write(writer, probabilities, first_row=0, last_row=None, batch_size=4):
+    """
+    adds rows in batches of shuffled indices, in reverse batch order within chunks of 12
+    """
+    last_row = len(probabilities) if last_row is None else last_row
+    rng = np.random.default_rng(1)
+    for chunk_start in range(first_row, last_row, 12):
+        indices = rng.permutation(np.arange(chunk_start, min(chunk_start + 12, last_row)))
+        for start in reversed(range(0, len(indices), batch_size)):
+            batch = indices[start:start + batch_size]
+            writer.add(batch, probabilities[batch])
+
+def _read(path):
+    if path.endswith(".csv"):
+        return pd.read_csv(path)
+    return pd.read_parquet(path)
+
+@pytest.mark.parametrize("extension", [".csv", ".parquet"])
+def test_table_writers(tmp_path, extension):
+    if extension == ".parquet":
+        pytest.importorskip("pyarrow")
+    probabilities = _probabilities(50)
+    path = str(tmp_path / ("predictions" + extension))
+    writer = open_prediction_writer(path, 50, 2, chunk_size=10)
+    _write(writer, probabilities)
+    writer.close()
+    output = _read(path)
+    assert output["label"].tolist() == probabilities.argmax(axis=1).tolist()
+    assert np.allclose(output[["probability_0", "probability_1"]].values, probabilities, atol=1e-6)
+    assert os.listdir(str(tmp_path)) == ["predictions" + extension]
+    # a finished output is not written again
+    assert open_prediction_writer(path, 50, 2).rows_written == 50
+
+@pytest.mark.parametrize("extension", [".csv", ".parquet", ".npy"])
+def test_resume(tmp_path, extension):
+    if extension == ".parquet":
+        pytest.importorskip("pyarrow")
+    probabilities = _probabilities(50)
+    path = str(tmp_path / ("predictions" + extension))
+    # an interrupted run only commits whole chunks that follow the written rows
+    writer = open_prediction_writer(path, 50, 2, chunk_size=10)
+    _write(writer, probabilities, last_row=30)
+    assert 0 < writer.rows_written <= 30
+    if extension == ".csv":
+        with open(path, "a") as csv_file:
+            csv_file.write("1,0.3")  # a row that was cut off
+
+    writer = open_prediction_writer(path, 50, 2, chunk_size=10)
+    first_row = writer.rows_written
+    assert 0 < first_row <= 30
+    _write(writer, probabilities, first_row=first_row)
+    writer.close()
+    if extension == ".npy":
+        assert np.allclose(np.load(path), probabilities)
+    else:
+        output = _read(path)
+        assert np.allclose(output[["probability_0", "probability_1"]].values, probabilities, atol=1e-6)
+    assert os.listdir(str(tmp_path)) == ["predictions" + extension]
+
+def test_missing_rows(tmp_path):
+    writer = open_prediction_writer(str(tmp_path / "predictions.npy"), 10, 2)
+    writer.add(np.arange(9), _probabilities(9))
+    with pytest.raises(ValueError):
+        writer.close()
+
+@pytest.mark.parametrize("extension", [".parquet", ".npy"])
+def test_finished_output_of_other_data(tmp_path, extension):
+    if extension == ".parquet":
+        pytest.importorskip("pyarrow")
+    path = str(tmp_path / ("predictions" + extension))
+    writer = open_prediction_writer(path, 10, 2)
+    _write(writer, _probabilities(10))
+    writer.close()
+    with pytest.raises(ValueError):
+        open_prediction_writer(path, 20, 2)
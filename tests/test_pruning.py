@@ -0,0 +1,97 @@
+"""
+Tests for the structured pruning found within pruning.py
+"""
+
+import torch
+from transformers import (
+    BertConfig,
+    BertForQuestionAnswering,
+    BertForSequenceClassification,
+    BertTokenizer,
+    XLNetConfig,
+    XLNetForSequenceClassification
+)
+
+from happytransformer import HappyBERT
+from happytransformer.pruning import (
+    count_flops,
+    drop_top_layers,
+    head_importance,
+    prune_model
+)
+
+def _batches():
+    generator = torch.Generator().manual_seed(0)
+    return [{
+        'input_ids': torch.randint(5, 20, (4, 10), generator=generator),
+        'attention_mask': torch.ones(4, 10, dtype=torch.long),
+        'labels': torch.randint(0, 2, (4,), generator=generator)
+    } for _ in range(3)]
+
+def _bert():
+    torch.manual_seed(0)
+    return BertForSequenceClassification(BertConfig(
+        vocab_size=20, hidden_size=16, num_hidden_layers=3, num_attention_heads=4, intermediate_size=32
+    ))
+
+def test_head_importance():
+    importance = head_importance(_bert(), _batches())
+    assert [len(scores) for scores in importance] == [4, 4, 4]
+    assert all(abs(scores.norm().item() - 1) < 1e-4 for scores in importance)
+
+def test_prune_model(tmp_path):
+    model = _bert()
+    batches = _batches()
+    report = prune_model(model, batches, {'head_fraction': 0.5, 'layers_to_drop': 1, 'recovery_steps': 2})
+    assert model.config.num_hidden_layers == 2
+    # half of the heads of the two remaining layers
+    assert sum(len(heads) for heads in report['pruned_heads'].values()) == 4
+    assert report['after']['parameters'] < report['before']['parameters']
+    assert report['after']['flops_per_example'] < report['before']['flops_per_example']
+
+    # a saved pruned model loads with the same structure and predictions
+    model.save_pretrained(str(tmp_path))
+    loaded = BertForSequenceClassification.from_pretrained(str(tmp_path))
+    loaded.eval()
+    with torch.no_grad():
+        assert torch.allclose(loaded(input_ids=batches[0]['input_ids']).logits,
+                              model(input_ids=batches[0]['input_ids']).logits, atol=1e-5)
+
+def test_head_pruning_keeps_a_head_per_layer():
+    model = _bert()
+    report = prune_model(model, _batches(), {'head_fraction': 1.0})
+    assert all(len(heads) == 3 for heads in report['pruned_heads'].values())
+
+def test_xlnet_layers():
+    torch.manual_seed(0)
+    model = XLNetForSequenceClassification(XLNetConfig(
+        vocab_size=20, d_model=16, n_layer=3, n_head=4, d_inner=32
+    ))
+    batch = _batches()[0]
+    flops = count_flops(model, batch)
+    drop_top_layers(model, 2)
+    assert model.config.n_layer == 1
+    assert count_flops(model, batch) < flops
+
+def test_prune_qa_reloads(tmp_path):
+    model_dir = str(tmp_path / "model")
+    vocab_path = tmp_path / "vocab.txt"
+    vocab_path.write_text("\n".join(["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]",
+                                      "who", "where", "lives", "in", "montreal", "anna"]))
+    BertTokenizer(str(vocab_path)).save_pretrained(model_dir)
+    torch.manual_seed(0)
+    BertForQuestionAnswering(BertConfig(
+        vocab_size=11, hidden_size=16, num_hidden_layers=2, num_attention_heads=4, intermediate_size=32
+    )).save_pretrained(model_dir)
+
+    examples = [('who lives in montreal', 'anna lives in montreal', 'anna'),
+                ('where lives anna', 'anna lives in montreal', 'montreal')]
+    happy = HappyBERT(model_dir)
+    happy.prune("qa", examples, output_dir=str(tmp_path / "pruned"), args={'head_fraction': 0.5})
+
+    # the pruned model is loaded instead of the default question answering model
+    pruned = HappyBERT(str(tmp_path / "pruned"))
+    pruned._get_question_answering()
+    assert pruned.qa.config.num_attention_heads == 4
+    assert sum(len(heads) for heads in pruned.qa.config.pruned_heads.values()) == 4
+    assert sum(layer.attention.self.num_attention_heads for layer in pruned.qa.bert.encoder.layer) == 4
@@ -32,3 +32,25 @@ def test_qa_multi():
         total_p = sum(answer.softmax for answer in computed_answers)
         # probabilties for answers_to_question() add up to 1 ish
         assert abs(total_p-1) < 0.01
+
+def test_qa_document():
+    document = happy_bert.prepare_context(PARAGRAPH)
+    questions = [question for question, _ in QA_PAIRS]
+    batched_answers = document.answers_to_questions(questions, k=10)
+    for question in questions:
+        document.add_question(question)
+    pending_answers = document.answer_pending(k=10)
+    assert document.pending_questions == []
+    for (question, expected_answer), answers, pending in zip(QA_PAIRS, batched_answers, pending_answers):
+        single_answers = happy_bert.answers_to_question(question, PARAGRAPH, k=10)
+        assert len(answers) == 10
+        assert answers[0].text.lower() == expected_answer.lower()
+        # batching with padding gives the same answers as one at a time
+        assert [answer.text for answer in answers] == [answer.text for answer in single_answers]
+        assert [answer.text for answer in pending] == [answer.text for answer in answers]
+
+def test_qa_cascade_stats_without_cascade():
+    stats = happy_bert.get_qa_cascade_stats()
+    assert stats["questions"] == 0
+    assert stats["escalation_rate"] == 0
+    assert stats["mean_seconds"] == 0
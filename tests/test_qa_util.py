@@ -2,7 +2,16 @@
 Contains tests for functions found within qa_util.py
 """
 
-from happytransformer.qa_util import biggest_sums, SumPair
+import torch
+
+from happytransformer.qa_util import (
+    biggest_sums,
+    SumPair,
+    top_k_spans,
+    top_span_probabilities,
+    qa_probabilities,
+    qa_spans_batch
+)
 
 def test_biggest_sums():
     """
@@ -23,3 +32,97 @@ def test_biggest_sums():
         for expected_pair, computed_pair in 
         zip(expected_pairs, computed_pairs)
     )
+
+def _brute_force_spans(start_logits, end_logits, k, max_answer_length=None):
+    """
+    Scores every valid span one at a time and sorts them
+    """
+    spans = [
+        (start_logits[start] + end_logits[end], start, end)
+        for start in range(len(start_logits))
+        for end in range(start, len(end_logits))
+        if max_answer_length is None or end - start < max_answer_length
+    ]
+    return sorted(spans, reverse=True)[:k]
+
+def test_top_k_spans():
+    """
+    Tests top_k_spans against a brute force search over all spans
+    """
+    torch.manual_seed(0)
+    batch_size, length, k = 4, 30, 20
+    start_logits = torch.randn(batch_size, length)
+    end_logits = torch.randn(batch_size, length)
+    lengths = [30, 25, 3, 1]
+    for max_answer_length in [None, 1, 5]:
+        scores, starts, ends = top_k_spans(
+            start_logits, end_logits, k,
+            max_answer_length=max_answer_length, lengths=lengths
+        )
+        for row, row_length in enumerate(lengths):
+            expected = _brute_force_spans(
+                start_logits[row][:row_length].tolist(),
+                end_logits[row][:row_length].tolist(),
+                k, max_answer_length
+            )
+            found = torch.isfinite(scores[row])
+            assert found.sum().item() == len(expected)
+            computed = zip(scores[row][found].tolist(), starts[row][found].tolist(), ends[row][found].tolist())
+            for (expected_score, expected_start, expected_end), (score, start, end) in zip(expected, computed):
+                assert abs(expected_score - score) < 1e-5
+                assert (expected_start, expected_end) == (start, end)
+
+def test_qa_probabilities():
+    """
+    Tests that qa_probabilities returns k valid spans that sum to 1
+    """
+    torch.manual_seed(1)
+    start_logits = torch.randn(50)
+    end_logits = torch.randn(50)
+    probabilities = qa_probabilities(start_logits, end_logits, 10, max_answer_length=8)
+    assert len(probabilities) == 10
+    assert all(0 <= p.end_idx - p.start_idx < 8 for p in probabilities)
+    assert abs(sum(p.probability for p in probabilities) - 1) < 1e-5
+    assert probabilities == sorted(probabilities, key=lambda p: p.probability, reverse=True)
+
+def test_top_span_probabilities():
+    """
+    Tests top_span_probabilities against the product of the start and end
+    softmaxes of the best brute force span
+    """
+    torch.manual_seed(2)
+    start_logits = torch.randn(3, 12)
+    end_logits = torch.randn(3, 12)
+    lengths = [12, 7, 1]
+    probabilities = top_span_probabilities(start_logits, end_logits, max_answer_length=4, lengths=lengths)
+    for row, row_length in enumerate(lengths):
+        start_softmax = torch.softmax(start_logits[row][:row_length], dim=0).tolist()
+        end_softmax = torch.softmax(end_logits[row][:row_length], dim=0).tolist()
+        expected = max(
+            start_softmax[start] * end_softmax[end]
+            for start in range(row_length)
+            for end in range(start, min(start + 4, row_length))
+        )
+        assert abs(probabilities[row] - expected) < 1e-5
+    # a single position is certain
+    assert abs(probabilities[2] - 1) < 1e-6
+
+def test_span_confidences():
+    """
+    Tests that the confidence of every span is the product of its start
+    and end softmaxes, and that the best span matches top_span_probabilities
+    """
+    torch.manual_seed(3)
+    start_logits = torch.randn(2, 10)
+    end_logits = torch.randn(2, 10)
+    lengths = [10, 4]
+    spans = qa_spans_batch(start_logits, end_logits, 20, max_answer_length=3, lengths=lengths)
+    for row, row_length in enumerate(lengths):
+        start_softmax = torch.softmax(start_logits[row][:row_length], dim=0).tolist()
+        end_softmax = torch.softmax(end_logits[row][:row_length], dim=0).tolist()
+        for span in spans[row]:
+            expected = start_softmax[span.start_idx] * end_softmax[span.end_idx]
+            assert abs(span.confidence - expected) < 1e-5
+    best = top_span_probabilities(start_logits, end_logits, max_answer_length=3, lengths=lengths)
+    for row_spans, probability in zip(spans, best):
+        assert abs(row_spans[0].confidence - probability) < 1e-5
@@ -1,3 +1,8 @@
+import json
+import os
+
+import numpy as np
+
 from happytransformer import HappyBERT
 
 happy = HappyBERT()
@@ -9,4 +14,119 @@ def test_sequence_runs():
     '''
     happy.init_sequence_classifier()
     happy.train_sequence_classifier('tests/test_sequence.csv')
-    happy.eval_sequence_classifier('tests/test_sequence.csv')
\ No newline at end of file
+    happy.eval_sequence_classifier('tests/test_sequence.csv')
+
+
+def test_predict_sequences():
+    '''
+    predict_sequences gives the same labels as test_sequence_classifier
+    '''
+    happy.init_sequence_classifier()
+    happy.train_sequence_classifier('tests/test_sequence.csv')
+    texts = ['I love dogs', 'This is terrible', 'What a great movie to watch']
+    probabilities = happy.predict_sequences(texts, batch_size=2)
+    assert probabilities.shape == (3, 2)
+    assert abs(probabilities.sum(axis=1) - 1).max() < 1e-5
+    assert probabilities.argmax(axis=1).tolist() == happy.test_sequence_classifier(texts)
+    assert happy.predict_sequences(texts, return_probabilities=False).tolist() == happy.test_sequence_classifier(texts)
+
+def test_gradient_accumulation():
+    '''
+    accumulated gradients still update the model
+    '''
+    happy.init_sequence_classifier()
+    happy.seq.args['gradient_accumulation_steps'] = 2
+    happy.seq.args['weight_decay'] = 0
+    before = happy.seq.model.classifier.weight.detach().clone()
+    happy.train_sequence_classifier('tests/test_sequence.csv')
+    assert not happy.seq.model.classifier.weight.detach().equal(before)
+
+def test_save_load_sequence_classifier(tmp_path):
+    '''
+    a saved classifier predicts the same after loading
+    '''
+    texts = ['I love dogs', 'This is terrible']
+    happy.init_sequence_classifier()
+    happy.train_sequence_classifier('tests/test_sequence.csv')
+    happy.save_sequence_classifier(str(tmp_path))
+    loaded = HappyBERT()
+    loaded.load_sequence_classifier(str(tmp_path))
+    assert abs(loaded.predict_sequences(texts) - happy.predict_sequences(texts)).max() < 1e-5
+
+def test_distributed_training():
+    '''
+    training with two processes updates the model
+    '''
+    happy.init_sequence_classifier()
+    before = happy.seq.model.classifier.weight.detach().clone()
+    happy.train_sequence_classifier('tests/test_sequence.csv', num_processes=2)
+    assert not happy.seq.model.classifier.weight.detach().equal(before)
+
+def test_distill_sequence_classifier():
+    '''
+    a distilled student replaces the teacher and is compared with it
+    '''
+    happy.init_sequence_classifier()
+    happy.train_sequence_classifier('tests/test_sequence.csv')
+    report = happy.distill_sequence_classifier({'num_hidden_layers': 2}, 'tests/test_sequence.csv',
+                                               eval_csv_path='tests/test_sequence.csv')
+    assert happy.seq.model.config.num_hidden_layers == 2
+    assert report['student']['parameters'] < report['teacher']['parameters']
+    assert report['speedup'] > 0
+    assert len(happy.test_sequence_classifier(['I love dogs', 'This is terrible'])) == 2
+
+def test_distill_checkpointed_teacher(tmp_path):
+    '''
+    a student doesn't resume from or overwrite the teacher's checkpoints
+    '''
+    teacher_dir = str(tmp_path / 'teacher')
+    happy.init_sequence_classifier()
+    happy.seq.args['checkpoint_dir'] = teacher_dir
+    happy.seq.args['checkpoint_steps'] = 1
+    happy.train_sequence_classifier('tests/test_sequence.csv')
+    happy.seq.args['resume_from'] = teacher_dir
+    teacher_checkpoints = sorted(os.listdir(teacher_dir))
+    assert teacher_checkpoints
+    happy.distill_sequence_classifier({'num_hidden_layers': 2}, 'tests/test_sequence.csv')
+    assert happy.seq.model.config.num_hidden_layers == 2
+    assert happy.seq.args['checkpoint_dir'] is None
+    assert happy.seq.args['resume_from'] is None
+    assert sorted(os.listdir(teacher_dir)) == teacher_checkpoints
+
+def test_frozen_encoder():
+    '''
+    with a frozen encoder only the classification head is trained
+    '''
+    happy.init_sequence_classifier()
+    happy.seq.args['freeze_encoder'] = True
+    encoder = happy.seq.model.bert.encoder.layer[0].output.dense.weight.detach().clone()
+    classifier = happy.seq.model.classifier.weight.detach().clone()
+    happy.train_sequence_classifier('tests/test_sequence.csv')
+    assert happy.seq.model.bert.encoder.layer[0].output.dense.weight.detach().equal(encoder)
+    assert not happy.seq.model.classifier.weight.detach().equal(classifier)
+
+def test_frozen_encoder_settings(tmp_path):
+    '''
+    a frozen encoder accumulates gradients and records telemetry
+    '''
+    telemetry_path = tmp_path / 'telemetry.jsonl'
+    happy.init_sequence_classifier()
+    happy.seq.args['freeze_encoder'] = True
+    happy.seq.args['gradient_accumulation_steps'] = 2
+    happy.seq.args['telemetry_path'] = str(telemetry_path)
+    happy.train_sequence_classifier('tests/test_sequence.csv', eval_csv_path='tests/test_sequence.csv')
+    events = [json.loads(line)['event'] for line in telemetry_path.read_text().splitlines()]
+    # one update per epoch, since the data fits in one batch
+    assert events.count('train_step') == happy.seq.args['num_epochs']
+    assert events.count('eval') == happy.seq.args['num_epochs']
+
+def test_test_output_path(tmp_path):
+    '''
+    predictions streamed to a file match the in-memory predictions
+    '''
+    happy.init_sequence_classifier()
+    happy.train_sequence_classifier('tests/test_sequence.csv')
+    texts = ['I love dogs', 'This is terrible', 'What a great day', 'I hate waiting']
+    output_path = str(tmp_path / 'predictions.npy')
+    assert happy.test_sequence_classifier(texts, output_path=output_path) is None
+    assert abs(np.load(output_path) - happy.predict_sequences(texts)).max() < 1e-5
@@ -0,0 +1,113 @@
+"""
+Tests for the StreamingCSVDataset found within streaming_dataset.py
+"""
+
+import torch
+from torch.utils.data import DataLoader
+from transformers import BertTokenizer
+
+from happytransformer.classifier_utils import featurize_texts
+from happytransformer.streaming_dataset import StreamingCSVDataset
+
+VOCAB = ["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]", "i", "love", "hate", "you", "dogs", "cats", "."]
+TEXTS = ["I love you.", "I hate cats", "dogs", "I love dogs and cats", "you", "cats hate dogs.", "I"]
+LABELS = ["1", "0", "1", "0", "1", "0", "1"]
+
+def _tokenizer(tmp_path):
+    vocab_path = tmp_path / "vocab.txt"
+    vocab_path.write_text("\n".join(VOCAB))
+    return BertTokenizer(str(vocab_path))
+
+def _write_csv(tmp_path, labelled=True):
+    csv_path = tmp_path / "data.csv"
+    rows = [
+        '{},"{}"'.format(label, text) if labelled else '"{}"'.format(text)
+        for text, label in zip(TEXTS, LABELS)
+    ]
+    csv_path.write_text("\n".join(rows) + "\n")
+    return str(csv_path)
+
+def test_streaming_dataset_examples(tmp_path):
+    """
+    Every row is yielded exactly once, with the same tokens as featurize_texts
+    """
+    tokenizer = _tokenizer(tmp_path)
+    dataset = StreamingCSVDataset(
+        _write_csv(tmp_path), tokenizer, ["0", "1"], 8, batch_size=2,
+        chunk_size=3, shuffle_buffer_size=2
+    )
+    expected = featurize_texts(TEXTS, LABELS, ["0", "1"], 8, tokenizer)
+    assert dataset.num_rows == len(TEXTS)
+    assert len(dataset) == 4
+    seen = []
+    for batch in dataset:
+        assert len(batch) <= 2
+        for index, input_ids, segment_ids, label in batch:
+            start, end = expected.offsets[index], expected.offsets[index + 1]
+            assert input_ids.tolist() == expected.input_ids[start:end].tolist()
+            assert segment_ids.tolist() == expected.segment_ids[start:end].tolist()
+            assert label == expected.label_ids[index]
+            seen.append(index)
+    assert sorted(seen) == list(range(len(TEXTS)))
+
+def test_streaming_dataset_order(tmp_path):
+    """
+    Without shuffling or grouping, test files are read in order
+    """
+    tokenizer = _tokenizer(tmp_path)
+    dataset = StreamingCSVDataset(
+        _write_csv(tmp_path, labelled=False), tokenizer, ["0", "1"], 8, batch_size=3,
+        labelled=False, shuffle=False, group_by_length=False, chunk_size=2
+    )
+    indices = [example[0] for batch in dataset for example in batch]
+    assert indices == list(range(len(TEXTS)))
+
+def test_streaming_dataset_start_row(tmp_path):
+    """
+    Rows before start_row are skipped, also inside a chunk
+    """
+    tokenizer = _tokenizer(tmp_path)
+    dataset = StreamingCSVDataset(
+        _write_csv(tmp_path, labelled=False), tokenizer, ["0", "1"], 8, batch_size=2,
+        labelled=False, shuffle=False, group_by_length=False, chunk_size=3, start_row=4
+    )
+    indices = [example[0] for batch in dataset for example in batch]
+    assert indices == [4, 5, 6]
+    assert len(dataset) == 2
+
+def test_streaming_dataset_blank_lines(tmp_path):
+    """
+    Blank lines are skipped when rows are counted, as they are when they are read
+    """
+    csv_path = tmp_path / "data.csv"
+    csv_path.write_text('1,"I love you."\n\n0,"I hate cats"\n\n')
+    dataset = StreamingCSVDataset(str(csv_path), _tokenizer(tmp_path), ["0", "1"], 8, batch_size=1)
+    assert dataset.num_rows == 2
+    assert len(dataset) == len(list(dataset)) == 2
+
+def test_streaming_dataset_workers(tmp_path):
+    """
+    The partial last batch of every worker is counted
+    """
+    dataset = StreamingCSVDataset(
+        _write_csv(tmp_path), _tokenizer(tmp_path), ["0", "1"], 8, batch_size=2,
+        chunk_size=3, num_workers=3
+    )
+    batches = list(DataLoader(dataset, batch_size=None, num_workers=3))
+    assert len(dataset) == len(batches) == 5
+
+def test_streaming_dataset_reshuffles(tmp_path):
+    """
+    Every epoch is shuffled differently, also without worker processes
+    """
+    torch.manual_seed(0)
+    dataset = StreamingCSVDataset(
+        _write_csv(tmp_path), _tokenizer(tmp_path), ["0", "1"], 8, batch_size=1,
+        group_by_length=False, num_workers=0
+    )
+    epochs = [
+        [example[0] for batch in DataLoader(dataset, batch_size=None, num_workers=0) for example in batch]
+        for _ in range(2)
+    ]
+    assert sorted(epochs[0]) == sorted(epochs[1]) == list(range(len(TEXTS)))
+    assert epochs[0] != epochs[1]
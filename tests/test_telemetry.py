@@ -0,0 +1,53 @@
+"""
+Tests for the telemetry found within telemetry.py
+"""
+
+import json
+
+import numpy as np
+import torch
+
+from happytransformer.telemetry import LoopTimer, Telemetry
+
+def _batches(count):
+    return [torch.tensor([[1, 1, 1, 0], [1, 1, 0, 0]]) for _ in range(count)]
+
+def test_loop_timer():
+    timer = LoopTimer()
+    for attention_mask in timer(_batches(3)):
+        timer.add_batch(attention_mask)
+    report = timer.report()
+    assert report["examples"] == 6
+    assert report["tokens"] == 15
+    assert report["seconds"] >= report["compute_seconds"] >= 0
+    assert 0 <= report["data_wait_fraction"] <= 1
+    timer.reset()
+    assert timer.report()["examples"] == 0
+
+def test_train_steps(tmp_path):
+    records = []
+    path = str(tmp_path / "telemetry.jsonl")
+    telemetry = Telemetry([records.append], jsonl_path=path, log_steps=2)
+    timer = telemetry.timer()
+    for step, attention_mask in enumerate(timer(_batches(5)), start=1):
+        timer.add_batch(attention_mask)
+        telemetry.train_step(step, timer, loss=float(step), learning_rate=0.1)
+    telemetry.emit("eval", {"accuracy": np.float64(0.5), "true_positive": np.int64(3)})
+    telemetry.close()
+
+    assert [record["event"] for record in records] == ["train_step", "train_step", "eval"]
+    assert [record["step"] for record in records[:2]] == [2, 4]
+    # the loss is averaged and the examples are counted since the last record
+    assert records[0]["loss"] == 1.5
+    assert records[1]["examples"] == 4
+    assert "peak_rss_mb" in records[0]
+    with open(path) as jsonl_file:
+        lines = [json.loads(line) for line in jsonl_file]
+    assert [line["event"] for line in lines] == ["train_step", "train_step", "eval"]
+    assert lines[2]["true_positive"] == 3
+
+def test_disabled():
+    telemetry = Telemetry()
+    assert not telemetry.enabled
+    telemetry.emit("eval", {"accuracy": 1.0})
+    telemetry.close()
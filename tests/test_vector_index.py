@@ -0,0 +1,62 @@
+"""
+Tests for the on-disk vector index found within vector_index.py
+"""
+
+import numpy as np
+import pytest
+
+from happytransformer.vector_index import VectorIndex, normalize
+
+def _vectors(count, dimension=16, seed=0):
+    return np.random.default_rng(seed).standard_normal((count, dimension)).astype(np.float32)
+
+def test_exact_search(tmp_path):
+    vectors = _vectors(1000)
+    index = VectorIndex(str(tmp_path / "index"), dimension=16, block_size=128)
+    assert index.add(vectors[:600]).tolist() == list(range(600))
+    assert index.add(vectors[600:]).tolist() == list(range(600, 1000))
+
+    queries = _vectors(5, seed=1)
+    scores, ids = index.search(queries, k=10)
+    expected = normalize(queries) @ normalize(vectors).T
+    assert ids.tolist() == np.argsort(-expected, axis=1)[:, :10].tolist()
+    assert np.allclose(scores, np.sort(expected, axis=1)[:, ::-1][:, :10], atol=1e-5)
+
+    # a vector is its own nearest neighbor, also after reopening the index
+    reopened = VectorIndex(str(tmp_path / "index"))
+    assert len(reopened) == 1000
+    assert reopened.search(vectors[42], k=1)[1].tolist() == [[42]]
+
+def test_float16(tmp_path):
+    vectors = _vectors(200)
+    index = VectorIndex(str(tmp_path / "index"), dimension=16, dtype="float16")
+    index.add(vectors)
+    assert index.vectors().dtype == np.float16
+    assert index.search(vectors[:20], k=1)[1][:, 0].tolist() == list(range(20))
+
+def test_ivf(tmp_path):
+    vectors = _vectors(2000)
+    index = VectorIndex(str(tmp_path / "index"), dimension=16, block_size=256)
+    index.add(vectors)
+    index.build_ivf(num_lists=20)
+    queries = _vectors(10, seed=1)
+    exact_scores, exact_ids = index.search(queries, k=5)
+    # probing every list is exact
+    assert index.search(queries, k=5, nprobe=20)[1].tolist() == exact_ids.tolist()
+    # with fewer lists, each query gets the nearest vectors of its own lists
+    ids = index.search(queries, k=5, nprobe=3)[1]
+    for query, row_ids in zip(normalize(queries), ids):
+        lists = np.argsort(-(index.centroids @ query))[:3]
+        members = np.concatenate([index.order[index.offsets[c]:index.offsets[c + 1]] for c in lists])
+        expected = members[np.argsort(-(normalize(vectors)[members] @ query))[:5]]
+        assert row_ids.tolist() == expected.tolist()
+    # vectors added after the IVF was built are still found
+    index.add(queries)
+    assert index.search(queries, k=1, nprobe=1)[1][:, 0].tolist() == list(range(2000, 2010))
+    assert VectorIndex(str(tmp_path / "index")).search(queries, k=1, nprobe=2)[1][:, 0].tolist() == \
+        list(range(2000, 2010))
+
+def test_ivf_empty_index(tmp_path):
+    index = VectorIndex(str(tmp_path / "index"), dimension=16)
+    with pytest.raises(ValueError):
+        index.build_ivf()